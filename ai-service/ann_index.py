@@ -0,0 +1,320 @@
+"""
+Approximate Nearest-Neighbour Indexes
+Candidate generators for very large face galleries; FaceGallery re-ranks
+their candidates exactly with the full float32 templates
+"""
+
+import math
+import threading
+from typing import Dict, List, Optional, Sequence
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class VectorIndex:
+    """
+    Interface for pluggable gallery indexes
+
+    Vectors passed in are already L2-normalized float32. An index only has
+    to return a superset of likely neighbours; exact scoring is done by the
+    gallery with the same cosine distance as _calculate_similarity.
+    """
+
+    name = "base"
+
+    @property
+    def trained(self) -> bool:
+        raise NotImplementedError
+
+    def prepare(self, vectors: np.ndarray, identity_ids: Sequence[str]):
+        """Train and load rows off to the side; returns a state for install()"""
+        raise NotImplementedError
+
+    def install(self, state) -> None:
+        """Atomically replace the live index with a prepared state"""
+        raise NotImplementedError
+
+    def train(self, vectors: np.ndarray, identity_ids: Sequence[str] = ()) -> None:
+        raise NotImplementedError
+
+    def add(self, identity_ids: Sequence[str], vectors: np.ndarray) -> None:
+        raise NotImplementedError
+
+    def remove(self, identity_id: str) -> bool:
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        """Drop all vectors but keep the trained structure"""
+        raise NotImplementedError
+
+    def reload(self, identity_ids: Sequence[str], vectors: np.ndarray) -> None:
+        """Atomically replace all vectors, keeping the trained structure"""
+        raise NotImplementedError
+
+    def candidates(self, probe: np.ndarray, count: int) -> List[str]:
+        raise NotImplementedError
+
+    def stats(self) -> Dict:
+        return {'index': self.name, 'trained': self.trained}
+
+
+class _InvertedList:
+    """Growable float16 vector block plus the identity of each row"""
+
+    __slots__ = ('vectors', 'ids')
+
+    def __init__(self, dimension: int):
+        self.vectors = np.zeros((8, dimension), dtype=np.float16)
+        self.ids: List[str] = []
+
+    def append(self, identity_id: str, vector: np.ndarray) -> int:
+        position = len(self.ids)
+        if position == self.vectors.shape[0]:
+            grown = np.zeros((position * 2, self.vectors.shape[1]), dtype=np.float16)
+            grown[:position] = self.vectors
+            self.vectors = grown
+        self.vectors[position] = vector
+        self.ids.append(identity_id)
+        return position
+
+    def pop_swap(self, position: int) -> Optional[str]:
+        """Remove a row by moving the last row into it; returns the moved ID"""
+        last = len(self.ids) - 1
+        moved = None
+        if position != last:
+            self.vectors[position] = self.vectors[last]
+            moved = self.ids[last]
+            self.ids[position] = moved
+        self.ids.pop()
+        return moved
+
+
+class _IVFState:
+    """Centroids plus the inverted lists filled against them"""
+
+    __slots__ = ('centroids', 'lists', 'where')
+
+    def __init__(self, centroids: np.ndarray, dimension: int):
+        self.centroids = centroids
+        self.lists = [_InvertedList(dimension) for _ in range(len(centroids))]
+        self.where: Dict[str, tuple] = {}
+
+    def add(self, identity_ids: Sequence[str], vectors: np.ndarray) -> None:
+        cells = np.argmax(vectors @ self.centroids.T, axis=1)
+        for identity_id, vector, cell in zip(identity_ids, vectors, cells):
+            if identity_id in self.where:
+                self.remove(identity_id)
+            position = self.lists[cell].append(identity_id, vector)
+            self.where[identity_id] = (int(cell), position)
+
+    def remove(self, identity_id: str) -> bool:
+        location = self.where.pop(identity_id, None)
+        if location is None:
+            return False
+        cell, position = location
+        moved = self.lists[cell].pop_swap(position)
+        if moved is not None:
+            self.where[moved] = (cell, position)
+        return True
+
+
+class IVFIndex(VectorIndex):
+    """
+    Inverted-file index over spherical k-means cells
+
+    Each template lives in the list of its nearest centroid, stored as
+    float16 to halve the memory scanned. A query scores the centroids,
+    scans the `n_probe` closest lists and returns the best-scoring IDs for
+    exact re-ranking. Adds and removes are incremental; retrain after the
+    gallery has grown a lot so cells stay balanced.
+
+    Training and reloading build the centroids and filled lists off to the
+    side and swap them in with a single assignment, so searches never see
+    a trained but empty index.
+    """
+
+    name = "ivf"
+
+    def __init__(
+        self,
+        dimension: int = 512,
+        n_lists: Optional[int] = None,
+        n_probe: int = 16,
+        train_iterations: int = 10,
+        max_train_samples_per_list: int = 64,
+        seed: int = 0
+    ):
+        """
+        Args:
+            dimension: Embedding dimension
+            n_lists: Number of cells; None picks ~4*sqrt(N) at each train
+            n_probe: Cells scanned per query (recall vs latency)
+            train_iterations: k-means iterations
+            max_train_samples_per_list: Training subsample size per cell
+            seed: Random seed for reproducible training
+        """
+        self.dimension = dimension
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.train_iterations = train_iterations
+        self.max_train_samples_per_list = max_train_samples_per_list
+        self.seed = seed
+        self._state: Optional[_IVFState] = None
+        self._lock = threading.RLock()
+
+    @property
+    def trained(self) -> bool:
+        return self._state is not None
+
+    @property
+    def centroids(self) -> Optional[np.ndarray]:
+        state = self._state
+        return state.centroids if state is not None else None
+
+    @property
+    def _trained_lists(self) -> int:
+        state = self._state
+        return len(state.centroids) if state is not None else 0
+
+    def __len__(self) -> int:
+        state = self._state
+        return len(state.where) if state is not None else 0
+
+    def _fit_centroids(self, vectors: np.ndarray) -> np.ndarray:
+        """Spherical k-means on a subsample; does not touch the live index"""
+        count = len(vectors)
+        n_lists = self.n_lists or int(min(4096, max(16, 4 * math.sqrt(count))))
+        n_lists = min(n_lists, count)
+        rng = np.random.default_rng(self.seed)
+
+        sample_size = min(count, n_lists * self.max_train_samples_per_list)
+        sample = vectors[rng.choice(count, size=sample_size, replace=False)].astype(np.float32)
+        centroids = sample[rng.choice(sample_size, size=n_lists, replace=False)].copy()
+
+        for _ in range(self.train_iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            empty = norms[:, 0] == 0
+            # Re-seed empty cells with random samples
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            norms[empty] = 1.0
+            centroids = sums / norms
+
+        logger.info(f"Trained IVF index with {n_lists} lists on {sample_size} samples")
+        return centroids.astype(np.float32)
+
+    def prepare(self, vectors: np.ndarray, identity_ids: Sequence[str]) -> _IVFState:
+        """
+        Train centroids and fill the lists without touching the live index
+
+        Raises:
+            ValueError: Empty gallery
+        """
+        if len(vectors) == 0:
+            raise ValueError("Cannot train an index on an empty gallery")
+        vectors = np.atleast_2d(vectors)
+        state = _IVFState(self._fit_centroids(vectors), self.dimension)
+        state.add(identity_ids, vectors)
+        return state
+
+    def install(self, state: _IVFState) -> None:
+        """Swap in a state built by prepare()"""
+        with self._lock:
+            self._state = state
+
+    def train(self, vectors: np.ndarray, identity_ids: Sequence[str] = ()) -> None:
+        """Learn cell centroids and load `identity_ids` rows in one swap"""
+        vectors = np.atleast_2d(vectors)
+        self.install(self.prepare(vectors, identity_ids))
+
+    def add(self, identity_ids: Sequence[str], vectors: np.ndarray) -> None:
+        if not self.trained:
+            raise RuntimeError("Index must be trained before adding vectors")
+        with self._lock:
+            self._state.add(identity_ids, np.atleast_2d(vectors))
+
+    def remove(self, identity_id: str) -> bool:
+        with self._lock:
+            if self._state is None:
+                return False
+            return self._state.remove(identity_id)
+
+    def reset(self) -> None:
+        with self._lock:
+            if self._state is not None:
+                self._state = _IVFState(self._state.centroids, self.dimension)
+
+    def reload(self, identity_ids: Sequence[str], vectors: np.ndarray) -> None:
+        """Replace the contents with these rows, keeping the trained centroids"""
+        state = self._state
+        if state is None:
+            return
+        fresh = _IVFState(state.centroids, self.dimension)
+        if len(identity_ids):
+            fresh.add(identity_ids, np.atleast_2d(vectors))
+        self.install(fresh)
+
+    def candidates(self, probe: np.ndarray, count: int, n_probe: Optional[int] = None) -> List[str]:
+        with self._lock:
+            state = self._state
+            n_probe = min(n_probe or self.n_probe, len(state.centroids))
+            cell_scores = state.centroids @ probe
+            cells = np.argpartition(-cell_scores, n_probe - 1)[:n_probe]
+
+            ids: List[str] = []
+            scores = []
+            for cell in cells:
+                inverted = state.lists[cell]
+                size = len(inverted.ids)
+                if size == 0:
+                    continue
+                scores.append(inverted.vectors[:size].astype(np.float32) @ probe)
+                ids.extend(inverted.ids)
+
+        if not ids:
+            return []
+
+        scores = np.concatenate(scores)
+        if len(ids) > count:
+            best = np.argpartition(-scores, count - 1)[:count]
+            return [ids[i] for i in best]
+        return ids
+
+    def stats(self) -> Dict:
+        with self._lock:
+            state = self._state
+            sizes = [len(inverted.ids) for inverted in state.lists] if state is not None else []
+            size = len(state.where) if state is not None else 0
+        return {
+            'index': self.name,
+            'trained': self.trained,
+            'n_lists': self._trained_lists,
+            'configured_n_lists': self.n_lists,
+            'n_probe': self.n_probe,
+            'size': size,
+            'max_list_size': max(sizes) if sizes else 0
+        }
+
+
+INDEX_TYPES = {
+    IVFIndex.name: IVFIndex
+}
+
+
+def create_index(name: str, dimension: int = 512, **params) -> Optional[VectorIndex]:
+    """
+    Build an index by name; "exact" means no index (full scan)
+
+    Raises:
+        ValueError: Unknown index name
+    """
+    if name in (None, "", "exact"):
+        return None
+    if name not in INDEX_TYPES:
+        raise ValueError(f"Unknown gallery index '{name}'. Options: exact, {', '.join(INDEX_TYPES)}")
+    return INDEX_TYPES[name](dimension=dimension, **params)
@@ -0,0 +1,244 @@
+"""
+Benchmark: face alignment latency and verification accuracy by alignment mode
+
+Compares, on faces found by the service's Haar detector:
+  legacy     crop -> resize -> eye cascade over the whole chip-sized crop
+             -> rotate -> letterbox (the previous alignment)
+  landmarks  eye cascade over the eye band only, then one similarity warp
+  yunet      YuNet landmarks on the face box, then one similarity warp
+             (only when the YuNet model is in models/)
+  none       one warp of the face box, no eye search
+
+The latency table covers alignment only. The agreement table reports the
+mean absolute pixel difference of each mode's chip from the legacy chip
+and the difference in eye angle, which need no model. The roll table
+rotates every face by known angles (--angles) about its box centre and
+reports how far each landmark source's eye angle is from the truth.
+
+With --identities (a directory with one sub-directory of face images per
+person), every chip is also embedded and verification accuracy at
+VERIFICATION_THRESHOLD is reported over all genuine and impostor pairs;
+this needs DeepFace and TensorFlow.
+
+Usage:
+    python benchmarks/bench_alignment.py path/to/faces/ --repeats 20
+    python benchmarks/bench_alignment.py --identities path/to/people/
+"""
+
+import argparse
+import itertools
+import math
+import os
+import time
+
+import cv2
+import numpy as np
+
+import bench_utils
+from face_detection import EYE_CASCADE
+from face_recognition_service import FaceRecognitionService
+
+
+def legacy_eyes(detector, image, region, target_size):
+    x, y, w, h = region['x'], region['y'], region['w'], region['h']
+    factor = min(target_size[0] / h, target_size[1] / w)
+    face = cv2.resize(image[y:y + h, x:x + w], (max(1, int(w * factor)), max(1, int(h * factor))),
+                      interpolation=cv2.INTER_AREA if factor < 1 else cv2.INTER_LINEAR)
+    eyes = detector._cascade(EYE_CASCADE).detectMultiScale(cv2.cvtColor(face, cv2.COLOR_BGR2GRAY), 1.1, 10)
+    return face, eyes
+
+
+def legacy_align(detector, image, region, target_size):
+    face, eyes = legacy_eyes(detector, image, region, target_size)
+    size = (face.shape[1], face.shape[0])
+    if len(eyes) >= 2:
+        largest = sorted(eyes, key=lambda eye: eye[2] * eye[3], reverse=True)[:2]
+        (lx, ly), (rx, ry) = sorted((ex + ew / 2, ey + eh / 2) for ex, ey, ew, eh in largest)
+        angle = math.degrees(math.atan2(ry - ly, rx - lx))
+        rotation = cv2.getRotationMatrix2D((size[0] / 2, size[1] / 2), angle, 1.0)
+        face = cv2.warpAffine(face, rotation, size)
+    chip = np.zeros(target_size + (3,), dtype=np.float32)
+    top, left = (target_size[0] - size[1]) // 2, (target_size[1] - size[0]) // 2
+    chip[top:top + size[1], left:left + size[0]] = face
+    chip *= 1.0 / 255
+    return chip
+
+
+def eye_angle(eyes):
+    if eyes is None:
+        return None
+    (lx, ly), (rx, ry) = eyes
+    return math.degrees(math.atan2(ry - ly, rx - lx))
+
+
+def landmark_sources(service):
+    sources = {'landmarks': service.face_detector}
+    yunet = service._native_detector("yunet")
+    if yunet.available():
+        sources['yunet'] = yunet
+    return sources
+
+
+def aligners(service):
+    detector = service.face_detector
+    size = service.MODEL_INPUT_SIZE
+    modes = {'legacy': lambda image, region: legacy_align(detector, image, region, size)}
+    for label, source in landmark_sources(service).items():
+        modes[label] = lambda image, region, source=source: detector.align(
+            image, region, size, source.find_eyes(image, region)
+        )
+    modes['none'] = lambda image, region: detector.align(image, region, size)
+    return modes
+
+
+def roll_recovery(service, faces, angles):
+    """Eye-angle error of each landmark source on faces rotated by known angles"""
+    rows = {}
+    for label, source in landmark_sources(service).items():
+        errors, samples, misses, attempts = [], [], 0, 0
+        for _, image, region in faces:
+            base = eye_angle(source.find_eyes(image, region))
+            centre = (region['x'] + region['w'] / 2, region['y'] + region['h'] / 2)
+            for angle in angles:
+                attempts += 1
+                rotation = cv2.getRotationMatrix2D(centre, angle, 1.0)
+                rotated = cv2.warpAffine(image, rotation, (image.shape[1], image.shape[0]))
+                start = time.perf_counter()
+                found = eye_angle(source.find_eyes(rotated, region))
+                samples.append((time.perf_counter() - start) * 1000)
+                if base is None or found is None:
+                    misses += 1
+                    continue
+                # A counter-clockwise image rotation lowers the eye-line angle
+                errors.append(abs(found - (base - angle)))
+        rows[label] = {
+            'find_eyes_ms': round(float(np.mean(samples)), 2) if samples else 'n/a',
+            'angle_mae': round(float(np.mean(errors)), 2) if errors else 'n/a',
+            'angle_max': round(float(np.max(errors)), 2) if errors else 'n/a',
+            'missed': f"{misses}/{attempts}"
+        }
+    return rows
+
+
+def detected_faces(service, paths):
+    """Decoded images with the single largest Haar face, skipping images without one"""
+    faces = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        detections = service.face_detector.detect(image, service.MIN_FACE_SIZE)
+        if detections:
+            region = max(detections, key=lambda d: d[0]['w'])[0]
+            faces.append((path, image, region))
+    return faces
+
+
+def image_paths(root):
+    return sorted(
+        os.path.join(folder, name)
+        for folder, _, names in os.walk(root)
+        for name in names if name.lower().endswith(bench_utils.IMAGE_EXTENSIONS)
+    )
+
+
+def latency_and_agreement(service, faces, repeats):
+    modes = aligners(service)
+    rows, agreement = {}, {}
+    for label, align in modes.items():
+        samples = []
+        for _ in range(repeats):
+            for _, image, region in faces:
+                start = time.perf_counter()
+                align(image, region)
+                samples.append((time.perf_counter() - start) * 1000)
+        rows[label] = bench_utils.summarize(samples)
+
+    detector = service.face_detector
+    sources = landmark_sources(service)
+    for label in [label for label in modes if label != 'legacy']:
+        pixel_diffs, angle_diffs = [], []
+        for _, image, region in faces:
+            legacy = modes['legacy'](image, region)
+            pixel_diffs.append(float(np.abs(modes[label](image, region) - legacy).mean()) * 255)
+
+            _, eyes = legacy_eyes(detector, image, region, service.MODEL_INPUT_SIZE)
+            if len(eyes) >= 2 and label in sources:
+                largest = sorted(eyes, key=lambda eye: eye[2] * eye[3], reverse=True)[:2]
+                old = eye_angle(sorted((ex + ew / 2, ey + eh / 2) for ex, ey, ew, eh in largest))
+                new = eye_angle(sources[label].find_eyes(image, region))
+                if new is not None:
+                    angle_diffs.append(abs(new - old))
+        agreement[label] = {
+            'pixel_mae': round(float(np.mean(pixel_diffs)), 2),
+            'angle_mae': round(float(np.mean(angle_diffs)), 2) if angle_diffs else 'n/a',
+            'angles': len(angle_diffs)
+        }
+    return rows, agreement
+
+
+def verification_accuracy(service, root):
+    people = {
+        name: detected_faces(service, image_paths(os.path.join(root, name)))
+        for name in sorted(os.listdir(root)) if os.path.isdir(os.path.join(root, name))
+    }
+    rows = {}
+    for label, align in aligners(service).items():
+        embeddings = [
+            (person, np.asarray(service._generate_embedding(align(image, region))))
+            for person, faces in people.items() for _, image, region in faces
+        ]
+        correct = genuine = impostor = false_accepts = false_rejects = 0
+        for (a, ea), (b, eb) in itertools.combinations(embeddings, 2):
+            match = service._calculate_similarity(ea, eb) <= service.VERIFICATION_THRESHOLD
+            if a == b:
+                genuine += 1
+                false_rejects += not match
+            else:
+                impostor += 1
+                false_accepts += match
+            correct += match == (a == b)
+        pairs = genuine + impostor
+        rows[label] = {
+            'pairs': pairs,
+            'accuracy': round(correct / pairs, 4) if pairs else 0.0,
+            'FRR': round(false_rejects / genuine, 4) if genuine else 0.0,
+            'FAR': round(false_accepts / impostor, 4) if impostor else 0.0
+        }
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*', help="Face images or directories")
+    parser.add_argument('--identities', help="Directory with one sub-directory of images per person")
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--angles', default="-20,-10,-5,5,10,20", help="Known rotations in degrees")
+    args = parser.parse_args()
+
+    service = FaceRecognitionService()
+    paths = []
+    for path in args.images or ([args.identities] if args.identities else []):
+        paths.extend(image_paths(path) if os.path.isdir(path) else [path])
+    faces = detected_faces(service, paths)
+    if not faces:
+        raise SystemExit("No faces found. Pass face images or directories.")
+
+    rows, agreement = latency_and_agreement(service, faces, args.repeats)
+    bench_utils.print_table(f"Alignment latency per face (ms), {len(faces)} faces x {args.repeats}", rows)
+    bench_utils.print_table("Agreement with legacy alignment (pixel MAE in grey levels, eye angle MAE in degrees)", agreement)
+    angles = [float(angle) for angle in args.angles.split(",") if angle.strip()]
+    bench_utils.print_table(
+        f"Roll recovery over {len(faces)} faces x {len(angles)} rotations (degrees)",
+        roll_recovery(service, faces, angles)
+    )
+
+    if args.identities:
+        bench_utils.print_table(
+            f"Verification at threshold {service.VERIFICATION_THRESHOLD}",
+            verification_accuracy(service, args.identities)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark: recall@k vs latency of the IVF gallery index against exact search
+
+Synthetic templates are drawn around identity clusters (so the data has
+structure like real face embeddings) and each probe is a noisy copy of an
+enrolled template. Recall@k is the fraction of the exact top-k that the
+indexed search also returns; both use the same cosine distance.
+
+Usage:
+    python benchmarks/bench_ann.py --size 300000 --n-probe 4 8 16 32 64 --top-k 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import bench_utils
+from ann_index import IVFIndex
+from face_gallery import FaceGallery
+
+
+def synthetic_templates(rng, size, clusters=2000, spread=0.6):
+    centers = rng.standard_normal((clusters, 512)).astype(np.float32)
+    assignment = rng.integers(0, clusters, size=size)
+    return centers[assignment] + spread * rng.standard_normal((size, 512)).astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=300000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--n-lists', type=int, default=None)
+    parser.add_argument('--n-probe', type=int, nargs='+', default=[4, 8, 16, 32, 64])
+    parser.add_argument('--probe-noise', type=float, default=0.3)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    templates = synthetic_templates(rng, args.size)
+    
+    exact = FaceGallery(dimension=512, initial_capacity=args.size)
+    indexed = FaceGallery(dimension=512, initial_capacity=args.size, index=IVFIndex(n_lists=args.n_lists))
+    for i, template in enumerate(templates):
+        exact.add(f"user-{i}", template)
+        indexed.add(f"user-{i}", template)
+    
+    start = time.perf_counter()
+    indexed.build_index()
+    print(f"Index build: {time.perf_counter() - start:.1f}s, {indexed.stats()['index']}")
+    
+    targets = rng.integers(0, args.size, size=args.queries)
+    probes = templates[targets] + args.probe_noise * rng.standard_normal((args.queries, 512)).astype(np.float32)
+    
+    exact_results, exact_ms = [], []
+    for probe in probes:
+        start = time.perf_counter()
+        exact_results.append({identity for identity, _ in exact.search(probe, args.top_k)})
+        exact_ms.append((time.perf_counter() - start) * 1000)
+    
+    rows = {'exact': {**bench_utils.summarize(exact_ms), 'recall': 1.0}}
+    for n_probe in args.n_probe:
+        indexed.index.n_probe = n_probe
+        latencies, hits = [], 0
+        for probe, expected in zip(probes, exact_results):
+            start = time.perf_counter()
+            found = {identity for identity, _ in indexed.search(probe, args.top_k)}
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(found & expected)
+        recall = hits / (len(probes) * args.top_k)
+        rows[f"ivf n_probe={n_probe}"] = {**bench_utils.summarize(latencies), 'recall': round(recall, 4)}
+    
+    bench_utils.print_table(f"Recall@{args.top_k} vs latency (ms), {args.size} identities", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: micro-batched Facenet512 embeddings under concurrent load
+
+Simulates a burst of concurrent /verify calls, each embedding one aligned
+chip, and reports throughput and per-request latency for every combination
+of max batch size and max wait. Batch size 1 is the unbatched baseline.
+
+Usage:
+    python benchmarks/bench_batching.py --concurrency 16 --requests 512 \\
+        --batch-sizes 1 4 8 16 --max-waits 2 5 10
+"""
+
+import argparse
+import threading
+import time
+
+import numpy as np
+
+import bench_utils
+from embedding_batcher import EmbeddingBatcher
+from face_recognition_service import FaceRecognitionService
+
+
+def run_load(embed, chips, concurrency):
+    """Fire len(chips) embed calls from `concurrency` threads"""
+    latencies = []
+    lock = threading.Lock()
+    next_index = [0]
+    
+    def worker():
+        while True:
+            with lock:
+                index = next_index[0]
+                next_index[0] += 1
+            if index >= len(chips):
+                return
+            start = time.perf_counter()
+            embed(chips[index])
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+    
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=512)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--max-waits', type=float, nargs='+', default=[2.0, 5.0, 10.0])
+    args = parser.parse_args()
+    
+    service = FaceRecognitionService()
+    height, width = service.MODEL_INPUT_SIZE
+    rng = np.random.default_rng(0)
+    chips = rng.random((args.requests, height, width, 3), dtype=np.float32)
+    
+    # Build the model outside the measured region
+    service._embed_batch(chips[:1])
+    
+    rows = {}
+    throughput = {}
+    for batch_size in args.batch_sizes:
+        for max_wait in (args.max_waits if batch_size > 1 else [0.0]):
+            if batch_size == 1:
+                # Unbatched baseline: every request runs its own forward pass
+                lock = threading.Lock()
+                
+                def embed(chip):
+                    with lock:
+                        return service._embed_batch(chip[np.newaxis])[0]
+                latencies, elapsed = run_load(embed, chips, args.concurrency)
+                label = "unbatched"
+            else:
+                batcher = EmbeddingBatcher(service._embed_batch, batch_size, max_wait)
+                latencies, elapsed = run_load(batcher.embed, chips, args.concurrency)
+                batcher.close()
+                label = f"batch<={batch_size} wait={max_wait:g}ms"
+                stats = batcher.stats()
+                print(
+                    f"{label}: mean batch {stats['batch_size']['mean']}, "
+                    f"queue delay p99 {stats['queue_delay_ms']['p99']}ms"
+                )
+            rows[label] = bench_utils.summarize(latencies)
+            throughput[label] = len(chips) / elapsed
+    
+    bench_utils.print_table(
+        f"Per-request embed latency (ms), concurrency {args.concurrency}, {args.requests} requests",
+        rows
+    )
+    for label, value in throughput.items():
+        print(f"{label.ljust(32)} {value:8.1f} embeddings/s")
+
+
+if __name__ == "__main__":
+    main()
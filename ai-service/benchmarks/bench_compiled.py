@@ -0,0 +1,95 @@
+"""
+Benchmark: per-call overhead of the ways to run Facenet512 on one chip
+
+  represent   DeepFace.represent(detector_backend="skip"), the default path
+  predict     model.predict on the held model
+  call        model(chips, training=False), eager
+  compiled    KerasEmbedder, a tf.function traced for the chip shape
+  xla         KerasEmbedder with XLA compilation
+
+All run the same forward pass on the same chips, so the difference from
+`compiled` is call overhead. The table also gives the largest cosine
+distance of each path's embeddings from represent's.
+
+Needs DeepFace and TensorFlow.
+
+Usage:
+    python benchmarks/bench_compiled.py --calls 200
+    python benchmarks/bench_compiled.py --calls 200 --batch-sizes 1 4 8
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import bench_utils
+from embedding_engines import KerasEmbedder, cosine_distances
+from face_recognition_service import FaceRecognitionService, get_deepface
+
+
+def paths(batch_size):
+    DeepFace = get_deepface()
+    name = FaceRecognitionService.MODEL_NAME
+    size = FaceRecognitionService.MODEL_INPUT_SIZE
+    model = DeepFace.build_model(name)
+
+    def represent(chips):
+        return np.array([
+            DeepFace.represent(
+                img_path=chip, model_name=name, detector_backend="skip", enforce_detection=False, align=False
+            )[0]['embedding']
+            for chip in chips
+        ])
+
+    compiled = KerasEmbedder(lambda: model, size, batch_sizes=(batch_size,))
+    xla = KerasEmbedder(lambda: model, size, batch_sizes=(batch_size,), jit_compile=True)
+    return {
+        'represent': represent,
+        'predict': lambda chips: model.predict(chips, verbose=0),
+        'call': lambda chips: model(chips, training=False).numpy(),
+        'compiled': compiled.embed,
+        'xla': xla.embed
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=200, help="Timed calls per path and batch size")
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1])
+    args = parser.parse_args()
+
+    height, width = FaceRecognitionService.MODEL_INPUT_SIZE
+    for batch_size in args.batch_sizes:
+        chips = np.random.default_rng(0).random((batch_size, height, width, 3), dtype=np.float32)
+        runners = paths(batch_size)
+        reference = runners['represent'](chips)
+
+        rows = {}
+        for label, run in runners.items():
+            # First call builds, traces or compiles; keep it out of the samples
+            start = time.perf_counter()
+            embeddings = run(chips)
+            first_ms = (time.perf_counter() - start) * 1000
+            samples = []
+            for _ in range(args.calls):
+                start = time.perf_counter()
+                run(chips)
+                samples.append((time.perf_counter() - start) * 1000)
+            row = bench_utils.summarize(samples)
+            del row['count']
+            row['first_ms'] = round(first_ms, 1)
+            row['max_dist'] = float(f"{cosine_distances(reference, np.asarray(embeddings)).max():.2e}")
+            rows[label] = row
+
+        baseline = rows['compiled']['p50']
+        for row in rows.values():
+            row['overhead'] = round(row['p50'] - baseline, 3)
+        bench_utils.print_table(
+            f"Facenet512 per call (ms), batch {batch_size}, {args.calls} calls; overhead is p50 minus compiled",
+            rows
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Benchmark: image decode latency and allocations per request
+
+Compares the previous PIL -> np.array -> cvtColor path with
+cv2.imdecode straight to BGR at full size, and with the pipeline's
+decode stage (header validation, then DCT-reduced decoding of oversized
+JPEGs; see _decode_scale). Peak traced
+memory comes from tracemalloc, which sees NumPy and OpenCV
+output buffers but not PIL's internal image, so the legacy figure is a
+lower bound. Allocations are measured in a separate pass so tracing
+does not inflate the latency numbers.
+
+Without image arguments, synthetic JPEG frames are used: webcam sizes
+(1280x720 matches the frontend Camera.tsx capture), 4K, and a 12 MP
+phone photo.
+
+Usage:
+    python benchmarks/bench_decode.py [path/to/faces/] --repeats 50
+"""
+
+import argparse
+import time
+import tracemalloc
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import bench_utils
+from face_recognition_service import FaceRecognitionService
+
+SYNTHETIC_SIZES = {
+    '720p': (720, 1280),
+    '1080p': (1080, 1920),
+    '4K': (2160, 3840),
+    '12MP': (3024, 4032)
+}
+
+
+def legacy_decode(image_data):
+    pil_image = Image.open(BytesIO(image_data))
+    if pil_image.mode != 'RGB':
+        pil_image = pil_image.convert('RGB')
+    img_array = np.array(pil_image)
+    return cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+
+
+def pipeline_decode(service):
+    def decode(image_data):
+        width, height, image_format = service._read_image_header(image_data)
+        service._validate_dimensions(width, height)
+        return service._load_image_from_bytes(image_data, service._decode_scale(width, height, image_format))
+    return decode
+
+
+def synthetic_jpeg(height, width):
+    rng = np.random.default_rng(0)
+    # Smooth noise compresses like a photo rather than like static
+    small = rng.integers(0, 255, size=(height // 16, width // 16, 3), dtype=np.uint8)
+    frame = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    _, encoded = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+
+def measure(decode, image_data, repeats):
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        decode(image_data)
+        samples.append((time.perf_counter() - start) * 1000)
+    summary = bench_utils.summarize(samples)
+
+    tracemalloc.start()
+    decode(image_data)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # Relative to a full-size frame, so reduced decodes show below 1
+    frame_bytes = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), cv2.IMREAD_COLOR).nbytes
+    summary['peak_mb'] = round(peak / 2**20, 2)
+    summary['frames'] = round(peak / frame_bytes, 2)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*', help="Image files or directories (default: synthetic frames)")
+    parser.add_argument('--repeats', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.images:
+        inputs = {f"image {i}": data for i, data in enumerate(bench_utils.load_image_files(args.images)[:5])}
+    else:
+        inputs = {name: synthetic_jpeg(*size) for name, size in SYNTHETIC_SIZES.items()}
+
+    service = FaceRecognitionService()
+    rows = {}
+    for name, image_data in inputs.items():
+        rows[f"{name} legacy PIL"] = measure(legacy_decode, image_data, args.repeats)
+        rows[f"{name} imdecode"] = measure(service._load_image_from_bytes, image_data, args.repeats)
+        rows[f"{name} header+reduced"] = measure(pipeline_decode(service), image_data, args.repeats)
+
+    bench_utils.print_table("Decode per request (ms; peak traced memory in MB and in decoded frames)", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark: face detection latency by input resolution
+
+Compares a full-resolution Haar scan with DeepFace's opencv-backend
+parameters (what extract_faces did) against HaarFaceDetector, which
+scans a working copy downscaled for MIN_FACE_SIZE with a minimum window,
+and with the same detector limited to a centred ROI hint (the camera's
+face guide) widened by ROI_MARGIN.
+Each input is letterboxed onto 720p, 1080p and 4K canvases with the face
+image filling the canvas height.
+
+Without image arguments a synthetic textured frame is used, which gives
+the no-face cost (the cascade has to scan every window).
+
+Usage:
+    python benchmarks/bench_detection.py [path/to/faces/] --repeats 5
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import bench_utils
+from face_detection import CASCADE_DIR, FACE_CASCADE, roi_region
+from face_recognition_service import FaceRecognitionService
+
+RESOLUTIONS = {'720p': (720, 1280), '1080p': (1080, 1920), '4K': (2160, 3840)}
+# Normalized x, y, w, h of the frontend face guide (200x260 CSS px) in a
+# 480x360 preview of a 1280x720 capture
+GUIDE_ROI = (0.34, 0.14, 0.31, 0.72)
+
+
+def letterbox(image, height, width):
+    scale = min(height / image.shape[0], width / image.shape[1])
+    resized = cv2.resize(image, (int(image.shape[1] * scale), int(image.shape[0] * scale)))
+    canvas = np.full((height, width, 3), 90, dtype=np.uint8)
+    top = (height - resized.shape[0]) // 2
+    left = (width - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return canvas
+
+
+def synthetic_frame():
+    rng = np.random.default_rng(0)
+    small = rng.integers(0, 255, size=(45, 80, 3), dtype=np.uint8)
+    return cv2.resize(small, (1280, 720), interpolation=cv2.INTER_CUBIC)
+
+
+def time_calls(fn, repeats):
+    samples, found = [], 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        found = len(fn())
+        samples.append((time.perf_counter() - start) * 1000)
+    summary = bench_utils.summarize(samples)
+    summary['faces'] = found
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='*', help="Face images or directories (default: synthetic frame)")
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    if args.images:
+        sources = [
+            cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            for data in bench_utils.load_image_files(args.images)[:3]
+        ]
+    else:
+        sources = [synthetic_frame()]
+
+    service = FaceRecognitionService()
+    cascade = cv2.CascadeClassifier(CASCADE_DIR + '/' + FACE_CASCADE)
+    rows = {}
+
+    for name, (height, width) in RESOLUTIONS.items():
+        for index, source in enumerate(sources):
+            frame = letterbox(source, height, width)
+            label = f"{name} #{index}"
+            rows[f"{label} full-res"] = time_calls(
+                lambda: cascade.detectMultiScale3(frame, 1.1, 10, outputRejectLevels=True)[0],
+                args.repeats
+            )
+            rows[f"{label} working"] = time_calls(
+                lambda: service.face_detector.detect(frame, service.MIN_FACE_SIZE),
+                args.repeats
+            )
+            region = roi_region(GUIDE_ROI, frame.shape, service.ROI_MARGIN)
+            rows[f"{label} working+roi"] = time_calls(
+                lambda: service._find_faces(frame, 1, region),
+                args.repeats
+            )
+
+    bench_utils.print_table(
+        f"Haar detection (ms), MIN_FACE_SIZE={service.MIN_FACE_SIZE}px", rows
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark: detector backends by latency, miss rate and false positives
+
+Runs every requested backend through the service's detection path
+(FaceRecognitionService._find_faces with the >0.9 confidence filter) over
+a local image set and reports latency percentiles per image and accuracy:
+
+  miss_rate   share of face images where no face was found
+  fp/image    extra detections per face image (every image is expected
+              to hold exactly one face), plus every detection on the
+              --negatives images, per image
+  neg_fp      share of --negatives images with any detection
+
+Backends whose model files or packages are missing are listed as
+unavailable. With --max-miss-rate and --max-fp the fastest backend (by
+p95) meeting both is printed.
+
+Native backends read the LBP cascade and YuNet model from --model-dir
+(default: face_detection.MODEL_DIR); DeepFace backends need DeepFace and
+TensorFlow, and download their weights on first use.
+
+Usage:
+    python benchmarks/bench_detectors.py path/to/faces/ --negatives path/to/no-faces/
+    python benchmarks/bench_detectors.py path/to/faces/ --backends opencv lbp yunet --max-miss-rate 0.02
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+import bench_utils
+from face_detection import DETECTOR_BACKENDS, MODEL_DIR, NATIVE_DETECTORS
+from face_recognition_service import FaceRecognitionService
+
+
+def decode_all(paths):
+    images = []
+    for data in bench_utils.load_image_files(paths):
+        image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is not None:
+            images.append(image)
+    return images
+
+
+def detect(service, backend, image):
+    return service._confident_faces(service._find_faces(image, detector=backend))
+
+
+def profile(service, backend, faces, negatives, repeats):
+    # First call loads the model; keep it out of the latency samples
+    start = time.perf_counter()
+    detect(service, backend, faces[0])
+    load_ms = (time.perf_counter() - start) * 1000
+
+    samples, misses, extra, negative_hits, negative_fps = [], 0, 0, 0, 0
+    for repeat in range(repeats):
+        for image in faces:
+            start = time.perf_counter()
+            found = len(detect(service, backend, image))
+            samples.append((time.perf_counter() - start) * 1000)
+            if repeat == 0:
+                misses += found == 0
+                extra += max(0, found - 1)
+        for image in negatives:
+            start = time.perf_counter()
+            found = len(detect(service, backend, image))
+            samples.append((time.perf_counter() - start) * 1000)
+            if repeat == 0:
+                negative_hits += found > 0
+                negative_fps += found
+
+    row = bench_utils.summarize(samples)
+    del row['count']
+    row['load_ms'] = round(load_ms, 1)
+    row['miss_rate'] = round(misses / len(faces), 4)
+    row['fp/image'] = round((extra + negative_fps) / (len(faces) + len(negatives)), 4)
+    row['neg_fp'] = round(negative_hits / len(negatives), 4) if negatives else 'n/a'
+    return row
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+', help="Face images or directories (one face per image)")
+    parser.add_argument('--negatives', nargs='*', default=[], help="Images or directories without faces")
+    parser.add_argument('--backends', nargs='+', default=list(NATIVE_DETECTORS), choices=DETECTOR_BACKENDS)
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--repeats', type=int, default=3, help="Passes over the image set")
+    parser.add_argument('--max-miss-rate', type=float, help="Accuracy bar for the recommendation")
+    parser.add_argument('--max-fp', type=float, default=float('inf'), help="Largest fp/image allowed")
+    args = parser.parse_args()
+
+    faces = decode_all(args.images)
+    negatives = decode_all(args.negatives) if args.negatives else []
+    service = FaceRecognitionService(detector_model_dir=args.model_dir)
+
+    rows, unavailable = {}, {}
+    for backend in args.backends:
+        try:
+            rows[backend] = profile(service, backend, faces, negatives, args.repeats)
+        except Exception as e:
+            unavailable[backend] = {'reason': f"{type(e).__name__}: {str(e)[:120]}"}
+
+    bench_utils.print_table(
+        f"Detector backends (ms per image), {len(faces)} face + {len(negatives)} negative images "
+        f"x {args.repeats}, MIN_FACE_SIZE={service.MIN_FACE_SIZE}px",
+        rows
+    )
+    for backend, info in unavailable.items():
+        print(f"{backend}: unavailable ({info['reason']})")
+
+    if args.max_miss_rate is not None:
+        eligible = [
+            backend for backend, row in rows.items()
+            if row['miss_rate'] <= args.max_miss_rate and row['fp/image'] <= args.max_fp
+        ]
+        if eligible:
+            best = min(eligible, key=lambda backend: rows[backend]['p95'])
+            print(f"Fastest backend within the accuracy bar: {best} (p95 {rows[best]['p95']} ms)")
+        else:
+            print("No backend meets the accuracy bar")
+
+
+if __name__ == "__main__":
+    main()
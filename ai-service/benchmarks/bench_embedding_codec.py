@@ -0,0 +1,90 @@
+"""
+Benchmark: embedding transport encodings
+
+Compares what /verify does with the incoming stored_embedding and what
+/enroll does with the outgoing one, per encoding:
+
+    json    json.dumps / json.loads of 512 floats, plus the pydantic
+            List[float] validation of EnrollmentResponse
+    base64  encode_embedding_base64 / decode_embedding_field
+    binary  encode_embedding / decode_embedding (raw multipart part)
+
+Usage:
+    python benchmarks/bench_embedding_codec.py --iterations 5000
+"""
+
+import argparse
+import json
+import time
+from typing import List, Optional
+
+import numpy as np
+from pydantic import BaseModel
+
+import bench_utils
+from embedding_codec import (
+    encode_embedding,
+    decode_embedding,
+    encode_embedding_base64,
+    decode_embedding_field
+)
+
+
+class EmbeddingBody(BaseModel):
+    # Same field type as EnrollmentResponse.embedding
+    embedding: Optional[List[float]] = None
+
+
+def time_calls(fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=5000)
+    parser.add_argument('--dimension', type=int, default=512)
+    args = parser.parse_args()
+
+    embedding = np.random.default_rng(0).standard_normal(args.dimension).astype(np.float32)
+    as_list = embedding.astype(np.float64).tolist()
+
+    json_text = json.dumps(as_list)
+    base64_text = encode_embedding_base64(embedding)
+    binary = encode_embedding(embedding)
+
+    cases = {
+        'json': (
+            lambda: EmbeddingBody(embedding=as_list).model_dump_json(),
+            lambda: json.loads(json_text),
+            len(json_text)
+        ),
+        'base64': (
+            lambda: encode_embedding_base64(embedding),
+            lambda: decode_embedding_field(base64_text, args.dimension),
+            len(base64_text)
+        ),
+        'binary': (
+            lambda: encode_embedding(embedding),
+            lambda: decode_embedding(binary, args.dimension),
+            len(binary)
+        )
+    }
+
+    serialize, parse, sizes = {}, {}, {}
+    for name, (encode, decode, size) in cases.items():
+        serialize[name] = bench_utils.summarize(time_calls(encode, args.iterations))
+        parse[name] = bench_utils.summarize(time_calls(decode, args.iterations))
+        sizes[name] = {'bytes': size, 'vs_json': round(size / len(json_text), 3)}
+
+    bench_utils.print_table("Serialize (us)", serialize)
+    bench_utils.print_table("Parse (us)", parse)
+    bench_utils.print_table(f"Payload size, {args.dimension} dims", sizes)
+
+
+if __name__ == "__main__":
+    main()
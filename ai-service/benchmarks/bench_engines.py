@@ -0,0 +1,155 @@
+"""
+Benchmark: embedding engines by cold start, memory and per-request latency
+
+Each engine runs in a fresh interpreter, as a worker would start:
+
+  cold_ms     process spawn -> imports -> FaceRecognitionService -> warmup()
+  import_ms   importing the service (TensorFlow is never imported here)
+  warmup_ms   FaceRecognitionService.warmup() (model load + dummy inference;
+              for deepface this includes importing and patching TensorFlow)
+  rss_mb      resident memory after warmup
+  peak_mb     peak resident memory
+  tf          whether TensorFlow ended up imported
+
+followed by enroll_face latency percentiles over the given face images.
+Each engine uses its default detector unless --detector is given.
+
+The opencv-dnn and onnxruntime engines need models/facenet512.onnx (see
+export_onnx.py; onnxruntime converts it itself if TensorFlow is around)
+and, with their default detector, the YuNet model; the deepface engine
+needs TensorFlow. Engines that cannot start are listed as unavailable.
+ONNX Runtime threads and graph optimization are read from the ORT_*
+environment variables, the precision from EMBEDDING_PRECISION and the
+deepface engine's COMPILED_INFERENCE mode and MODEL_STORE, as in the
+service.
+
+Usage:
+    python benchmarks/bench_engines.py path/to/faces/ --repeats 5
+    python benchmarks/bench_engines.py path/to/faces/ --engines deepface opencv-dnn --detector opencv
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+import bench_utils
+from embedding_engines import ENGINES
+
+
+def rss_mb() -> float:
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return round(int(line.split()[1]) / 1024, 1)
+    return 0.0
+
+
+def child(engine, detector, paths, repeats):
+    """Runs in the spawned interpreter; reports one JSON line"""
+    start = time.perf_counter()
+    from face_recognition_service import FaceRecognitionService, FaceNotDetectedException, LowQualityImageException
+    import_ms = (time.perf_counter() - start) * 1000
+
+    engine_options = None
+    if engine == "onnxruntime":
+        engine_options = {
+            'intra_op_threads': int(os.getenv("ORT_INTRA_OP_THREADS", "0")),
+            'inter_op_threads': int(os.getenv("ORT_INTER_OP_THREADS", "0")),
+            'graph_optimization': os.getenv("ORT_GRAPH_OPTIMIZATION", "all")
+        }
+    service = FaceRecognitionService(
+        engine=engine,
+        detector_backend=detector,
+        engine_options=engine_options,
+        precision=os.getenv("EMBEDDING_PRECISION", "fp32"),
+        compiled_inference=os.getenv("COMPILED_INFERENCE", "off") if engine == "deepface" else "off",
+        model_store=os.getenv("MODEL_STORE", "true").lower() in ("1", "true", "yes")
+    )
+    warmup_ms = service.warmup()
+    print("ready", flush=True)
+
+    report = {
+        'import_ms': round(import_ms, 1),
+        'warmup_ms': round(warmup_ms, 1),
+        'rss_mb': rss_mb(),
+        'tf': 'tensorflow' in sys.modules
+    }
+
+    images = bench_utils.load_image_files(paths)
+    samples, rejected = [], 0
+    for _ in range(repeats):
+        for data in images:
+            begin = time.perf_counter()
+            try:
+                service.enroll_face(data)
+            except (FaceNotDetectedException, LowQualityImageException):
+                rejected += 1
+            samples.append((time.perf_counter() - begin) * 1000)
+
+    report['peak_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    report['latency'] = bench_utils.summarize(samples)
+    report['rejected'] = rejected
+    print(json.dumps(report), flush=True)
+
+
+def run_engine(engine, detector, paths, repeats):
+    command = [sys.executable, os.path.abspath(__file__), '--child', engine, '--repeats', str(repeats)]
+    if detector:
+        command += ['--detector', detector]
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command + list(paths), stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    cold_ms = None
+    report = None
+    for line in process.stdout:
+        if line.strip() == "ready" and cold_ms is None:
+            cold_ms = (time.perf_counter() - start) * 1000
+        elif line.startswith('{'):
+            report = json.loads(line)
+    stderr = process.stderr.read()
+    process.wait()
+    if report is None:
+        last = stderr.strip().splitlines()[-1] if stderr.strip() else f"exit code {process.returncode}"
+        raise RuntimeError(last[:120])
+    report['cold_ms'] = round(cold_ms, 1)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+', help="Face images or directories (one face per image)")
+    parser.add_argument('--engines', nargs='+', default=list(ENGINES), choices=ENGINES)
+    parser.add_argument('--detector', help="Detector backend for every engine (default: the engine's own)")
+    parser.add_argument('--repeats', type=int, default=5, help="Passes over the image set")
+    parser.add_argument('--child', choices=ENGINES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(args.child, args.detector, args.images, args.repeats)
+        return
+
+    startup, latency, unavailable = {}, {}, {}
+    for engine in args.engines:
+        try:
+            report = run_engine(engine, args.detector, args.images, args.repeats)
+        except RuntimeError as e:
+            unavailable[engine] = str(e)
+            continue
+        startup[engine] = {
+            key: report[key] for key in ('cold_ms', 'import_ms', 'warmup_ms', 'rss_mb', 'peak_mb', 'tf')
+        }
+        latency[engine] = {**report['latency'], 'rejected': report['rejected']}
+
+    bench_utils.print_table("Cold start and memory", startup)
+    bench_utils.print_table(f"enroll_face latency (ms), {args.repeats} passes", latency)
+    for engine, reason in unavailable.items():
+        print(f"{engine}: unavailable ({reason})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Benchmark: 1:N gallery search latency
+
+Fills a FaceGallery with random unit-norm templates and times top-k
+search, next to the per-template Python loop over _calculate_similarity
+it replaces (measured on a subset and scaled linearly).
+
+Usage:
+    python benchmarks/bench_gallery.py --sizes 1000 10000 100000 --top-k 5
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+import bench_utils
+from face_gallery import FaceGallery
+from face_recognition_service import FaceRecognitionService
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--loop-sample', type=int, default=2000, help="Templates timed for the Python loop")
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(0)
+    service = FaceRecognitionService()
+    rows = {}
+    
+    for size in args.sizes:
+        templates = rng.standard_normal((size, 512)).astype(np.float32)
+        gallery = FaceGallery(dimension=512, initial_capacity=size)
+        for i, template in enumerate(templates):
+            gallery.add(f"user-{i}", template)
+        
+        probes = rng.standard_normal((args.queries, 512)).astype(np.float32)
+        samples = []
+        for probe in probes:
+            start = time.perf_counter()
+            gallery.search(probe, top_k=args.top_k)
+            samples.append((time.perf_counter() - start) * 1000)
+        rows[f"gallery n={size}"] = bench_utils.summarize(samples)
+        
+        # Baseline: Python loop, timed on a subset and scaled to the full size
+        sample = min(size, args.loop_sample)
+        probe = probes[0].tolist()
+        start = time.perf_counter()
+        for template in templates[:sample]:
+            service._calculate_similarity(probe, template.tolist())
+        loop_ms = (time.perf_counter() - start) * 1000 * size / sample
+        rows[f"python loop n={size} (est.)"] = bench_utils.summarize([loop_ms])
+    
+    bench_utils.print_table(f"Top-{args.top_k} search latency (ms)", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+Benchmark: import and startup time without models, against a budget
+
+Runs each target in a fresh interpreter under `python -X importtime`:
+
+  service   import face_recognition_service
+  app       import main, i.e. main:app with its FaceRecognitionService
+            built, as uvicorn loads it before the (optional) warmup
+
+and reports the interpreter's wall time, the target's cumulative import
+time, the slowest modules it imports directly and whether TensorFlow or
+DeepFace was imported (neither should be: they load when an engine that
+needs them is first built). Exits non-zero when a target is over its
+budget or imports TensorFlow.
+
+Usage:
+    python benchmarks/bench_import.py --repeats 5
+    python benchmarks/bench_import.py --budget-service-ms 400 --budget-app-ms 1500 --top 15
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import bench_utils
+
+TARGETS = {
+    'service': "face_recognition_service",
+    'app': "main",
+}
+
+# Modules that must stay out of a model-free start
+HEAVY_MODULES = ("tensorflow", "deepface", "keras", "tf_keras")
+
+
+def parse_importtime(stderr):
+    """
+    Cumulative microseconds per module at nesting depth 0 (the target and
+    interpreter start-up) and 1 (what they import directly), and every
+    imported module
+    """
+    depths, modules = ({}, {}), []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        modules.append(name.strip())
+        # Nested imports are indented two spaces per level under their parent
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth < 2:
+            depths[depth][name.strip()] = int(cumulative)
+    return depths, modules
+
+
+def measure(module):
+    env = dict(os.environ)
+    # The app must not warm models or pin CPUs while it is being timed
+    env.update({'EAGER_WARMUP': 'false', 'CPU_PINNING': 'false'})
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=bench_utils.SERVICE_DIR, env=env, capture_output=True, text=True
+    )
+    wall_ms = (time.perf_counter() - start) * 1000
+    if process.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{process.stderr[-2000:]}")
+    depths, modules = parse_importtime(process.stderr)
+    return wall_ms, depths, modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeats', type=int, default=5, help="Fresh interpreters per target")
+    parser.add_argument('--budget-service-ms', type=float, default=500.0,
+                        help="Budget for importing face_recognition_service (wall p50)")
+    parser.add_argument('--budget-app-ms', type=float, default=2000.0,
+                        help="Budget for importing main:app without models (wall p50)")
+    parser.add_argument('--top', type=int, default=10, help="Slowest top-level imports to list")
+    args = parser.parse_args()
+
+    budgets = {'service': args.budget_service_ms, 'app': args.budget_app_ms}
+    rows, failures = {}, []
+    for target, module in TARGETS.items():
+        walls, imports = [], []
+        for _ in range(args.repeats):
+            wall_ms, (top_level, direct), modules = measure(module)
+            walls.append(wall_ms)
+            imports.append(top_level.get(module, 0) / 1000)
+        heavy = sorted({name.split(".")[0] for name in modules} & set(HEAVY_MODULES))
+
+        wall = bench_utils.summarize(walls)
+        rows[target] = {
+            'p50_ms': wall['p50'],
+            'max_ms': wall['max'],
+            'import_ms': bench_utils.summarize(imports)['p50'],
+            'budget': budgets[target],
+            'heavy': ",".join(heavy) or "-"
+        }
+        if wall['p50'] > budgets[target]:
+            failures.append(f"{target}: {wall['p50']} ms > budget {budgets[target]} ms")
+        if heavy:
+            failures.append(f"{target}: imports {', '.join(heavy)}")
+
+        slowest = sorted(direct.items(), key=lambda item: item[1], reverse=True)[:args.top]
+        bench_utils.print_table(
+            f"Slowest direct imports of {module} (ms, cumulative, last run)",
+            {name: {'ms': round(cumulative / 1000, 1)} for name, cumulative in slowest}
+        )
+
+    bench_utils.print_table(
+        f"Startup without models (ms, wall time of the interpreter), {args.repeats} fresh interpreters", rows
+    )
+    for failure in failures:
+        print(f"OVER BUDGET: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
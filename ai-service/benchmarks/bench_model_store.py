@@ -0,0 +1,141 @@
+"""
+Benchmark: cold start and per-worker memory with and without the model store
+
+Starts --workers fresh interpreters per configuration, as uvicorn workers
+would start, each building FaceRecognitionService and running warmup().
+Once all are warm it samples every worker's memory (Linux only):
+
+  cold_ms    process spawn -> imports -> service -> warmup (p50 of workers)
+  rss_mb     resident memory per worker (p50)
+  uss_mb     memory unique to the worker (Private_Clean + Private_Dirty),
+             what each extra worker really costs
+  pss_mb     proportional share, shared pages split between the workers
+  total_pss  PSS summed over the workers
+
+Configurations:
+  deepface          DeepFace.build_model (.h5 from DEEPFACE_HOME)
+  deepface-store    compiled deepface engine, weights from the store
+  onnxruntime       ONNX Runtime reading facenet512.onnx into each process
+  onnxruntime-store ONNX Runtime using the memory-mapped store in place
+
+The store is built with `python model_store.py build`. Configurations
+whose models or packages are missing are listed as unavailable.
+
+Usage:
+    python benchmarks/bench_model_store.py --workers 4
+    python benchmarks/bench_model_store.py --workers 4 --configs onnxruntime onnxruntime-store
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import bench_utils
+
+CONFIGS = {
+    'deepface': {'FACE_ENGINE': 'deepface', 'COMPILED_INFERENCE': 'off', 'MODEL_STORE': 'false'},
+    'deepface-store': {'FACE_ENGINE': 'deepface', 'COMPILED_INFERENCE': 'on', 'MODEL_STORE': 'true'},
+    'onnxruntime': {'FACE_ENGINE': 'onnxruntime', 'MODEL_STORE': 'false'},
+    'onnxruntime-store': {'FACE_ENGINE': 'onnxruntime', 'MODEL_STORE': 'true'},
+}
+
+
+def child():
+    """Runs in each spawned worker; prints "ready" and waits to be killed"""
+    from face_recognition_service import FaceRecognitionService
+
+    engine = os.environ['FACE_ENGINE']
+    service = FaceRecognitionService(
+        engine=engine,
+        compiled_inference=os.getenv("COMPILED_INFERENCE", "off") if engine == "deepface" else "off",
+        model_store=os.environ['MODEL_STORE'] == 'true'
+    )
+    service.warmup()
+    print("ready", flush=True)
+    sys.stdin.read()
+
+
+def memory(pid):
+    """RSS, USS and PSS of one process in MB"""
+    values = {'Rss': 0, 'Pss': 0, 'Private_Clean': 0, 'Private_Dirty': 0}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            key = line.split(':')[0]
+            if key in values:
+                values[key] = int(line.split()[1])
+    return (
+        values['Rss'] / 1024,
+        (values['Private_Clean'] + values['Private_Dirty']) / 1024,
+        values['Pss'] / 1024
+    )
+
+
+def run_config(name, workers, timeout):
+    env = dict(os.environ)
+    env.update(CONFIGS[name])
+    env['THREAD_PLAN'] = 'off'
+    processes, cold = [], []
+    try:
+        for _ in range(workers):
+            start = time.perf_counter()
+            process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), '--child'],
+                stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                env=env, text=True
+            )
+            processes.append((process, start))
+        for process, start in processes:
+            line = process.stdout.readline()
+            if line.strip() != "ready":
+                process.kill()
+                stderr = process.stderr.read().strip().splitlines()
+                raise RuntimeError(stderr[-1][:120] if stderr else f"exit code {process.wait()}")
+            cold.append((time.perf_counter() - start) * 1000)
+
+        samples = [memory(process.pid) for process, _ in processes]
+    finally:
+        for process, _ in processes:
+            if process.poll() is None:
+                process.kill()
+            process.wait(timeout=timeout)
+
+    rss, uss, pss = (
+        bench_utils.summarize([sample[index] for sample in samples])['p50'] for index in range(3)
+    )
+    return {
+        'cold_ms': bench_utils.summarize(cold)['p50'],
+        'rss_mb': round(rss, 1),
+        'uss_mb': round(uss, 1),
+        'pss_mb': round(pss, 1),
+        'total_pss': round(sum(sample[2] for sample in samples), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--configs', nargs='+', default=list(CONFIGS), choices=list(CONFIGS))
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child()
+        return
+
+    rows, unavailable = {}, {}
+    for name in args.configs:
+        try:
+            rows[name] = run_config(name, args.workers, args.timeout)
+        except (RuntimeError, OSError) as e:
+            unavailable[name] = str(e)
+
+    bench_utils.print_table(f"Cold start and memory per worker, {args.workers} workers", rows)
+    for name, reason in unavailable.items():
+        print(f"{name}: unavailable ({reason})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Benchmark: legacy two-pass pipeline vs single-pass detect -> align -> embed
+
+The legacy path mirrors the original service: DeepFace.extract_faces for the
+quality checks followed by DeepFace.represent on the full image, which runs
+detection and alignment a second time. The single-pass path is what
+FaceRecognitionService runs today.
+
+Usage:
+    python benchmarks/bench_pipeline.py path/to/faces/ --repeats 5
+"""
+
+import argparse
+import time
+
+import bench_utils
+from face_recognition_service import FaceRecognitionService, get_deepface
+
+
+def run_legacy(service: FaceRecognitionService, image, timings):
+    DeepFace = get_deepface()
+    
+    start = time.perf_counter()
+    DeepFace.extract_faces(
+        img_path=image,
+        detector_backend=service.DETECTOR_BACKEND,
+        enforce_detection=False,
+        align=True
+    )
+    timings['detect'].append((time.perf_counter() - start) * 1000)
+    
+    start = time.perf_counter()
+    DeepFace.represent(
+        img_path=image,
+        model_name=service.MODEL_NAME,
+        detector_backend=service.DETECTOR_BACKEND,
+        enforce_detection=True,
+        align=True
+    )
+    timings['embed'].append((time.perf_counter() - start) * 1000)
+
+
+def run_single_pass(service: FaceRecognitionService, image, timings):
+    start = time.perf_counter()
+    _, _, face_chip, _ = service._detect_face(image)
+    timings['detect'].append((time.perf_counter() - start) * 1000)
+    
+    start = time.perf_counter()
+    service._generate_embedding(face_chip)
+    timings['embed'].append((time.perf_counter() - start) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+', help="Face images or directories (one face per image)")
+    parser.add_argument('--repeats', type=int, default=5, help="Passes over the image set")
+    args = parser.parse_args()
+    
+    service = FaceRecognitionService()
+    images = [service._load_image_from_bytes(data) for data in bench_utils.load_image_files(args.images)]
+    
+    # Build the model and detector outside the measured region
+    run_single_pass(service, images[0], {'detect': [], 'embed': []})
+    
+    results = {}
+    for label, runner in (('legacy', run_legacy), ('single-pass', run_single_pass)):
+        timings = {'detect': [], 'embed': [], 'total': []}
+        for _ in range(args.repeats):
+            for image in images:
+                start = time.perf_counter()
+                runner(service, image, timings)
+                timings['total'].append((time.perf_counter() - start) * 1000)
+        for stage, samples in timings.items():
+            results[f"{label} {stage}"] = bench_utils.summarize(samples)
+    
+    bench_utils.print_table(f"Pipeline latency (ms), {len(images)} images x {args.repeats}", results)
+    
+    legacy_mean = results['legacy total']['mean']
+    single_mean = results['single-pass total']['mean']
+    if single_mean:
+        print(f"Speedup (mean total): {legacy_mean / single_mean:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: memory of W independent uvicorn workers vs W workers forked
+from a preloaded parent
+
+Starts each layout on localhost, waits for /ready, samples memory of the
+whole process tree (RSS and PSS from /proc, Linux only), drives /enroll
+with concurrent clients for a fixed duration and samples it again.
+Summed RSS counts pages shared between workers once per worker; PSS
+splits them, so its sum is what the layout really occupies.
+
+Layouts:
+    uvicorn   uvicorn main:app --workers W, every worker imports and loads
+              everything itself
+    preload   python preload_server.py --workers W, workers forked after
+              the parent has loaded what it can (see preload_server.py)
+
+Run it with each FACE_ENGINE; how much is shared depends on the engine.
+
+Usage:
+    python benchmarks/bench_preload.py path/to/faces/ --workers 4 --duration 30
+    FACE_ENGINE=onnxruntime ORT_INTRA_OP_THREADS=1 python benchmarks/bench_preload.py path/to/faces/
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+import bench_utils
+from bench_worker_layout import PORT, drive_load, memory_mb, wait_ready
+
+COMMANDS = {
+    'uvicorn': ['-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(PORT),
+                '--log-level', 'warning', '--workers'],
+    'preload': ['preload_server.py', '--host', '127.0.0.1', '--port', str(PORT),
+                '--log-level', 'warning', '--workers'],
+}
+
+
+def run_layout(name, args, images):
+    env = dict(os.environ)
+    env.update({
+        'INFERENCE_MODE': 'local',
+        'WORKERS': str(args.workers),
+        'INFERENCE_QUEUE_SIZE': str(args.concurrency * 2)
+    })
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable] + COMMANDS[name] + [str(args.workers)],
+        cwd=bench_utils.SERVICE_DIR, env=env
+    )
+    try:
+        wait_ready(args.startup_timeout)
+        ready_s = time.perf_counter() - start
+        # Let the other workers finish warming up before sampling
+        time.sleep(args.settle)
+        idle_rss, idle_pss = memory_mb([process.pid])
+
+        start = time.perf_counter()
+        latencies, statuses = drive_load(images, args.concurrency, args.duration)
+        elapsed = time.perf_counter() - start
+        loaded_rss, loaded_pss = memory_mb([process.pid])
+    finally:
+        process.terminate()
+        process.wait(timeout=60)
+
+    ok = sum(1 for code in statuses if code == 200)
+    return {
+        'ready_s': round(ready_s, 1),
+        'idle_rss_mb': round(idle_rss),
+        'idle_pss_mb': round(idle_pss),
+        'load_rss_mb': round(loaded_rss),
+        'load_pss_mb': round(loaded_pss),
+        'req_per_s': round(ok / elapsed, 2),
+        'errors': len(statuses) - ok
+    }, bench_utils.summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+', help="Face images or directories")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--settle', type=float, default=10.0, help="Seconds to wait after /ready before sampling")
+    parser.add_argument('--startup-timeout', type=float, default=300.0)
+    parser.add_argument('--layouts', nargs='+', default=list(COMMANDS), choices=list(COMMANDS))
+    args = parser.parse_args()
+
+    images = bench_utils.load_image_files(args.images)
+
+    memory, latency = {}, {}
+    for name in args.layouts:
+        memory[name], latency[name] = run_layout(name, args, images)
+
+    bench_utils.print_table(
+        f"Memory of the process tree and throughput, {args.workers} workers, "
+        f"FACE_ENGINE={os.getenv('FACE_ENGINE', 'deepface')}",
+        memory
+    )
+    bench_utils.print_table("Request latency (ms)", latency)
+
+
+if __name__ == "__main__":
+    main()
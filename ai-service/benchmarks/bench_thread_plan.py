@@ -0,0 +1,105 @@
+"""
+Benchmark: throughput and tail latency by per-worker thread layout
+
+Starts `uvicorn --workers W` once per layout, waits for /ready, drives
+/enroll with concurrent clients for a fixed duration and reports
+throughput and latency percentiles.
+
+Layouts:
+    default   THREAD_PLAN=off; TensorFlow, OpenCV and BLAS each size their
+              pools to every core, in every worker
+    planned   THREAD_PLAN=auto; the CPUs (and cgroup quota) are split
+              between the workers
+    pinned    planned, and each worker pinned to its own CPUs
+    tN        planned, with N TensorFlow intra-op and BLAS threads per worker
+              (e.g. t1, t2), to try shares other than the even split
+
+The layout of one worker, as reported on /ready, is printed per run.
+
+Usage:
+    python benchmarks/bench_thread_plan.py path/to/faces/ --workers 4 --duration 30
+    python benchmarks/bench_thread_plan.py path/to/faces/ --layouts default planned pinned t1 t2
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+import bench_utils
+from bench_worker_layout import PORT, drive_load, wait_ready
+
+
+def layout_env(name, workers):
+    env = dict(os.environ)
+    for variable in ('TF_NUM_INTRAOP_THREADS', 'TF_NUM_INTEROP_THREADS', 'OMP_NUM_THREADS',
+                     'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'CPU_PINNING'):
+        env.pop(variable, None)
+    env.update({'INFERENCE_MODE': 'local', 'WORKERS': str(workers), 'THREAD_PLAN': 'auto'})
+    if name == 'default':
+        env['THREAD_PLAN'] = 'off'
+    elif name == 'pinned':
+        env['CPU_PINNING'] = 'true'
+    elif name.startswith('t') and name[1:].isdigit():
+        threads = name[1:]
+        for variable in ('TF_NUM_INTRAOP_THREADS', 'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS'):
+            env[variable] = threads
+    elif name != 'planned':
+        raise SystemExit(f"Unknown layout {name}")
+    return env
+
+
+def run_layout(name, args, images):
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+         '--port', str(PORT), '--workers', str(args.workers), '--log-level', 'warning'],
+        cwd=bench_utils.SERVICE_DIR, env=layout_env(name, args.workers)
+    )
+    try:
+        wait_ready(args.startup_timeout)
+        with urllib.request.urlopen(f'http://127.0.0.1:{PORT}/ready', timeout=5) as response:
+            plan = json.loads(response.read()).get('thread_plan')
+
+        start = time.perf_counter()
+        latencies, statuses = drive_load(images, args.concurrency, args.duration)
+        elapsed = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+    ok = sum(1 for code in statuses if code == 200)
+    row = bench_utils.summarize(latencies)
+    del row['count']
+    row['req_per_s'] = round(ok / elapsed, 2)
+    row['errors'] = len(statuses) - ok
+    return row, plan
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+', help="Face images or directories")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--startup-timeout', type=float, default=300.0)
+    parser.add_argument('--layouts', nargs='+', default=['default', 'planned', 'pinned'])
+    args = parser.parse_args()
+
+    images = bench_utils.load_image_files(args.images)
+
+    rows = {}
+    for name in args.layouts:
+        rows[name], plan = run_layout(name, args, images)
+        print(f"{name}: {plan}")
+
+    bench_utils.print_table(
+        f"/enroll latency (ms) and throughput, {args.workers} workers, {args.concurrency} clients",
+        rows
+    )
+
+
+if __name__ == "__main__":
+    main()
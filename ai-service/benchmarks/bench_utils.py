@@ -0,0 +1,96 @@
+"""
+Shared helpers for the benchmark scripts
+"""
+
+import os
+import sys
+import glob
+import statistics
+from typing import Dict, List
+
+# Benchmarks live next to the service modules, not inside a package
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVICE_DIR not in sys.path:
+    sys.path.insert(0, SERVICE_DIR)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def load_image_files(paths: List[str]) -> List[bytes]:
+    """
+    Read raw image bytes from files and/or directories
+    
+    Args:
+        paths: Image files or directories containing images
+        
+    Returns:
+        List of raw image bytes
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for name in sorted(glob.glob(os.path.join(path, '**', '*'), recursive=True)):
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    files.append(name)
+        else:
+            files.append(path)
+    
+    if not files:
+        raise SystemExit("No images found. Pass image files or directories.")
+    
+    images = []
+    for name in files:
+        with open(name, 'rb') as f:
+            images.append(f.read())
+    return images
+
+
+def summarize(samples_ms: List[float]) -> Dict[str, float]:
+    """
+    Summarize latency samples in milliseconds
+    
+    Args:
+        samples_ms: Latency samples
+        
+    Returns:
+        Dictionary with count, mean, p50, p95, p99 and max
+    """
+    if not samples_ms:
+        return {'count': 0, 'mean': 0.0, 'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'max': 0.0}
+    
+    ordered = sorted(samples_ms)
+    
+    def percentile(p):
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+    
+    return {
+        'count': len(ordered),
+        'mean': round(statistics.fmean(ordered), 2),
+        'p50': round(percentile(50), 2),
+        'p95': round(percentile(95), 2),
+        'p99': round(percentile(99), 2),
+        'max': round(ordered[-1], 2)
+    }
+
+
+def print_table(title: str, rows: Dict[str, Dict[str, float]]) -> None:
+    """
+    Print summaries as an aligned text table
+    
+    Args:
+        title: Table heading
+        rows: Mapping of row label to summary dictionary
+    """
+    print("=" * 72)
+    print(title)
+    print("=" * 72)
+    if not rows:
+        return
+    
+    columns = list(next(iter(rows.values())).keys())
+    label_width = max(len(label) for label in rows) + 2
+    print("".ljust(label_width) + "".join(str(c).rjust(10) for c in columns))
+    for label, summary in rows.items():
+        print(label.ljust(label_width) + "".join(str(summary[c]).rjust(10) for c in columns))
+    print()
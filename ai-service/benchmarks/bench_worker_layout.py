@@ -0,0 +1,201 @@
+"""
+Benchmark: per-worker models vs a shared inference process
+
+Starts each layout on localhost, waits for /ready, drives /enroll with
+concurrent clients for a fixed duration and samples memory of the whole
+process tree (RSS and PSS from /proc, Linux only).
+
+Layouts:
+    per-worker  uvicorn --workers W, every worker loads TensorFlow + Facenet512
+    shared      W light uvicorn workers + P shared inference processes
+
+Usage:
+    python benchmarks/bench_worker_layout.py path/to/faces/ --workers 4 \\
+        --inference-processes 1 --inference-threads 4 --duration 30
+"""
+
+import argparse
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+
+import bench_utils
+
+PORT = 8077
+
+
+def descendants(root_pid):
+    """PIDs of root_pid and all its descendants"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            children.setdefault(int(fields[1]), []).append(int(entry))
+        except OSError:
+            continue
+
+    pids, stack = [], [root_pid]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def memory_mb(root_pids):
+    """Summed RSS and PSS (MB) across the process trees"""
+    rss = pss = 0
+    for root in root_pids:
+        for pid in descendants(root):
+            try:
+                with open(f'/proc/{pid}/smaps_rollup') as f:
+                    for line in f:
+                        if line.startswith('Rss:'):
+                            rss += int(line.split()[1])
+                        elif line.startswith('Pss:'):
+                            pss += int(line.split()[1])
+            except OSError:
+                continue
+    return rss / 1024, pss / 1024
+
+
+def wait_ready(timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{PORT}/ready', timeout=2):
+                return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(1)
+    raise SystemExit("Service did not become ready in time")
+
+
+def post_image(image_bytes):
+    boundary = uuid.uuid4().hex
+    body = (
+        f'--{boundary}\r\n'
+        f'Content-Disposition: form-data; name="image"; filename="face.jpg"\r\n'
+        f'Content-Type: image/jpeg\r\n\r\n'
+    ).encode() + image_bytes + f'\r\n--{boundary}--\r\n'.encode()
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{PORT}/enroll',
+        data=body,
+        headers={'Content-Type': f'multipart/form-data; boundary={boundary}'}
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def drive_load(images, concurrency, duration):
+    latencies, statuses = [], []
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(offset):
+        index = offset
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            code = post_image(images[index % len(images)])
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                latencies.append(elapsed)
+                statuses.append(code)
+            index += concurrency
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, statuses
+
+
+def run_layout(name, args, images):
+    env = dict(os.environ)
+    env.update({
+        'INFERENCE_SLOTS': str(args.inference_threads if name == 'shared' else 1),
+        'INFERENCE_QUEUE_SIZE': str(args.concurrency * 2),
+        'SHARED_INFERENCE_SOCKET': f'/tmp/face-inference-bench-{os.getpid()}.sock'
+    })
+    env.setdefault('SHARED_INFERENCE_AUTHKEY', secrets.token_hex(32))
+    roots = []
+
+    if name == 'shared':
+        env['INFERENCE_MODE'] = 'shared'
+        roots.append(subprocess.Popen(
+            [sys.executable, 'shared_inference.py',
+             '--processes', str(args.inference_processes),
+             '--threads', str(args.inference_threads)],
+            cwd=bench_utils.SERVICE_DIR, env=env
+        ))
+    else:
+        env['INFERENCE_MODE'] = 'local'
+
+    roots.append(subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1',
+         '--port', str(PORT), '--workers', str(args.workers), '--log-level', 'warning'],
+        cwd=bench_utils.SERVICE_DIR, env=env
+    ))
+
+    try:
+        wait_ready(args.startup_timeout)
+        idle_rss, idle_pss = memory_mb([p.pid for p in roots])
+
+        start = time.perf_counter()
+        latencies, statuses = drive_load(images, args.concurrency, args.duration)
+        elapsed = time.perf_counter() - start
+        loaded_rss, loaded_pss = memory_mb([p.pid for p in roots])
+    finally:
+        for process in reversed(roots):
+            process.terminate()
+        for process in roots:
+            process.wait(timeout=30)
+
+    ok = sum(1 for code in statuses if code == 200)
+    return {
+        'idle_rss_mb': round(idle_rss),
+        'idle_pss_mb': round(idle_pss),
+        'load_rss_mb': round(loaded_rss),
+        'load_pss_mb': round(loaded_pss),
+        'req_per_s': round(ok / elapsed, 2),
+        'errors': len(statuses) - ok
+    }, bench_utils.summarize(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('images', nargs='+', help="Face images or directories")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--inference-processes', type=int, default=1)
+    parser.add_argument('--inference-threads', type=int, default=4)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30.0)
+    parser.add_argument('--startup-timeout', type=float, default=300.0)
+    parser.add_argument('--layouts', nargs='+', default=['per-worker', 'shared'])
+    args = parser.parse_args()
+
+    images = bench_utils.load_image_files(args.images)
+
+    memory, latency = {}, {}
+    for name in args.layouts:
+        memory[name], latency[name] = run_layout(name, args, images)
+
+    bench_utils.print_table(f"Memory and throughput, {args.workers} HTTP workers", memory)
+    bench_utils.print_table("Request latency (ms)", latency)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Embedding Batcher
+Coalesces aligned face chips from concurrent requests into a single
+batched forward pass of the embedding model
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, List
+import logging
+
+import numpy as np
+
+from metrics import Histogram, Counter
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+QUEUE_DELAY_BUCKETS_MS = (0.5, 1, 2, 5, 10, 20, 50, 100)
+
+
+class _PendingChip:
+    __slots__ = ('chip', 'future', 'enqueued_at')
+
+    def __init__(self, chip: np.ndarray):
+        self.chip = chip
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class EmbeddingBatcher:
+    """
+    Dynamic micro-batching scheduler for the embedding model
+
+    A single scheduler thread owns the model call. It takes the first
+    waiting chip, keeps collecting until `max_batch_size` chips are queued
+    or `max_wait_ms` has passed since that first chip arrived, runs one
+    forward pass and hands each row of the output back to its caller.
+    """
+
+    def __init__(
+        self,
+        embed_batch: Callable[[np.ndarray], np.ndarray],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0
+    ):
+        """
+        Args:
+            embed_batch: Maps a (N, H, W, 3) chip array to (N, D) embeddings
+            max_batch_size: Upper bound on chips per forward pass
+            max_wait_ms: Longest time the oldest chip may wait for company
+        """
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._embed_batch = embed_batch
+        self._queue = queue.Queue()
+        self._closed = False
+        # Orders enqueues against close() so nothing lands behind the sentinel
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.batch_size = Histogram(buckets=BATCH_SIZE_BUCKETS)
+        self.queue_delay_ms = Histogram(buckets=QUEUE_DELAY_BUCKETS_MS)
+        self.forward_ms = Histogram()
+        self.failed_batches = Counter()
+
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+        logger.info(
+            f"Embedding batcher started - Max batch: {max_batch_size}, "
+            f"Max wait: {max_wait_ms}ms"
+        )
+
+    def embed(self, face_chip: np.ndarray) -> np.ndarray:
+        """
+        Embed one aligned chip, blocking until its batch has run
+
+        Args:
+            face_chip: Aligned face chip (H, W, 3)
+
+        Returns:
+            Embedding vector for this chip
+
+        Raises:
+            RuntimeError: Batcher closed, or the model returned the wrong number of rows
+        """
+        pending = _PendingChip(face_chip)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Embedding batcher is closed")
+            self._queue.put(pending)
+        return pending.future.result()
+
+    def _collect(self, first: _PendingChip) -> List[_PendingChip]:
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait_ms / 1000
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                # Shutdown sentinel: finish this batch, then stop
+                self._queue.put(None)
+                break
+            batch.append(item)
+
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+
+            batch = self._collect(first)
+            started_at = time.perf_counter()
+
+            for item in batch:
+                self.queue_delay_ms.observe((started_at - item.enqueued_at) * 1000)
+            self.batch_size.observe(len(batch))
+
+            try:
+                embeddings = self._embed_batch(np.stack([item.chip for item in batch]))
+                if len(embeddings) != len(batch):
+                    raise RuntimeError(
+                        f"Embedding model returned {len(embeddings)} rows for {len(batch)} chips"
+                    )
+            except Exception as e:
+                logger.error(f"Batched embedding failed for {len(batch)} chip(s): {str(e)}")
+                self.failed_batches.inc()
+                for item in batch:
+                    item.future.set_exception(e)
+                continue
+            finally:
+                self.forward_ms.observe((time.perf_counter() - started_at) * 1000)
+
+            for item, embedding in zip(batch, embeddings):
+                item.future.set_result(embedding)
+
+    def stats(self) -> Dict:
+        """Batch-size and queue-delay histograms for /metrics"""
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait_ms,
+            'queued': self._queue.qsize(),
+            'failed_batches': self.failed_batches.value,
+            'batch_size': self.batch_size.snapshot(),
+            'queue_delay_ms': self.queue_delay_ms.snapshot(),
+            'forward_ms': self.forward_ms.snapshot()
+        }
+
+    def after_fork(self) -> None:
+        """
+        Start a new scheduler thread in a forked child
+
+        Threads do not survive os.fork(); the queue is replaced too, since
+        its lock may have been held by the parent's thread.
+        """
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        """Finish queued work, stop the scheduler thread and fail anything left"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout=5)
+
+        # Only reached with items left if the scheduler is stuck in the model
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None and not item.future.done():
+                item.future.set_exception(RuntimeError("Embedding batcher is closed"))
@@ -0,0 +1,142 @@
+"""
+Embedding Codec
+Compact binary encoding for face embeddings, as an opt-in alternative to
+JSON arrays of floats on /enroll and /verify
+
+Layout (little-endian):
+    magic     4 bytes  b"FEMB"
+    version   uint8    1
+    dtype     uint8    1 = float32, 2 = float16
+    dimension uint16   number of values
+    values    dimension * itemsize bytes
+"""
+
+import base64
+import binascii
+import json
+import struct
+from typing import Optional
+
+import numpy as np
+
+MAGIC = b"FEMB"
+VERSION = 1
+HEADER = struct.Struct("<4sBBH")
+
+# Media type of a raw (not base64) payload, for Accept and file parts
+MEDIA_TYPE = "application/x-face-embedding"
+
+DTYPE_CODES = {
+    1: np.dtype("<f4"),
+    2: np.dtype("<f2")
+}
+DTYPE_NAMES = {
+    "float32": 1,
+    "float16": 2
+}
+
+# Values of the embedding_format query flag
+EMBEDDING_FORMATS = ("json", "base64", "binary")
+
+
+def encode_embedding(embedding, dtype: str = "float32") -> bytes:
+    """
+    Encode an embedding as header + raw little-endian values
+
+    Args:
+        embedding: 1-D sequence or array of floats
+        dtype: "float32" (lossless for model output) or "float16"
+
+    Returns:
+        Encoded bytes
+    """
+    if dtype not in DTYPE_NAMES:
+        raise ValueError(f"Unsupported embedding dtype '{dtype}'")
+    code = DTYPE_NAMES[dtype]
+    values = np.asarray(embedding, dtype=DTYPE_CODES[code]).reshape(-1)
+    return HEADER.pack(MAGIC, VERSION, code, values.shape[0]) + values.tobytes()
+
+
+def decode_embedding(payload: bytes, expected_dimension: Optional[int] = None) -> np.ndarray:
+    """
+    Decode bytes produced by encode_embedding
+
+    Args:
+        payload: Encoded bytes
+        expected_dimension: Reject embeddings of any other length
+
+    Returns:
+        Embedding as a float32 array
+
+    Raises:
+        ValueError: Bad header, truncated payload or wrong dimension
+    """
+    if len(payload) < HEADER.size:
+        raise ValueError("Embedding payload is too short")
+
+    magic, version, code, dimension = HEADER.unpack_from(payload)
+    if magic != MAGIC:
+        raise ValueError("Embedding payload has an unknown format")
+    if version != VERSION:
+        raise ValueError(f"Unsupported embedding format version {version}")
+    if code not in DTYPE_CODES:
+        raise ValueError(f"Unsupported embedding dtype code {code}")
+
+    dtype = DTYPE_CODES[code]
+    if len(payload) != HEADER.size + dimension * dtype.itemsize:
+        raise ValueError("Embedding payload length does not match its header")
+
+    values = np.frombuffer(payload, dtype=dtype, count=dimension, offset=HEADER.size)
+    return _validated(values.astype(np.float32), expected_dimension)
+
+
+def encode_embedding_base64(embedding, dtype: str = "float32") -> str:
+    """Base64 text form of encode_embedding, safe for form fields and JSON"""
+    return base64.b64encode(encode_embedding(embedding, dtype)).decode("ascii")
+
+
+def decode_embedding_base64(text: str, expected_dimension: Optional[int] = None) -> np.ndarray:
+    """
+    Decode the base64 text form of an encoded embedding
+
+    Raises:
+        ValueError: Invalid base64 or payload
+    """
+    try:
+        payload = base64.b64decode(text, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("Embedding is not valid base64")
+    return decode_embedding(payload, expected_dimension)
+
+
+def decode_embedding_field(text: str, expected_dimension: Optional[int] = None) -> np.ndarray:
+    """
+    Parse an embedding form field sent either as a JSON array or as base64
+
+    JSON arrays keep float64 precision so existing callers get exactly
+    the same similarity scores as before.
+
+    Raises:
+        ValueError: Neither a numeric JSON array nor a valid encoded embedding
+    """
+    text = text.strip()
+    if not text.startswith("["):
+        return decode_embedding_base64(text, expected_dimension)
+
+    try:
+        values = np.array(json.loads(text), dtype=np.float64)
+    except (json.JSONDecodeError, TypeError, ValueError):
+        raise ValueError("Invalid embedding format. Must be a JSON array of numbers or base64.")
+    return _validated(values, expected_dimension)
+
+
+def _validated(values: np.ndarray, expected_dimension: Optional[int]) -> np.ndarray:
+    if values.ndim != 1 or values.shape[0] == 0:
+        raise ValueError("Embedding must be a non-empty 1-D array")
+    if expected_dimension is not None and values.shape[0] != expected_dimension:
+        raise ValueError(
+            f"Embedding has {values.shape[0]} dimensions, expected {expected_dimension}"
+        )
+    if not np.all(np.isfinite(values)):
+        raise ValueError("Embedding contains non-finite values")
+    return values
@@ -0,0 +1,402 @@
+"""
+Embedding Engines
+Facenet512 run without TensorFlow, from an ONNX export of the same weights,
+so templates enrolled through DeepFace stay comparable, or through a
+compiled TensorFlow function that skips DeepFace.represent
+
+Create the model file once, where TensorFlow is installed, with:
+    python export_onnx.py
+(the onnxruntime engine also does this itself the first time it loads)
+"""
+
+import os
+import threading
+import logging
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+from face_detection import MODEL_DIR
+from model_store import MAPPED_ONNX, has_arrays, map_arrays
+
+logger = logging.getLogger(__name__)
+
+# ONNX export of DeepFace's Facenet512 with an NCHW input, see export_onnx.py
+FACENET_ONNX = "facenet512.onnx"
+
+# "deepface" runs Facenet512 through DeepFace/TensorFlow; the others need
+# only the ONNX export and never import TensorFlow
+ENGINES = ("deepface", "opencv-dnn", "onnxruntime")
+
+# Largest cosine distance allowed between an engine's embedding and
+# DeepFace's for the same chip; far below VERIFICATION_THRESHOLD, so stored
+# templates keep matching after switching engines
+EMBEDDING_TOLERANCE = 1e-4
+
+GRAPH_OPTIMIZATIONS = ("disable", "basic", "extended", "all")
+
+# How the deepface engine calls the model: "off" goes through
+# DeepFace.represent, "on" through a traced tf.function, "xla" through a
+# traced and XLA-compiled one
+COMPILED_MODES = ("off", "on", "xla")
+
+# Embedding precisions each engine can run. deepface bf16 is Keras mixed
+# precision (fast on CPUs with AVX512-BF16/AMX); opencv-dnn fp16 computes in
+# half precision where OpenCV supports it (ARM) and in fp32 elsewhere;
+# onnxruntime fp16 and int8 run reduced models made by quantize_model.py
+PRECISIONS = ("fp32", "fp16", "bf16", "int8")
+ENGINE_PRECISIONS = {
+    "deepface": ("fp32", "bf16"),
+    "opencv-dnn": ("fp32", "fp16"),
+    "onnxruntime": ("fp32", "fp16", "int8")
+}
+
+# ONNX model file per precision, in the model directory
+PRECISION_MODELS = {
+    "fp32": FACENET_ONNX,
+    "fp16": "facenet512.fp16.onnx",
+    "int8": "facenet512.int8.onnx"
+}
+
+
+def check_precision(engine: str, precision: str) -> None:
+    """
+    Raises:
+        ValueError: The engine cannot run at this precision
+    """
+    supported = ENGINE_PRECISIONS.get(engine, ())
+    if precision not in supported:
+        raise ValueError(f"The {engine} engine supports precision: {', '.join(supported)}")
+
+
+def create_embedder(
+    engine: str,
+    model_dir: str = MODEL_DIR,
+    precision: str = "fp32",
+    model_store: bool = True,
+    **options
+):
+    """
+    Build the embedder for a TensorFlow-free engine
+
+    Args:
+        engine: One of ENGINES other than "deepface"
+        model_dir: Directory holding the PRECISION_MODELS files
+        precision: One of the engine's ENGINE_PRECISIONS
+        model_store: Let onnxruntime fp32 map its weights from the model
+            store (model_store.MAPPED_ONNX) when it has been built
+        **options: Engine settings, see OnnxRuntimeEmbedder
+
+    Raises:
+        ValueError: Unknown engine or unsupported precision
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"engine must be one of: {', '.join(ENGINES)}")
+    check_precision(engine, precision)
+    if engine == "opencv-dnn":
+        # fp16 is a compute target for the fp32 model, not another file
+        return DnnEmbedder(os.path.join(model_dir, FACENET_ONNX), precision)
+    if engine == "onnxruntime":
+        mapped = os.path.join(model_dir, MAPPED_ONNX)
+        if model_store and precision == "fp32" and has_arrays(mapped) and os.path.isfile(f"{mapped}.onnx"):
+            return OnnxRuntimeEmbedder(f"{mapped}.onnx", precision=precision, mapped_weights=mapped, **options)
+        model_path = os.path.join(model_dir, PRECISION_MODELS[precision])
+        return OnnxRuntimeEmbedder(model_path, precision=precision, **options)
+    raise ValueError(f"The {engine} engine has no TensorFlow-free embedder")
+
+
+def compiled_batch_sizes(max_batch_size: int) -> Tuple[int, ...]:
+    """Powers of two below max_batch_size, and max_batch_size itself"""
+    sizes = {max_batch_size}
+    size = 1
+    while size < max_batch_size:
+        sizes.add(size)
+        size *= 2
+    return tuple(sorted(sizes))
+
+
+def cosine_distances(expected: np.ndarray, actual: np.ndarray) -> np.ndarray:
+    """Row-wise cosine distance between two (N, D) embedding arrays"""
+    dot = np.sum(expected * actual, axis=1)
+    return 1 - dot / (np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1))
+
+
+class DnnEmbedder:
+    """
+    Facenet512 forward passes through OpenCV's DNN module
+
+    Takes the same BGR float32 chips in [0, 1] that DeepFace.represent
+    feeds the Keras model, batched as (N, height, width, 3).
+    """
+
+    name = "opencv-dnn"
+
+    def __init__(self, model_path: str, precision: str = "fp32"):
+        """
+        Args:
+            model_path: ONNX file written by export_onnx.py
+            precision: "fp32", or "fp16" to compute in half precision
+                where the CPU supports it
+        """
+        self.model_path = model_path
+        self.precision = precision
+        # cv2.dnn.Net keeps per-forward state and is not safe to share
+        # between threads
+        self._local = threading.local()
+        # Networks released by their thread, for the next thread that needs one
+        self._released: List[cv2.dnn.Net] = []
+        self._released_lock = threading.Lock()
+
+    def _net(self) -> cv2.dnn.Net:
+        net = getattr(self._local, 'net', None)
+        if net is None:
+            with self._released_lock:
+                if self._released:
+                    net = self._local.net = self._released.pop()
+                    return net
+            if not os.path.isfile(self.model_path):
+                raise RuntimeError(
+                    f"Embedding model not found at {self.model_path}; create it with export_onnx.py"
+                )
+            net = cv2.dnn.readNetFromONNX(self.model_path)
+            net.setPreferableBackend(cv2.dnn.DNN_BACKEND_OPENCV)
+            net.setPreferableTarget(
+                cv2.dnn.DNN_TARGET_CPU_FP16 if self.precision == "fp16" else cv2.dnn.DNN_TARGET_CPU
+            )
+            self._local.net = net
+        return net
+
+    def load(self) -> None:
+        """Load the network for the calling thread"""
+        self._net()
+
+    def release(self) -> None:
+        """
+        Hand the calling thread's network to the next thread that needs one
+
+        A process that loads and warms the network before forking workers
+        calls this, so a worker thread uses those (shared) pages instead
+        of reading the model again.
+        """
+        net = getattr(self._local, 'net', None)
+        if net is not None:
+            self._local.net = None
+            with self._released_lock:
+                self._released.append(net)
+
+    def embed(self, face_chips: np.ndarray) -> np.ndarray:
+        """
+        Embed a batch of aligned chips
+
+        Args:
+            face_chips: (N, height, width, 3) BGR float32 in [0, 1]
+
+        Returns:
+            (N, 512) float32 embeddings
+        """
+        net = self._net()
+        net.setInput(np.ascontiguousarray(face_chips.transpose(0, 3, 1, 2), dtype=np.float32))
+        return net.forward().reshape(len(face_chips), -1)
+
+
+class OnnxRuntimeEmbedder:
+    """
+    Facenet512 forward passes through ONNX Runtime on CPU
+
+    The ONNX export is created on first load if it is missing (this one
+    time needs TensorFlow and tf2onnx) and reused from disk afterwards.
+    An InferenceSession is safe to share between threads; intra-op
+    threads split each forward pass, inter-op threads run independent
+    graph branches in parallel.
+    """
+
+    name = "onnxruntime"
+
+    def __init__(
+        self,
+        model_path: str,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+        graph_optimization: str = "all",
+        precision: str = "fp32",
+        mapped_weights: Optional[str] = None
+    ):
+        """
+        Args:
+            model_path: ONNX file written by export_onnx.py, or its fp16 or
+                int8 variant from quantize_model.py
+            intra_op_threads: Threads per operator; 0 lets ONNX Runtime choose
+            inter_op_threads: Threads across operators; above 1 runs the
+                graph in parallel mode, 0 lets ONNX Runtime choose
+            graph_optimization: One of GRAPH_OPTIMIZATIONS
+            precision: Precision of the model file; only fp32 is converted
+                automatically when missing
+            mapped_weights: Model store prefix whose memory-mapped arrays
+                replace the model's initializers, shared with every other
+                process mapping the same file
+        """
+        if graph_optimization not in GRAPH_OPTIMIZATIONS:
+            raise ValueError(f"graph_optimization must be one of: {', '.join(GRAPH_OPTIMIZATIONS)}")
+        self.model_path = model_path
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.graph_optimization = graph_optimization
+        self.precision = precision
+        self.mapped_weights = mapped_weights
+        self._mapped_values = []
+        self._session_obj = None
+        self._input_name: Optional[str] = None
+        self._lock = threading.Lock()
+
+    def _ensure_model(self) -> None:
+        if not os.path.isfile(self.model_path):
+            if self.mapped_weights is not None:
+                raise RuntimeError(f"{self.model_path} not found; create it with model_store.py build")
+            if self.precision != "fp32":
+                raise RuntimeError(
+                    f"{self.precision} model not found at {self.model_path}; create it with quantize_model.py"
+                )
+            logger.info(f"{self.model_path} not found; converting Facenet512 to ONNX (one time)")
+            from export_onnx import export
+            export(self.model_path)
+
+    def _session(self):
+        if self._session_obj is None:
+            with self._lock:
+                if self._session_obj is None:
+                    self._ensure_model()
+                    import onnxruntime as ort
+
+                    options = ort.SessionOptions()
+                    options.intra_op_num_threads = self.intra_op_threads
+                    options.inter_op_num_threads = self.inter_op_threads
+                    options.execution_mode = (
+                        ort.ExecutionMode.ORT_PARALLEL if self.inter_op_threads > 1
+                        else ort.ExecutionMode.ORT_SEQUENTIAL
+                    )
+                    options.graph_optimization_level = {
+                        "disable": ort.GraphOptimizationLevel.ORT_DISABLE_ALL,
+                        "basic": ort.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+                        "extended": ort.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+                        "all": ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+                    }[self.graph_optimization]
+                    if self.mapped_weights is not None:
+                        # ONNX Runtime uses these buffers in place; they
+                        # must outlive the session
+                        for name, array in map_arrays(self.mapped_weights).items():
+                            value = ort.OrtValue.ortvalue_from_numpy(array)
+                            options.add_initializer(name, value)
+                            self._mapped_values.append(value)
+                    session = ort.InferenceSession(
+                        self.model_path, sess_options=options, providers=["CPUExecutionProvider"]
+                    )
+                    self._input_name = session.get_inputs()[0].name
+                    self._session_obj = session
+        return self._session_obj
+
+    def load(self) -> None:
+        """Create the session, converting the model first if needed"""
+        self._session()
+
+    def embed(self, face_chips: np.ndarray) -> np.ndarray:
+        """
+        Embed a batch of aligned chips
+
+        Args:
+            face_chips: (N, height, width, 3) BGR float32 in [0, 1]
+
+        Returns:
+            (N, 512) float32 embeddings
+        """
+        session = self._session()
+        blob = np.ascontiguousarray(face_chips.transpose(0, 3, 1, 2), dtype=np.float32)
+        embeddings = session.run(None, {self._input_name: blob})[0]
+        return np.asarray(embeddings, dtype=np.float32).reshape(len(face_chips), -1)
+
+
+class KerasEmbedder:
+    """
+    Facenet512 called directly through a traced TensorFlow function
+
+    DeepFace.represent checks its arguments, looks the model up, resizes
+    and normalizes the chip and runs Keras on every call, none of which
+    chips from _detect_face need. Here the service holds the model and its
+    call is traced once per batch size in batch_sizes, for the fixed chip
+    shape, when the embedder loads. Batches are padded to the next traced
+    size (and split above the largest), so nothing is traced at runtime.
+    """
+
+    name = "deepface"
+
+    def __init__(
+        self,
+        build_model: Callable[[], object],
+        input_size: Tuple[int, int],
+        batch_sizes: Sequence[int] = (1,),
+        jit_compile: bool = False
+    ):
+        """
+        Args:
+            build_model: Returns the Keras model, e.g. DeepFace.build_model
+                for Facenet512; called once, on load
+            input_size: Chip height and width
+            batch_sizes: Batch sizes to trace; the largest is the most
+                chips per forward pass
+            jit_compile: Compile the traced function with XLA
+        """
+        if not batch_sizes or min(batch_sizes) < 1:
+            raise ValueError("batch_sizes must be positive")
+        self._build_model = build_model
+        self.input_size = tuple(input_size)
+        self.batch_sizes = tuple(sorted(set(batch_sizes)))
+        self.jit_compile = jit_compile
+        self._functions: Optional[Dict[int, Callable]] = None
+        self._lock = threading.Lock()
+
+    def _compiled(self) -> Dict[int, Callable]:
+        if self._functions is None:
+            with self._lock:
+                if self._functions is None:
+                    import tensorflow as tf
+
+                    model = self._build_model()
+
+                    @tf.function(jit_compile=self.jit_compile)
+                    def forward(chips):
+                        # Float32 out whatever the Keras precision policy
+                        return tf.cast(model(chips, training=False), tf.float32)
+
+                    height, width = self.input_size
+                    self._functions = {
+                        size: forward.get_concrete_function(
+                            tf.TensorSpec((size, height, width, 3), tf.float32)
+                        )
+                        for size in self.batch_sizes
+                    }
+        return self._functions
+
+    def load(self) -> None:
+        """Build the model and trace every batch size"""
+        self._compiled()
+
+    def embed(self, face_chips: np.ndarray) -> np.ndarray:
+        """
+        Embed a batch of aligned chips
+
+        Args:
+            face_chips: (N, height, width, 3) BGR float32 in [0, 1]
+
+        Returns:
+            (N, 512) float32 embeddings
+        """
+        functions = self._compiled()
+        largest = self.batch_sizes[-1]
+        embeddings = []
+        for start in range(0, len(face_chips), largest):
+            chunk = face_chips[start:start + largest]
+            size = next(size for size in self.batch_sizes if size >= len(chunk))
+            batch = np.zeros((size,) + self.input_size + (3,), dtype=np.float32)
+            batch[:len(chunk)] = chunk
+            embeddings.append(np.asarray(functions[size](batch))[:len(chunk)])
+        return np.concatenate(embeddings).reshape(len(face_chips), -1)
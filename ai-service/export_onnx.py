@@ -0,0 +1,101 @@
+"""
+Export Facenet512 to ONNX for the TensorFlow-free engines
+
+Converts the Keras model DeepFace builds (same weights, so existing
+templates stay comparable) with tf2onnx, with an NCHW input as OpenCV's
+DNN module expects, then checks that the export reproduces DeepFace's
+embeddings on random chips within EMBEDDING_TOLERANCE. A failed check
+leaves no file behind.
+
+Needs TensorFlow, DeepFace and tf2onnx; run it once where they are
+installed and ship the file in models/ (the onnxruntime engine also runs
+the conversion itself when the file is missing):
+    pip install tf2onnx
+    python export_onnx.py --output models/facenet512.onnx
+"""
+
+import argparse
+import logging
+import os
+
+import numpy as np
+
+from embedding_engines import (
+    EMBEDDING_TOLERANCE,
+    FACENET_ONNX,
+    DnnEmbedder,
+    OnnxRuntimeEmbedder,
+    cosine_distances
+)
+from face_detection import MODEL_DIR
+
+logger = logging.getLogger(__name__)
+
+
+def export(output: str, opset: int = 13) -> None:
+    """
+    Convert, verify and atomically write the ONNX model
+
+    Raises:
+        RuntimeError: The export's embeddings differ from Keras by more
+            than EMBEDDING_TOLERANCE
+    """
+    import tensorflow as tf
+    import tf2onnx
+    from face_recognition_service import FaceRecognitionService, get_deepface
+
+    model = get_deepface().build_model(FaceRecognitionService.MODEL_NAME)
+    height, width = FaceRecognitionService.MODEL_INPUT_SIZE
+    spec = (tf.TensorSpec((None, height, width, 3), tf.float32, name="input"),)
+    # Other processes may convert at the same time; each writes its own
+    # file and the finished ones replace each other atomically
+    partial = f"{output}.{os.getpid()}.tmp"
+    try:
+        tf2onnx.convert.from_keras(
+            model, input_signature=spec, opset=opset, inputs_as_nchw=["input"], output_path=partial
+        )
+
+        # The export must reproduce the Keras embeddings on every engine
+        chips = np.random.default_rng(0).random((4, height, width, 3), dtype=np.float32)
+        expected = np.asarray(model.predict(chips, verbose=0))
+        embedders = [DnnEmbedder(partial)]
+        try:
+            import onnxruntime  # noqa: F401
+            embedders.append(OnnxRuntimeEmbedder(partial))
+        except ImportError:
+            pass
+        for embedder in embedders:
+            actual = embedder.embed(chips)
+            distance = float(cosine_distances(expected, actual).max())
+            logger.info(
+                f"{embedder.name} vs Keras: max abs diff {np.abs(expected - actual).max():.2e}, "
+                f"max cosine distance {distance:.2e}"
+            )
+            if distance > EMBEDDING_TOLERANCE:
+                raise RuntimeError(
+                    f"{embedder.name} export differs from Keras (cosine distance {distance:.2e} "
+                    f"> {EMBEDDING_TOLERANCE:g})"
+                )
+        os.replace(partial, output)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    logger.info(f"Wrote {output} ({os.path.getsize(output) / 1e6:.1f} MB)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export Facenet512 to ONNX")
+    parser.add_argument('--output', default=os.path.join(MODEL_DIR, FACENET_ONNX))
+    parser.add_argument('--opset', type=int, default=13)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    export(args.output, args.opset)
+
+
+if __name__ == "__main__":
+    main()
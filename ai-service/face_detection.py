@@ -0,0 +1,525 @@
+"""
+Face Detection
+Native OpenCV detector backends (Haar and LBP cascades, YuNet) run on a
+downscaled working image, with the face chip cropped and aligned from the
+full-resolution image
+"""
+
+import math
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CASCADE_DIR = cv2.data.haarcascades if hasattr(cv2, 'data') else os.path.join(
+    os.path.dirname(cv2.__file__), 'data'
+)
+FACE_CASCADE = "haarcascade_frontalface_default.xml"
+EYE_CASCADE = "haarcascade_eye.xml"
+
+# Model files that opencv-python does not bundle are read from here
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "models")
+LBP_CASCADE = "lbpcascade_frontalface_improved.xml"  # opencv/data/lbpcascades
+LBP_WINDOW = 45  # Training window of LBP_CASCADE
+YUNET_MODEL = "face_detection_yunet_2023mar.onnx"  # opencv_zoo/models/face_detection_yunet
+
+# Detector backends run in-process on the working image; the rest go
+# through DeepFace.extract_faces, which aligns every face it finds
+NATIVE_DETECTORS = ("opencv", "lbp", "yunet")
+DEEPFACE_DETECTORS = ("ssd", "dlib", "mtcnn", "retinaface", "mediapipe")
+DETECTOR_BACKENDS = NATIVE_DETECTORS + DEEPFACE_DETECTORS
+
+# Vertical span of a Haar face box that contains the eyes, as fractions of its height
+EYE_BAND = (0.15, 0.6)
+# Widest eye window searched, as a fraction of the face width
+MAX_EYE_WIDTH = 0.4
+# Context added around a face box before YuNet looks for its landmarks,
+# as a fraction of the box size on each side, and the width it is scaled to
+LANDMARK_MARGIN = 0.25
+LANDMARK_SEARCH_WIDTH = 160
+
+
+def parse_roi_hint(text: str) -> Tuple[float, float, float, float]:
+    """
+    Parse a region-of-interest hint sent by a client
+
+    Args:
+        text: "x,y,w,h" as fractions of the image width and height
+
+    Returns:
+        (x, y, w, h) tuple of floats
+
+    Raises:
+        ValueError: Not four numbers, or the box does not overlap the image
+    """
+    parts = text.split(",")
+    if len(parts) != 4:
+        raise ValueError("expected x,y,w,h")
+    x, y, w, h = (float(part) for part in parts)
+    if not all(math.isfinite(value) for value in (x, y, w, h)):
+        raise ValueError("values must be finite")
+    if w <= 0 or h <= 0 or w > 1 or h > 1:
+        raise ValueError("w and h must be in (0, 1]")
+    if x >= 1 or y >= 1 or x + w <= 0 or y + h <= 0:
+        raise ValueError("box lies outside the image")
+    return x, y, w, h
+
+
+def roi_region(roi: Tuple[float, float, float, float], image_shape: Tuple[int, ...], margin: float) -> Dict:
+    """
+    Pixel box searched for a hinted face
+
+    Args:
+        roi: Normalized (x, y, w, h) from parse_roi_hint
+        image_shape: Shape of the image the box applies to
+        margin: Fraction of the hint's width and height added on each side
+
+    Returns:
+        x/y/w/h in pixels, clipped to the image
+    """
+    height, width = image_shape[:2]
+    x, y, w, h = roi
+    x0 = max(0, round((x - w * margin) * width))
+    y0 = max(0, round((y - h * margin) * height))
+    x1 = min(width, round((x + w * (1 + margin)) * width))
+    y1 = min(height, round((y + h * (1 + margin)) * height))
+    return {'x': x0, 'y': y0, 'w': max(0, x1 - x0), 'h': max(0, y1 - y0)}
+
+
+def parse_detector_list(text: str) -> Tuple[str, ...]:
+    """
+    Parse a comma-separated list of detector backend names
+
+    Raises:
+        ValueError: A name is not one of DETECTOR_BACKENDS
+    """
+    names = tuple(name.strip() for name in text.split(",") if name.strip())
+    unknown = [name for name in names if name not in DETECTOR_BACKENDS]
+    if unknown:
+        raise ValueError(
+            f"unknown detector backend {', '.join(unknown)}; expected one of: {', '.join(DETECTOR_BACKENDS)}"
+        )
+    return names
+
+
+def create_detector(name: str, model_dir: str = MODEL_DIR, **kwargs) -> "FaceDetector":
+    """
+    Build a native detector backend
+
+    Args:
+        name: One of NATIVE_DETECTORS
+        model_dir: Directory holding model files opencv-python does not bundle
+        **kwargs: Passed to the detector's constructor
+
+    Raises:
+        ValueError: Not a native backend
+    """
+    if name == "opencv":
+        return HaarFaceDetector(**kwargs)
+    if name == "lbp":
+        return LBPFaceDetector(model_dir, **kwargs)
+    if name == "yunet":
+        return YuNetFaceDetector(model_dir, **kwargs)
+    raise ValueError(f"{name} is not a native detector backend")
+
+
+class FaceDetector:
+    """
+    Interface of a native detector backend
+
+    Subclasses implement detect(); backends that locate landmarks override
+    detect_faces() to add the eye centres, which spares the eye search
+    during alignment.
+    """
+
+    name = ""
+    detection_face_size = 36  # Pixels a minimum-size face spans in the working image
+
+    def load(self) -> None:
+        """Load model files for the calling thread"""
+
+    def working_factor(self, min_face_size: float) -> float:
+        """Downscale factor for detection; never upscales"""
+        return min(1.0, self.detection_face_size / max(min_face_size, 1.0))
+
+    def detect(self, image: np.ndarray, min_face_size: float) -> List[Tuple[Dict, float]]:
+        """
+        Find faces in a BGR image
+
+        Args:
+            image: Decoded BGR image
+            min_face_size: Smallest accepted face, in pixels of `image`
+
+        Returns:
+            List of (region, confidence); regions are x/y/w/h in pixels of `image`
+        """
+        raise NotImplementedError
+
+    def detect_faces(self, image: np.ndarray, min_face_size: float) -> List[Dict]:
+        """
+        detect() in the face format of DeepFace.extract_faces
+
+        Returns:
+            List of dicts with facial_area, confidence, face (always None;
+            the caller aligns) and optionally eyes
+        """
+        return [
+            {'facial_area': region, 'confidence': confidence, 'face': None}
+            for region, confidence in self.detect(image, min_face_size)
+        ]
+
+
+def _working_image(image: np.ndarray, factor: float) -> np.ndarray:
+    if factor < 1.0:
+        size = (max(1, round(image.shape[1] * factor)), max(1, round(image.shape[0] * factor)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+    return image
+
+
+def _full_resolution_box(box, factor: float, image_shape: Tuple[int, ...]) -> Dict:
+    x, y, w, h = box
+    height, width = image_shape[:2]
+    x0, y0 = max(0, int(x / factor)), max(0, int(y / factor))
+    x1, y1 = min(width, int(round((x + w) / factor))), min(height, int(round((y + h) / factor)))
+    return {'x': x0, 'y': y0, 'w': x1 - x0, 'h': y1 - y0}
+
+
+class HaarFaceDetector(FaceDetector):
+    """
+    Haar-cascade face detector that never scans more pixels than needed
+
+    The image is downscaled so that a face of the minimum accepted size
+    spans `detection_face_size` pixels, and the cascade's smallest window
+    is its own training window. Faces well below the minimum are never
+    scanned for, while faces somewhat below it are still found so callers
+    can report them as too small. Detection parameters match DeepFace's
+    opencv backend (scale factor 1.1, 10 neighbours, reject-level scores).
+
+    Whatever the detector backend, the accepted face is aligned here. Its
+    eye centres come from the detector's landmarks, YuNet's find_eyes()
+    when that model is installed, or this class's eye-band search.
+    """
+
+    name = "opencv"
+
+    def __init__(
+        self,
+        detection_face_size: int = 36,
+        window_size: int = 24,
+        scale_factor: float = 1.1,
+        min_neighbors: int = 10,
+        eye_search_width: int = 100,
+        face_cascade: str = FACE_CASCADE
+    ):
+        """
+        Args:
+            detection_face_size: Pixels a minimum-size face spans in the working image
+            window_size: Cascade training window; the smallest window scanned
+            scale_factor: Pyramid step between scanned window sizes
+            min_neighbors: Overlapping hits required to keep a detection
+            eye_search_width: Face width the eye band is scaled to for the eye search
+            face_cascade: Face cascade file, in CASCADE_DIR or an absolute path
+        """
+        self.face_cascade = face_cascade
+        self.detection_face_size = detection_face_size
+        self.window_size = window_size
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.eye_search_width = eye_search_width
+        # CascadeClassifier is not safe to share between threads
+        self._local = threading.local()
+
+    def _cascade(self, name: str) -> cv2.CascadeClassifier:
+        cascade = getattr(self._local, name, None)
+        if cascade is None:
+            path = os.path.join(CASCADE_DIR, name)
+            cascade = cv2.CascadeClassifier(path) if os.path.isfile(path) else None
+            if cascade is None or cascade.empty():
+                raise RuntimeError(f"Could not load cascade {path}")
+            setattr(self._local, name, cascade)
+        return cascade
+
+    def load(self) -> None:
+        """Load the cascades for the calling thread"""
+        self._cascade(self.face_cascade)
+        self._cascade(EYE_CASCADE)
+
+    def detect(self, image: np.ndarray, min_face_size: float) -> List[Tuple[Dict, float]]:
+        factor = self.working_factor(min_face_size)
+        gray = cv2.cvtColor(_working_image(image, factor), cv2.COLOR_BGR2GRAY)
+
+        faces, _, scores = self._cascade(self.face_cascade).detectMultiScale3(
+            gray,
+            scaleFactor=self.scale_factor,
+            minNeighbors=self.min_neighbors,
+            minSize=(self.window_size, self.window_size),
+            outputRejectLevels=True
+        )
+
+        # Map the boxes back to the full-resolution image
+        return [
+            (_full_resolution_box(box, factor, image.shape), float(score))
+            for box, score in zip(faces, scores)
+        ]
+
+    def find_eyes(self, image: np.ndarray, region: Dict) -> Optional[Tuple[Tuple[float, float], Tuple[float, float]]]:
+        """
+        Eye centres of a detected face, from the eye cascade
+
+        Only the band of the face box where eyes can be is searched, scaled
+        so the face is `eye_search_width` pixels wide, with eye windows
+        capped at a fraction of that width. That is a small fraction of a
+        search over the whole face crop at chip size.
+
+        Args:
+            image: Decoded BGR image
+            region: Face box in pixels of `image`
+
+        Returns:
+            ((x, y), (x, y)) ordered left to right, relative to the face box
+            in pixels of `image`, or None when fewer than two eyes are found
+        """
+        x, y, w, h = region['x'], region['y'], region['w'], region['h']
+        top, bottom = EYE_BAND
+        band_top = int(h * top)
+        band = image[y + band_top:y + int(h * bottom), x:x + w]
+
+        factor = self.eye_search_width / w
+        interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_LINEAR
+        band = cv2.resize(band, None, fx=factor, fy=factor, interpolation=interpolation)
+        gray = cv2.cvtColor(band, cv2.COLOR_BGR2GRAY)
+
+        largest_eye = int(self.eye_search_width * MAX_EYE_WIDTH)
+        eyes = self._cascade(EYE_CASCADE).detectMultiScale(
+            gray, 1.1, 10, maxSize=(largest_eye, largest_eye)
+        )
+        if len(eyes) < 2:
+            return None
+
+        # The eye cascade may return more than two hits; keep the largest
+        largest = sorted(eyes, key=lambda eye: eye[2] * eye[3], reverse=True)[:2]
+        left, right = sorted(
+            ((ex + ew / 2) / factor, (ey + eh / 2) / factor + band_top) for ex, ey, ew, eh in largest
+        )
+        return left, right
+
+    def align(
+        self,
+        image: np.ndarray,
+        region: Dict,
+        target_size: Tuple[int, int],
+        eyes: Optional[Tuple[Tuple[float, float], Tuple[float, float]]] = None
+    ) -> np.ndarray:
+        """
+        Warp a face to the model input size in one similarity transform
+
+        Same geometry as DeepFace's opencv alignment: the face box is
+        scaled to fit the target, rotated about its centre so the eyes are
+        level, and letterboxed with black bars.
+
+        Args:
+            image: Decoded BGR image
+            region: Face box in pixels of `image`
+            target_size: Model input (height, width)
+            eyes: Eye centres from find_eyes() or the detector; None skips
+                the rotation
+
+        Returns:
+            BGR float32 chip in [0, 1] of shape target_size + (3,)
+        """
+        x, y, w, h = region['x'], region['y'], region['w'], region['h']
+        face = image[y:y + h, x:x + w]
+
+        angle = 0.0
+        if eyes is not None:
+            (left_x, left_y), (right_x, right_y) = eyes
+            angle = math.degrees(math.atan2(right_y - left_y, right_x - left_x))
+
+        target_height, target_width = target_size
+        factor = min(target_height / h, target_width / w)
+        if factor < 0.5:
+            # warpAffine has no area filter; shrink large faces to twice the
+            # chip size first so the single warp does not alias
+            face = cv2.resize(face, None, fx=2 * factor, fy=2 * factor, interpolation=cv2.INTER_AREA)
+            h, w = face.shape[:2]
+            factor = min(target_height / h, target_width / w)
+        size = (max(1, int(w * factor)), max(1, int(h * factor)))
+        left = (target_width - size[0]) // 2
+        top = (target_height - size[1]) // 2
+
+        # Scale to chip size (with cv2.resize's pixel-centre convention),
+        # rotate about the scaled box centre, then shift into the letterbox
+        transform = cv2.getRotationMatrix2D((size[0] / 2, size[1] / 2), angle, 1.0)
+        shift = 0.5 * factor - 0.5
+        transform[:, 2] += transform[:, :2] @ (shift, shift) + (left, top)
+        transform[:, :2] *= factor
+        warped = cv2.warpAffine(face, transform, (target_width, target_height), flags=cv2.INTER_LINEAR)
+
+        if angle:
+            # Rotated corners must not spill into the letterbox bars
+            warped[:top] = 0
+            warped[top + size[1]:] = 0
+            warped[:, :left] = 0
+            warped[:, left + size[0]:] = 0
+        return np.multiply(warped, np.float32(1.0 / 255), dtype=np.float32)
+
+
+class LBPFaceDetector(HaarFaceDetector):
+    """
+    LBP-cascade face detector
+
+    Integer features make each window cheaper to evaluate than Haar, at
+    some cost in recall on dim or low-contrast faces. The cascade's larger
+    training window means the working image is downscaled less, keeping
+    the same ratio of minimum face to window as the Haar detector.
+    """
+
+    name = "lbp"
+
+    def __init__(
+        self,
+        model_dir: str = MODEL_DIR,
+        detection_face_size: int = 36,
+        window_size: int = 24,
+        **kwargs
+    ):
+        """
+        Args:
+            model_dir: Directory holding LBP_CASCADE
+            detection_face_size: Working-image face size the Haar detector
+                uses with `window_size`; scaled to the LBP window
+            window_size: Haar training window `detection_face_size` goes with
+            **kwargs: Other HaarFaceDetector settings
+        """
+        super().__init__(
+            detection_face_size=round(detection_face_size * LBP_WINDOW / window_size),
+            window_size=LBP_WINDOW,
+            face_cascade=os.path.join(model_dir, LBP_CASCADE),
+            **kwargs
+        )
+
+
+class YuNetFaceDetector(FaceDetector):
+    """
+    YuNet CNN face detector through cv2.FaceDetectorYN (OpenCV DNN)
+
+    Finds faces down to about 10 pixels, so the working image is
+    downscaled further than for the cascades, and returns five landmarks
+    per face; the eye centres are passed on for alignment. find_eyes()
+    also serves as the landmark model for faces other backends found.
+    """
+
+    name = "yunet"
+
+    def __init__(
+        self,
+        model_dir: str = MODEL_DIR,
+        detection_face_size: int = 24,
+        score_threshold: float = 0.6,
+        nms_threshold: float = 0.3,
+        **kwargs
+    ):
+        """
+        Args:
+            model_dir: Directory holding YUNET_MODEL
+            detection_face_size: Pixels a minimum-size face spans in the working image
+            score_threshold: Lowest face score kept
+            nms_threshold: Overlap above which weaker boxes are suppressed
+            **kwargs: Cascade settings, accepted for a uniform constructor
+        """
+        self.model_path = os.path.join(model_dir, YUNET_MODEL)
+        self.detection_face_size = detection_face_size
+        self.score_threshold = score_threshold
+        self.nms_threshold = nms_threshold
+        # FaceDetectorYN keeps per-input-size state
+        self._local = threading.local()
+
+    def _model(self) -> "cv2.FaceDetectorYN":
+        model = getattr(self._local, 'model', None)
+        if model is None:
+            if not os.path.isfile(self.model_path):
+                raise RuntimeError(f"YuNet model not found at {self.model_path}")
+            model = cv2.FaceDetectorYN.create(
+                self.model_path, "", (320, 320), self.score_threshold, self.nms_threshold
+            )
+            self._local.model = model
+        return model
+
+    def available(self) -> bool:
+        """Whether the model file is installed"""
+        return os.path.isfile(self.model_path)
+
+    def load(self) -> None:
+        self._model()
+
+    def _faces(self, image: np.ndarray, min_face_size: float):
+        factor = self.working_factor(min_face_size)
+        working = _working_image(image, factor)
+        model = self._model()
+        model.setInputSize((working.shape[1], working.shape[0]))
+        _, faces = model.detect(working)
+        return factor, faces if faces is not None else []
+
+    def detect(self, image: np.ndarray, min_face_size: float) -> List[Tuple[Dict, float]]:
+        factor, faces = self._faces(image, min_face_size)
+        return [(_full_resolution_box(face[:4], factor, image.shape), float(face[14])) for face in faces]
+
+    def detect_faces(self, image: np.ndarray, min_face_size: float) -> List[Dict]:
+        factor, faces = self._faces(image, min_face_size)
+        results = []
+        for face in faces:
+            region = _full_resolution_box(face[:4], factor, image.shape)
+            results.append({
+                'facial_area': region,
+                'confidence': float(face[14]),
+                'face': None,
+                'eyes': _eye_landmarks(face, factor, region['x'], region['y'])
+            })
+        return results
+
+    def find_eyes(self, image: np.ndarray, region: Dict) -> Optional[Tuple[Tuple[float, float], Tuple[float, float]]]:
+        """
+        Eye centres of a face found by another detector, from YuNet landmarks
+
+        YuNet runs on the face box plus LANDMARK_MARGIN of context, scaled
+        to LANDMARK_SEARCH_WIDTH, and the face nearest the box centre is
+        used. Same contract as HaarFaceDetector.find_eyes.
+
+        Returns:
+            ((x, y), (x, y)) ordered left to right, relative to the face box
+            in pixels of `image`, or None when YuNet finds no face there
+        """
+        x, y, w, h = region['x'], region['y'], region['w'], region['h']
+        height, width = image.shape[:2]
+        x0, y0 = max(0, int(x - w * LANDMARK_MARGIN)), max(0, int(y - h * LANDMARK_MARGIN))
+        x1 = min(width, int(x + w * (1 + LANDMARK_MARGIN)))
+        y1 = min(height, int(y + h * (1 + LANDMARK_MARGIN)))
+        crop = image[y0:y1, x0:x1]
+        if crop.size == 0:
+            return None
+
+        factor = LANDMARK_SEARCH_WIDTH / crop.shape[1]
+        interpolation = cv2.INTER_AREA if factor < 1 else cv2.INTER_LINEAR
+        crop = cv2.resize(crop, None, fx=factor, fy=factor, interpolation=interpolation)
+        model = self._model()
+        model.setInputSize((crop.shape[1], crop.shape[0]))
+        _, faces = model.detect(crop)
+        if faces is None or len(faces) == 0:
+            return None
+
+        centre = ((x + w / 2 - x0) * factor, (y + h / 2 - y0) * factor)
+        face = min(faces, key=lambda f: (f[0] + f[2] / 2 - centre[0]) ** 2 + (f[1] + f[3] / 2 - centre[1]) ** 2)
+        return _eye_landmarks(face, factor, x - x0, y - y0)
+
+
+def _eye_landmarks(face: np.ndarray, factor: float, origin_x: float, origin_y: float):
+    """Eye centres (landmarks 0 and 1) of a YuNet row, left to right, relative to a box origin"""
+    return tuple(sorted(
+        (float(face[i] / factor - origin_x), float(face[i + 1] / factor - origin_y))
+        for i in (4, 6)
+    ))
@@ -0,0 +1,428 @@
+"""
+Face Gallery
+In-memory gallery of enrolled templates for 1:N identification
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+
+from ann_index import VectorIndex
+
+logger = logging.getLogger(__name__)
+
+# Marks that a whole-gallery reload happened while the index was training
+_ALL = object()
+
+# Append-log records: op, identity length, identity bytes, then the
+# float32 template for adds
+_OP_ADD = 1
+_OP_REMOVE = 2
+_RECORD_HEADER = struct.Struct('<BH')
+
+# Shared state file: snapshot generation, log length in bytes, log records
+_STATE = struct.Struct('<qqq')
+
+
+class FaceGallery:
+    """
+    Enrolled templates held as one contiguous, pre-normalized float32 matrix
+
+    Scoring a probe is a single matrix-vector product over the used rows
+    followed by argpartition for the top-k, so search cost is one pass over
+    the matrix regardless of k. Removal moves the last row into the freed
+    slot to keep the used rows contiguous.
+
+    When `path` is given the gallery is persisted and kept in sync across
+    processes on the same host. Each add or remove appends one record to
+    `<path>.log` under an exclusive file lock, so a write costs one
+    template, not the whole gallery. Once the log outgrows
+    `compact_ratio` of the gallery it is folded into the `<path>` snapshot
+    and truncated. A small memory-mapped `<path>.state` file holds the
+    snapshot generation and log length: checking for other workers'
+    changes is a read from that mapping, and only new records are replayed.
+
+    With an ANN `index` (see ann_index.py) searches only score the index's
+    candidates, re-ranked exactly against the float32 templates. The index
+    is used once build_index() has trained it and is kept up to date on
+    every add and remove.
+    """
+
+    def __init__(
+        self,
+        dimension: int = 512,
+        path: Optional[str] = None,
+        initial_capacity: int = 1024,
+        index: Optional[VectorIndex] = None,
+        rerank_candidates: int = 64,
+        compact_ratio: float = 0.5,
+        compact_min_records: int = 1024
+    ):
+        """
+        Args:
+            dimension: Embedding dimension
+            path: Snapshot file shared by workers; None keeps the gallery in memory
+            initial_capacity: Rows allocated up front
+            index: Optional ANN index for large galleries
+            rerank_candidates: Minimum index candidates re-ranked exactly per query
+            compact_ratio: Compact once log records exceed this fraction of the gallery
+            compact_min_records: Never compact a log shorter than this
+        """
+        self.dimension = dimension
+        self.path = path
+        self.index = index
+        self.rerank_candidates = rerank_candidates
+        self.compact_ratio = compact_ratio
+        self.compact_min_records = compact_min_records
+        self._matrix = np.zeros((max(1, initial_capacity), dimension), dtype=np.float32)
+        self._ids: List[str] = []
+        self._rows = {}
+        self._lock = threading.RLock()
+        self._generation = None
+        self._log_offset = 0
+        self._state_map = None
+        # IDs changed while build_index() trains off-lock; None when idle
+        self._index_changes = None
+        self._build_lock = threading.Lock()
+
+        if path:
+            self._open_state()
+            self._refresh()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, identity_id: str) -> bool:
+        self._refresh()
+        return identity_id in self._rows
+
+    def _normalize(self, embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        if vector.shape[0] != self.dimension:
+            raise ValueError(
+                f"Embedding has {vector.shape[0]} dimensions, gallery expects {self.dimension}"
+            )
+        norm = np.linalg.norm(vector)
+        if not np.isfinite(norm) or norm == 0:
+            raise ValueError("Embedding must be a finite, non-zero vector")
+        return vector / norm
+
+    def _grow(self, required: int) -> None:
+        capacity = self._matrix.shape[0]
+        if required <= capacity:
+            return
+        while capacity < required:
+            capacity *= 2
+        matrix = np.zeros((capacity, self.dimension), dtype=np.float32)
+        matrix[:len(self._ids)] = self._matrix[:len(self._ids)]
+        self._matrix = matrix
+
+    def _add_normalized(self, identity_id: str, vector: np.ndarray) -> None:
+        row = self._rows.get(identity_id)
+        if row is None:
+            row = len(self._ids)
+            self._grow(row + 1)
+            self._ids.append(identity_id)
+            self._rows[identity_id] = row
+        self._matrix[row] = vector
+
+    def _remove(self, identity_id: str) -> bool:
+        row = self._rows.pop(identity_id, None)
+        if row is None:
+            return False
+        last = len(self._ids) - 1
+        if row != last:
+            moved_id = self._ids[last]
+            self._matrix[row] = self._matrix[last]
+            self._ids[row] = moved_id
+            self._rows[moved_id] = row
+        self._ids.pop()
+        return True
+
+    def _apply_add(self, identity_id: str, vector: np.ndarray) -> None:
+        self._add_normalized(identity_id, vector)
+        self._note_index_change(identity_id)
+        if self.index is not None and self.index.trained:
+            self.index.add([identity_id], vector[np.newaxis])
+
+    def _apply_remove(self, identity_id: str) -> bool:
+        self._note_index_change(identity_id)
+        if self.index is not None and self.index.trained:
+            self.index.remove(identity_id)
+        return self._remove(identity_id)
+
+    def add(self, identity_id: str, embedding) -> None:
+        """
+        Add or replace the template for an identity
+
+        Args:
+            identity_id: Caller's identifier (e.g. user ID)
+            embedding: Face embedding from enrollment
+
+        Raises:
+            ValueError: Wrong dimension or zero/non-finite embedding
+        """
+        vector = self._normalize(embedding)
+        with self._write():
+            self._apply_add(identity_id, vector)
+            self._append(_OP_ADD, identity_id, vector)
+
+    def remove(self, identity_id: str) -> bool:
+        """
+        Remove an identity from the gallery
+
+        Returns:
+            True if the identity was enrolled
+        """
+        with self._write():
+            removed = self._apply_remove(identity_id)
+            if removed:
+                self._append(_OP_REMOVE, identity_id)
+            return removed
+
+    def build_index(self) -> None:
+        """
+        Train the ANN index on the current templates and load them into it
+
+        Training and filling the lists run on a copy so searches continue
+        against the previous index meanwhile. The new index is swapped in
+        under the gallery lock, after replaying any adds and removes made
+        during training. Call again after large growth to rebalance.
+        """
+        if self.index is None:
+            return
+        with self._build_lock:
+            self._refresh()
+            with self._lock:
+                count = len(self._ids)
+                ids = list(self._ids)
+                vectors = self._matrix[:count].copy()
+                if count:
+                    self._index_changes = set()
+            if count == 0:
+                return
+
+            try:
+                prepared = self.index.prepare(vectors, ids)
+            except Exception:
+                with self._lock:
+                    self._index_changes = None
+                raise
+
+            with self._lock:
+                changes, self._index_changes = self._index_changes, None
+                self.index.install(prepared)
+                if changes is _ALL:
+                    self._reindex()
+                else:
+                    for identity_id in changes:
+                        row = self._rows.get(identity_id)
+                        if row is None:
+                            self.index.remove(identity_id)
+                        else:
+                            self.index.add([identity_id], self._matrix[row:row + 1])
+            logger.info(f"Built {self.index.name} index over {len(self._ids)} identities")
+
+    def _note_index_change(self, identity_id: str) -> None:
+        if self._index_changes is not None and self._index_changes is not _ALL:
+            self._index_changes.add(identity_id)
+
+    def _reindex(self) -> None:
+        self.index.reload(list(self._ids), self._matrix[:len(self._ids)])
+
+    def search(self, embedding, top_k: int = 5) -> List[Tuple[str, float]]:
+        """
+        Find the enrolled identities closest to a probe embedding
+
+        Args:
+            embedding: Probe face embedding
+            top_k: Number of candidates to return
+
+        Returns:
+            List of (identity_id, cosine_distance) sorted by distance
+        """
+        probe = self._normalize(embedding)
+        self._refresh()
+
+        with self._lock:
+            count = len(self._ids)
+            if count == 0 or top_k < 1:
+                return []
+
+            if self.index is not None and self.index.trained:
+                # Exact re-rank of the index's candidates only
+                wanted = max(top_k * 8, self.rerank_candidates)
+                rows = np.array(
+                    [self._rows[i] for i in self.index.candidates(probe, wanted) if i in self._rows],
+                    dtype=np.int64
+                )
+                if len(rows) == 0:
+                    return []
+                similarities = self._matrix[rows] @ probe
+            else:
+                rows = None
+                similarities = self._matrix[:count] @ probe
+
+            k = min(top_k, len(similarities))
+            if k < len(similarities):
+                best = np.argpartition(similarities, len(similarities) - k)[len(similarities) - k:]
+            else:
+                best = np.arange(len(similarities))
+            best = best[np.argsort(-similarities[best])]
+
+            return [
+                (self._ids[i if rows is None else rows[i]], float(1.0 - similarities[i]))
+                for i in best
+            ]
+
+    def stats(self) -> Dict:
+        """Gallery size and index state for /metrics"""
+        stats = {'size': len(self._ids), 'persisted': bool(self.path)}
+        stats['index'] = self.index.stats() if self.index is not None else {'index': 'exact'}
+        return stats
+
+    def compact(self) -> None:
+        """Fold the append log into the snapshot file"""
+        if not self.path:
+            return
+        with self._write():
+            self._compact()
+
+    # Persistence
+
+    @contextmanager
+    def _file_lock(self, operation):
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            fcntl.flock(lock_file, operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _open_state(self) -> None:
+        with self._file_lock(fcntl.LOCK_EX):
+            with open(f"{self.path}.state", 'a+b') as state_file:
+                if os.fstat(state_file.fileno()).st_size < _STATE.size:
+                    state_file.truncate(_STATE.size)
+                self._state_map = mmap.mmap(state_file.fileno(), _STATE.size)
+
+    def _read_state(self) -> Tuple[int, int, int]:
+        return _STATE.unpack_from(self._state_map, 0)
+
+    def _refresh(self) -> None:
+        """Catch up with changes other processes made; a no-op read when there are none"""
+        if not self.path:
+            return
+        generation, log_length, _ = self._read_state()
+        if generation == self._generation and log_length == self._log_offset:
+            return
+        with self._lock, self._file_lock(fcntl.LOCK_SH):
+            self._sync()
+
+    def _sync(self) -> None:
+        """Load a newer snapshot and replay unseen log records; file lock held"""
+        generation, log_length, _ = self._read_state()
+        if generation != self._generation:
+            self._load_snapshot()
+            self._generation = generation
+            self._log_offset = 0
+        if log_length > self._log_offset:
+            with open(f"{self.path}.log", 'rb') as log_file:
+                log_file.seek(self._log_offset)
+                self._replay(log_file.read(log_length - self._log_offset))
+            self._log_offset = log_length
+
+    def _load_snapshot(self) -> None:
+        if os.path.exists(self.path):
+            with np.load(self.path, allow_pickle=False) as snapshot:
+                ids = [str(i) for i in snapshot['ids']]
+                embeddings = snapshot['embeddings']
+            if embeddings.shape[1:] != (self.dimension,):
+                raise ValueError(f"Gallery file {self.path} has wrong embedding dimension")
+        else:
+            ids, embeddings = [], np.zeros((0, self.dimension), dtype=np.float32)
+        self._ids = ids
+        self._rows = {identity_id: row for row, identity_id in enumerate(ids)}
+        self._matrix = np.zeros((max(1024, len(ids) * 2), self.dimension), dtype=np.float32)
+        self._matrix[:len(ids)] = embeddings
+        if self.index is not None and self.index.trained:
+            self._reindex()
+        if self._index_changes is not None:
+            self._index_changes = _ALL
+        logger.info(f"Loaded face gallery with {len(ids)} identities from {self.path}")
+
+    def _replay(self, records: bytes) -> None:
+        vector_size = self.dimension * 4
+        offset = 0
+        while offset < len(records):
+            op, id_length = _RECORD_HEADER.unpack_from(records, offset)
+            offset += _RECORD_HEADER.size
+            identity_id = records[offset:offset + id_length].decode('utf-8')
+            offset += id_length
+            if op == _OP_ADD:
+                vector = np.frombuffer(records, dtype=np.float32, count=self.dimension, offset=offset)
+                offset += vector_size
+                self._apply_add(identity_id, vector.copy())
+            elif op == _OP_REMOVE:
+                self._apply_remove(identity_id)
+            else:
+                raise ValueError(f"Gallery log {self.path}.log is corrupt at byte {offset}")
+
+    def _append(self, op: int, identity_id: str, vector: Optional[np.ndarray] = None) -> None:
+        """Append one record to the log; exclusive file lock held"""
+        if not self.path:
+            return
+        encoded = identity_id.encode('utf-8')
+        record = _RECORD_HEADER.pack(op, len(encoded)) + encoded
+        if vector is not None:
+            record += vector.astype(np.float32).tobytes()
+
+        generation, log_length, log_records = self._read_state()
+        with open(f"{self.path}.log", 'ab') as log_file:
+            # Drop any tail a crashed writer left past the recorded length
+            log_file.truncate(log_length)
+            log_file.write(record)
+        log_length += len(record)
+        log_records += 1
+        _STATE.pack_into(self._state_map, 0, generation, log_length, log_records)
+        self._log_offset = log_length
+
+        if log_records > max(self.compact_min_records, self.compact_ratio * len(self._ids)):
+            self._compact()
+
+    def _compact(self) -> None:
+        """Write the snapshot and truncate the log; exclusive file lock held"""
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(
+                f,
+                ids=np.array(self._ids, dtype=str),
+                embeddings=self._matrix[:len(self._ids)]
+            )
+        os.replace(temp_path, self.path)
+        # Replaying the old log over the new snapshot is idempotent, so a
+        # crash before this point loses nothing
+        with open(f"{self.path}.log", 'ab') as log_file:
+            log_file.truncate(0)
+        generation = self._read_state()[0] + 1
+        _STATE.pack_into(self._state_map, 0, generation, 0, 0)
+        self._generation = generation
+        self._log_offset = 0
+        logger.info(f"Compacted face gallery log into {self.path} ({len(self._ids)} identities)")
+
+    @contextmanager
+    def _write(self):
+        with self._lock:
+            if not self.path:
+                yield
+                return
+            with self._file_lock(fcntl.LOCK_EX):
+                self._sync()
+                yield
@@ -5,31 +5,44 @@ Core logic for face detection, embedding generation, and verification
 
 import cv2
 import numpy as np
-# Environment configuration
-import os
-os.environ['TF_KERAS'] = '1'
-
-# NOTE: Patching is done in startup_patch.py which is imported in main.py before this module
-# So the LocallyConnected2D should already be available
 
-# Delay DeepFace import to avoid import conflicts
+# DeepFace (and with it TensorFlow) is imported on first use, so importing
+# this module, the test runner and the TensorFlow-free engines stay fast
 deepface_module = None
 
 def get_deepface():
     global deepface_module
     if deepface_module is None:
-        # Import DeepFace after patches are applied
-        import deepface as df
+        # Import DeepFace after the compatibility patch is applied
+        import startup_patch
+        startup_patch.apply()
+        from deepface import DeepFace as df
         deepface_module = df
     return deepface_module
 
-# Import other modules we need
-import cv2
-import numpy as np
-from typing import Dict, List, Tuple
+import os
+from typing import Dict, List, Optional, Tuple
 import logging
+import threading
+import time
 from io import BytesIO
-from PIL import Image
+from PIL import Image, ImageOps
+
+from embedding_batcher import EmbeddingBatcher
+from embedding_engines import (
+    COMPILED_MODES,
+    ENGINES,
+    DnnEmbedder,
+    KerasEmbedder,
+    check_precision,
+    compiled_batch_sizes,
+    create_embedder
+)
+from face_detection import DETECTOR_BACKENDS, MODEL_DIR, NATIVE_DETECTORS, HaarFaceDetector, create_detector, roi_region
+from metrics import Counter, Histogram
+from model_store import KERAS_WEIGHTS, build_keras_model, has_arrays
+from quality_gates import QualityGates
+from result_cache import ResultCache, image_key
 
 logger = logging.getLogger(__name__)
 
@@ -55,6 +68,22 @@ class InvalidImageException(Exception):
     pass
 
 
+# cv2.imdecode flags per JPEG reduction factor (DCT-domain scaling)
+REDUCED_DECODE_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+# Model load states reported by /ready
+MODEL_NOT_LOADED = "not_loaded"
+MODEL_LOADING = "loading"
+MODEL_READY = "ready"
+MODEL_FAILED = "failed"
+
+
 class FaceRecognitionService:
     """
     Face Recognition Service using DeepFace
@@ -63,44 +92,336 @@ class FaceRecognitionService:
     
     # Configuration
     MODEL_NAME = "Facenet512"  # High accuracy model (512-dim embeddings)
-    DETECTOR_BACKEND = "opencv"  # Fast and reliable
+    DETECTOR_BACKEND = "opencv"  # Default detector; see face_detection.DETECTOR_BACKENDS
+    MODEL_INPUT_SIZE = (160, 160)  # Facenet512 input resolution
+    EMBEDDING_DIMENSION = 512  # Facenet512 embedding length
     VERIFICATION_THRESHOLD = 0.40  # Cosine distance threshold (lower = stricter)
     MIN_FACE_SIZE = 80  # Minimum face dimension in pixels
     MIN_IMAGE_SIZE = 150  # Minimum image dimension
     MAX_IMAGE_SIZE = 4096  # Maximum image dimension
+    MAX_IMAGE_PIXELS = 4096 * 4096  # Decompression-bomb limit, checked from the header
+    ALLOWED_IMAGE_FORMATS = ("JPEG", "MPO", "PNG", "WEBP", "BMP", "TIFF", "GIF")
+    DECODE_MIN_SIDE = 1080  # Reduced JPEG decoding keeps at least this shorter side
+    DETECTOR_MIN_WINDOW = 24  # Smallest face the Haar cascade finds (its training window)
+    DETECTION_FACE_SIZE = 36  # Pixels a MIN_FACE_SIZE face spans in the downscaled detection image
+    ROI_MARGIN = 0.25  # Fraction of a client ROI hint's size also searched on each side
+    GATE_MIN_SHARPNESS = 10.0  # Minimum Laplacian variance of the frame scaled to GATE_FRAME_SIDE
+    GATE_MAX_CLIPPED_FRACTION = 0.5  # Largest share of near-black or near-white frame pixels
+    GATE_EDGE_MARGIN = 2  # Pixels a face box must keep from the frame edge
+    GATE_MAX_YAW = 40.0  # Degrees, estimated from the eye positions
+    GATE_MAX_ROLL = 30.0  # Degrees, from the line between the eyes
+    GATE_FRAME_SIDE = 320  # Longest side of the frame copy the blur and exposure gates use
     QUALITY_THRESHOLD = 30.0  # Minimum quality score
+    WARMUP_IMAGE_SIZE = (480, 640)  # Height, width of the synthetic warmup frame
+    ALIGNMENT_MODES = ("landmarks", "none")  # Eye-levelling similarity warp, or box crop only
     
-    def __init__(self):
-        """Initialize the face recognition service"""
+    def __init__(
+        self,
+        batch_max_size: int = 1,
+        batch_max_wait_ms: float = 5.0,
+        result_cache_size: int = 0,
+        result_cache_ttl_seconds: float = 30.0,
+        alignment: str = "landmarks",
+        detector_backend: Optional[str] = None,
+        detector_model_dir: str = MODEL_DIR,
+        engine: str = "deepface",
+        engine_options: Optional[Dict] = None,
+        precision: str = "fp32",
+        compiled_inference: str = "off",
+        model_store: bool = True
+    ):
+        """
+        Initialize the face recognition service
+        
+        Args:
+            batch_max_size: Chips per batched forward pass; 1 disables micro-batching
+            batch_max_wait_ms: Longest a chip waits for others to join its batch
+            result_cache_size: Results cached by image hash; 0 disables the cache
+            result_cache_ttl_seconds: Lifetime of a cached result
+            alignment: "landmarks" levels the eyes, "none" skips alignment
+            detector_backend: Default detector, one of DETECTOR_BACKENDS;
+                None uses DETECTOR_BACKEND
+            detector_model_dir: Directory with the LBP cascade, YuNet and
+                Facenet512 ONNX model files
+            engine: "deepface" runs Facenet512 through DeepFace/TensorFlow;
+                "opencv-dnn" and "onnxruntime" run its ONNX export through
+                cv2.dnn or ONNX Runtime and default to the yunet detector,
+                so TensorFlow is not imported
+            engine_options: Engine settings such as the onnxruntime thread
+                counts, see embedding_engines.OnnxRuntimeEmbedder
+            precision: Embedding precision, one of the engine's
+                embedding_engines.ENGINE_PRECISIONS
+            compiled_inference: For the deepface engine, "on" or "xla"
+                calls Facenet512 through a tf.function traced for the chip
+                shape and every batch size up to batch_max_size, instead
+                of DeepFace.represent; see embedding_engines.COMPILED_MODES
+            model_store: Load Facenet512 weights from the memory-mapped
+                model store in detector_model_dir when it has been built
+                (compiled deepface and onnxruntime fp32), see model_store
+        """
         logger.info(f"Initializing FaceRecognitionService with model: {self.MODEL_NAME}")
         
-        # Don't pre-load model to avoid startup issues
-        # Model will be loaded on first use
+        if alignment not in self.ALIGNMENT_MODES:
+            raise ValueError(f"alignment must be one of: {', '.join(self.ALIGNMENT_MODES)}")
+        self.alignment = alignment
+        
+        if detector_backend is not None and detector_backend not in DETECTOR_BACKENDS:
+            raise ValueError(f"detector_backend must be one of: {', '.join(DETECTOR_BACKENDS)}")
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of: {', '.join(ENGINES)}")
+        check_precision(engine, precision)
+        if compiled_inference not in COMPILED_MODES:
+            raise ValueError(f"compiled_inference must be one of: {', '.join(COMPILED_MODES)}")
+        if compiled_inference != "off" and engine != "deepface":
+            raise ValueError(f"compiled_inference applies to the deepface engine, not {engine}")
+        self.engine = engine
+        self.compiled_inference = compiled_inference
+        self.model_store = model_store
+        self.precision = precision
+        self._precision_policy_set = False
+        
+        # Engines other than deepface embed with an ONNX export and detect
+        # with a native backend, so nothing imports TensorFlow
+        self.embedder = None
+        if engine != "deepface":
+            if detector_backend is None:
+                detector_backend = "yunet"
+            if detector_backend not in NATIVE_DETECTORS:
+                raise ValueError(
+                    f"The {engine} engine needs a native detector ({', '.join(NATIVE_DETECTORS)})"
+                )
+            self.embedder = create_embedder(
+                engine, detector_model_dir, precision, model_store, **(engine_options or {})
+            )
+        elif compiled_inference != "off":
+            # The service holds Facenet512 itself and skips DeepFace.represent
+            self.embedder = KerasEmbedder(
+                self._build_keras_model,
+                self.MODEL_INPUT_SIZE,
+                batch_sizes=compiled_batch_sizes(batch_max_size),
+                jit_compile=compiled_inference == "xla"
+            )
+        self.detector_backend = detector_backend
+        self.detector_model_dir = detector_model_dir
+        
+        # Coalesce concurrent embedding requests into batched forward passes
+        self.embedding_batcher: Optional[EmbeddingBatcher] = None
+        if batch_max_size > 1:
+            self.embedding_batcher = EmbeddingBatcher(
+                self._embed_batch,
+                max_batch_size=batch_max_size,
+                max_wait_ms=batch_max_wait_ms
+            )
+        
+        # Haar detection on a downscaled working image (the "opencv"
+        # backend); it also aligns faces found by every native backend
+        self.face_detector = HaarFaceDetector(
+            detection_face_size=self.DETECTION_FACE_SIZE,
+            window_size=self.DETECTOR_MIN_WINDOW
+        )
+        # Other native backends are created on first use
+        self._native_detectors = {"opencv": self.face_detector}
+        self._native_detectors_lock = threading.Lock()
+        self._landmark_detector = None
+        
+        # Cheap checks that reject unusable images before the embedding model
+        self.quality_gates = QualityGates(
+            min_sharpness=self.GATE_MIN_SHARPNESS,
+            max_clipped_fraction=self.GATE_MAX_CLIPPED_FRACTION,
+            edge_margin=self.GATE_EDGE_MARGIN,
+            max_yaw=self.GATE_MAX_YAW,
+            max_roll=self.GATE_MAX_ROLL,
+            frame_side=self.GATE_FRAME_SIDE
+        )
+        self.embed_time_ms = Histogram()
+        
+        # How often a client ROI hint spares the full-frame detection pass
+        self.roi_hits = Counter()
+        self.roi_fallbacks = Counter()
+        
+        # Retried requests with identical image bytes reuse the first result
+        self.result_cache: Optional[ResultCache] = None
+        if result_cache_size > 0:
+            self.result_cache = ResultCache(
+                max_entries=result_cache_size,
+                ttl_seconds=result_cache_ttl_seconds
+            )
+        
+        # Models load on first use unless warmup() is called at startup
+        self.model_state = MODEL_NOT_LOADED
+        self.warmup_duration_ms: Optional[float] = None
+        self.warmup_error: Optional[str] = None
         logger.info("Face recognition service initialized. Models will load on first use.")
     
-    def _load_image_from_bytes(self, image_data: bytes) -> np.ndarray:
+    def warmup(self) -> float:
+        """
+        Load the detector and embedding model and run a dummy inference
+        through the full pipeline
+        
+        Returns:
+            Warmup duration in milliseconds
+            
+        Raises:
+            Exception: Model loading or inference failed; model_state is set to failed
+        """
+        logger.info("Warming up face detector and embedding model...")
+        self.model_state = MODEL_LOADING
+        start = time.perf_counter()
+        
+        try:
+            # Load the detector's model files up front: detection errors on
+            # the warmup frame below are indistinguishable from no face
+            detector = self._native_detector(self._backend())
+            if detector is not None:
+                detector.load()
+            if self.alignment == "landmarks":
+                self._landmarker().load()
+            
+            # Decode + detection on a synthetic frame; no face is expected.
+            # It is textured so the blur and exposure gates let it through
+            height, width = self.WARMUP_IMAGE_SIZE
+            frame = np.random.default_rng(0).integers(60, 200, size=(height, width, 3), dtype=np.uint8)
+            _, encoded = cv2.imencode('.jpg', frame)
+            try:
+                self._process_image(encoded.tobytes())
+            except (FaceNotDetectedException, MultipleFacesException, LowQualityImageException):
+                pass
+            
+            # Embedding model on a blank chip (via the batcher when enabled)
+            self._generate_embedding(np.zeros(self.MODEL_INPUT_SIZE + (3,), dtype=np.float32))
+            
+        except Exception as e:
+            self.model_state = MODEL_FAILED
+            self.warmup_error = str(e)
+            logger.error(f"Model warmup failed: {str(e)}")
+            raise
+        
+        self.warmup_duration_ms = round((time.perf_counter() - start) * 1000, 2)
+        self.model_state = MODEL_READY
+        logger.info(f"Model warmup completed in {self.warmup_duration_ms:.0f}ms")
+        
+        return self.warmup_duration_ms
+    
+    def after_fork(self) -> None:
+        """Restart background threads in a worker forked from a preloaded process"""
+        if self.embedding_batcher is not None:
+            self.embedding_batcher.after_fork()
+        if isinstance(self.embedder, DnnEmbedder):
+            # Worker threads take the network this thread loaded and warmed
+            self.embedder.release()
+    
+    def close(self) -> None:
+        """Release background resources"""
+        if self.embedding_batcher is not None:
+            self.embedding_batcher.close()
+    
+    def _read_image_header(self, image_data: bytes) -> Tuple[int, int, str]:
+        """
+        Read image dimensions and format without decoding pixel data
+        
+        Args:
+            image_data: Raw image bytes
+            
+        Returns:
+            Tuple of (width, height, format) as stored, before EXIF rotation
+            
+        Raises:
+            InvalidImageException: Unreadable header or unsupported format
+            LowQualityImageException: Declared size beyond the pixel limit
+        """
+        try:
+            # PIL only parses the header here; pixel data is never decoded
+            with Image.open(BytesIO(image_data)) as probe:
+                width, height = probe.size
+                image_format = probe.format
+        except Image.DecompressionBombError:
+            raise LowQualityImageException(
+                f"Image too large. Maximum size: {self.MAX_IMAGE_SIZE}x{self.MAX_IMAGE_SIZE}px"
+            )
+        except Exception as e:
+            raise InvalidImageException(f"Failed to load image: {str(e)}")
+        
+        if image_format not in self.ALLOWED_IMAGE_FORMATS:
+            raise InvalidImageException(
+                f"Unsupported image format: {image_format}. "
+                f"Allowed: {', '.join(self.ALLOWED_IMAGE_FORMATS)}"
+            )
+        
+        return width, height, image_format
+    
+    def _decode_scale(self, width: int, height: int, image_format: str) -> int:
+        """
+        Pick a JPEG DCT-domain reduction factor for oversized images
+        
+        The reduced image keeps at least DECODE_MIN_SIDE pixels on its
+        shorter side, and a face of MIN_FACE_SIZE stays at least
+        DETECTOR_MIN_WINDOW pixels so it can still be detected.
+        
+        Returns:
+            1, 2, 4 or 8
+        """
+        if image_format not in ("JPEG", "MPO"):
+            return 1
+        
+        for scale in (8, 4, 2):
+            if (min(width, height) // scale >= self.DECODE_MIN_SIDE
+                    and self.MIN_FACE_SIZE / scale >= self.DETECTOR_MIN_WINDOW):
+                return scale
+        return 1
+    
+    def _load_image_from_bytes(self, image_data: bytes, scale: int = 1) -> np.ndarray:
         """
         Load image from bytes and convert to numpy array
         
+        OpenCV reads the upload bytes in place and decodes straight to BGR,
+        applying EXIF orientation, so the decoded frame is the only
+        full-size allocation. Formats OpenCV cannot decode fall back to PIL.
+        
+        Args:
+            image_data: Raw image bytes
+            scale: JPEG reduction factor from _decode_scale
+            
+        Returns:
+            numpy array (BGR format for OpenCV)
+        """
+        try:
+            image = cv2.imdecode(np.frombuffer(image_data, dtype=np.uint8), REDUCED_DECODE_FLAGS[scale])
+        except cv2.error:
+            image = None
+        
+        if image is not None:
+            return image
+        
+        return self._load_image_with_pil(image_data, scale)
+    
+    def _load_image_with_pil(self, image_data: bytes, scale: int = 1) -> np.ndarray:
+        """
+        Fallback decoder for formats OpenCV does not read
+        
         Args:
             image_data: Raw image bytes
+            scale: JPEG reduction factor from _decode_scale
             
         Returns:
             numpy array (BGR format for OpenCV)
         """
         try:
-            # Convert bytes to PIL Image
             pil_image = Image.open(BytesIO(image_data))
+            if scale > 1:
+                # JPEG DCT scaling, same as OpenCV's reduced modes
+                width, height = pil_image.size
+                pil_image.draft('RGB', (width // scale, height // scale))
+            
+            # Upright per EXIF orientation
+            pil_image = ImageOps.exif_transpose(pil_image)
             
             # Convert to RGB if necessary
             if pil_image.mode != 'RGB':
                 pil_image = pil_image.convert('RGB')
             
-            # Convert to numpy array
-            img_array = np.array(pil_image)
-            
-            # Convert RGB to BGR for OpenCV
-            img_bgr = cv2.cvtColor(img_array, cv2.COLOR_RGB2BGR)
+            # Convert to numpy array, then RGB to BGR in the same buffer
+            img_bgr = np.array(pil_image)
+            cv2.cvtColor(img_bgr, cv2.COLOR_RGB2BGR, dst=img_bgr)
             
             return img_bgr
             
@@ -118,13 +439,22 @@ class FaceRecognitionService:
             LowQualityImageException: If image is too small or too large
         """
         height, width = image.shape[:2]
+        self._validate_dimensions(width, height)
+    
+    def _validate_dimensions(self, width: int, height: int) -> None:
+        """
+        Validate image dimensions, usually straight from the header
         
+        Raises:
+            LowQualityImageException: If image is too small or too large
+        """
         if height < self.MIN_IMAGE_SIZE or width < self.MIN_IMAGE_SIZE:
             raise LowQualityImageException(
                 f"Image too small. Minimum size: {self.MIN_IMAGE_SIZE}x{self.MIN_IMAGE_SIZE}px"
             )
         
-        if height > self.MAX_IMAGE_SIZE or width > self.MAX_IMAGE_SIZE:
+        if (height > self.MAX_IMAGE_SIZE or width > self.MAX_IMAGE_SIZE
+                or width * height > self.MAX_IMAGE_PIXELS):
             raise LowQualityImageException(
                 f"Image too large. Maximum size: {self.MAX_IMAGE_SIZE}x{self.MAX_IMAGE_SIZE}px"
             )
@@ -175,33 +505,151 @@ class FaceRecognitionService:
             logger.warning(f"Quality calculation failed: {str(e)}")
             return 50.0  # Default neutral score
     
-    def _detect_face(self, image: np.ndarray) -> Tuple[Dict, float]:
+    def _backend(self, detector: Optional[str] = None) -> str:
+        """Detector backend for a request: its override, else the service default"""
+        return detector or self.detector_backend or self.DETECTOR_BACKEND
+    
+    def _native_detector(self, name: str):
+        """The native detector for a backend name, or None for DeepFace backends"""
+        if name not in NATIVE_DETECTORS:
+            return None
+        detector = self._native_detectors.get(name)
+        if detector is None:
+            with self._native_detectors_lock:
+                detector = self._native_detectors.get(name)
+                if detector is None:
+                    detector = create_detector(name, self.detector_model_dir)
+                    self._native_detectors[name] = detector
+        return detector
+    
+    def _landmarker(self):
+        """
+        Source of eye centres for faces found without landmarks: YuNet when
+        its model is installed, else the Haar detector's eye-band search
+        """
+        if self._landmark_detector is None:
+            yunet = self._native_detector("yunet")
+            if yunet.available():
+                self._landmark_detector = yunet
+            else:
+                logger.info(f"YuNet model not found at {yunet.model_path}; aligning from the eye cascade")
+                self._landmark_detector = self.face_detector
+        return self._landmark_detector
+    
+    def _find_faces(
+        self,
+        image: np.ndarray,
+        scale: int = 1,
+        region: Optional[Dict] = None,
+        detector: Optional[str] = None
+    ) -> List[Dict]:
         """
-        Detect face in image with quality checks
+        Run the face detector
+        
+        Native backends (face_detection.NATIVE_DETECTORS) run on a
+        downscaled working image and leave alignment to the caller ('face'
+        is None); other backends go through DeepFace.extract_faces, which
+        aligns every face.
         
         Args:
             image: Image as numpy array
+            scale: Original pixels per image pixel
+            region: Only search this box (pixels of `image`)
+            detector: Backend override for this call
             
         Returns:
-            Tuple of (face_region_dict, quality_score)
+            List of dicts with facial_area (pixels of `image`), confidence
+            and face (BGR float32 chip or None); detectors that produce
+            landmarks may add eyes (centres relative to facial_area)
+        """
+        if region is not None:
+            x, y = region['x'], region['y']
+            face_objs = self._find_faces(image[y:y + region['h'], x:x + region['w']], scale, detector=detector)
+            for face in face_objs:
+                area = dict(face['facial_area'])
+                area['x'] += x
+                area['y'] += y
+                face['facial_area'] = area
+            return face_objs
+        
+        backend = self._backend(detector)
+        native = self._native_detector(backend)
+        if native is not None:
+            return native.detect_faces(image, self.MIN_FACE_SIZE / scale)
+        if self.engine != "deepface":
+            raise ValueError(f"The {self.engine} engine cannot run the {backend} detector")
+        
+        DeepFace = get_deepface()
+        face_objs = DeepFace.extract_faces(
+            img_path=image,
+            target_size=self.MODEL_INPUT_SIZE,
+            detector_backend=backend,
+            enforce_detection=False,
+            align=self.alignment != "none"
+        )
+        for face in face_objs:
+            # extract_faces returns RGB; the model expects the BGR order
+            # DeepFace.represent feeds it internally
+            face['face'] = np.ascontiguousarray(face['face'][:, :, ::-1], dtype=np.float32)
+        return face_objs
+    
+    def _detect_face(
+        self,
+        image: np.ndarray,
+        scale: int = 1,
+        roi: Optional[Tuple[float, float, float, float]] = None,
+        detector: Optional[str] = None
+    ) -> Tuple[Dict, float, np.ndarray, Optional[bool]]:
+        """
+        Detect and align face in image with quality checks
+        
+        A single detection pass yields the face region, the quality score and
+        the aligned face chip at the model input size, so the embedding model
+        never has to run detection again.
+        
+        With an ROI hint, only the hinted box (widened by ROI_MARGIN) is
+        searched first; the full frame is searched only when no confident
+        face is found there. Faces outside the box are not considered when
+        the hint hits.
+        
+        Quality gates run around detection: blur and exposure on the whole
+        frame before it, face-at-edge and head pose after it, so unusable
+        images never reach the embedding model.
+        
+        Args:
+            image: Image as numpy array
+            scale: Original pixels per image pixel (reduced JPEG decode);
+                face_region and the MIN_FACE_SIZE check use original pixels
+            roi: Normalized (x, y, w, h) where the client expects the face
+            detector: Detector backend override, see _find_faces
+            
+        Returns:
+            Tuple of (face_region_dict, quality_score, face_chip, roi_hit)
+            face_chip is BGR float32 in [0, 1] at MODEL_INPUT_SIZE;
+            roi_hit is None without a hint
             
         Raises:
             FaceNotDetectedException: No face found
             MultipleFacesException: Multiple faces found
-            LowQualityImageException: Face too small or poor quality
+            LowQualityImageException: Face too small, poor quality or
+                rejected by a quality gate
         """
         try:
-            # Detect faces using OpenCV's Haar Cascade
-            DeepFace = get_deepface()
-            face_objs = DeepFace.extract_faces(
-                img_path=image,
-                detector_backend=self.DETECTOR_BACKEND,
-                enforce_detection=False,
-                align=True
-            )
+            reason = self.quality_gates.check_frame(image)
+            if reason:
+                raise LowQualityImageException(reason)
+            
+            valid_faces = []
+            roi_hit = None
+            if roi is not None:
+                region = roi_region(roi, image.shape, self.ROI_MARGIN)
+                min_side = self.MIN_FACE_SIZE / scale
+                if region['w'] >= min_side and region['h'] >= min_side:
+                    valid_faces = self._confident_faces(self._find_faces(image, scale, region, detector))
+                roi_hit = bool(valid_faces)
             
-            # Filter out low-confidence detections
-            valid_faces = [face for face in face_objs if face.get('confidence', 0) > 0.9]
+            if not valid_faces:
+                valid_faces = self._confident_faces(self._find_faces(image, scale, detector=detector))
             
             if len(valid_faces) == 0:
                 raise FaceNotDetectedException(
@@ -213,8 +661,9 @@ class FaceRecognitionService:
                     f"Multiple faces detected ({len(valid_faces)}). Please provide image with single face."
                 )
             
-            # Get the face region
-            face_region = valid_faces[0]['facial_area']
+            # Get the face region, in original image pixels
+            detected_region = valid_faces[0]['facial_area']
+            face_region = {key: int(detected_region[key]) * scale for key in ('x', 'y', 'w', 'h')}
             
             # Check face size
             face_width = face_region['w']
@@ -226,8 +675,12 @@ class FaceRecognitionService:
                     f"Minimum: {self.MIN_FACE_SIZE}x{self.MIN_FACE_SIZE}px"
                 )
             
+            reason = self.quality_gates.check_edges(detected_region, image.shape)
+            if reason:
+                raise LowQualityImageException(reason)
+            
             # Calculate quality score
-            quality_score = self._calculate_quality_score(image, face_region)
+            quality_score = self._calculate_quality_score(image, detected_region)
             
             if quality_score < self.QUALITY_THRESHOLD:
                 raise LowQualityImageException(
@@ -235,12 +688,26 @@ class FaceRecognitionService:
                     f"Please provide clearer image with better lighting."
                 )
             
+            # Only the accepted face is aligned, in a single warp from
+            # landmarks the detector produced or from _landmarker()
+            face_chip = valid_faces[0]['face']
+            if face_chip is None:
+                eyes = valid_faces[0].get('eyes')
+                if eyes is None and self.alignment == "landmarks":
+                    eyes = self._landmarker().find_eyes(image, detected_region)
+                reason = self.quality_gates.check_pose(eyes, detected_region['w'])
+                if reason:
+                    raise LowQualityImageException(reason)
+                if self.alignment == "none":
+                    eyes = None
+                face_chip = self.face_detector.align(image, detected_region, self.MODEL_INPUT_SIZE, eyes)
+            
             logger.info(
                 f"Face detected - Size: {face_width}x{face_height}px, "
                 f"Quality: {quality_score:.1f}/100"
             )
             
-            return face_region, quality_score
+            return face_region, quality_score, face_chip, roi_hit
             
         except FaceNotDetectedException:
             raise
@@ -252,25 +719,45 @@ class FaceRecognitionService:
             logger.error(f"Face detection error: {str(e)}")
             raise FaceNotDetectedException(f"Face detection failed: {str(e)}")
     
-    def _generate_embedding(self, image: np.ndarray) -> List[float]:
+    @staticmethod
+    def _confident_faces(face_objs: List[Dict]) -> List[Dict]:
+        """Filter out low-confidence detections"""
+        return [face for face in face_objs if face.get('confidence', 0) > 0.9]
+    
+    def _generate_embedding(self, face_chip: np.ndarray) -> List[float]:
         """
-        Generate face embedding using DeepFace
+        Generate face embedding from an aligned face chip
+        
+        Detection is skipped because the chip already comes from _detect_face.
         
         Args:
-            image: Image as numpy array
+            face_chip: Aligned face chip from _detect_face
             
         Returns:
             Face embedding as list of floats
         """
         try:
+            # Join a batched forward pass with other in-flight requests
+            if self.embedding_batcher is not None:
+                embedding = self.embedding_batcher.embed(face_chip).tolist()
+                self._mark_ready()
+                logger.info(f"Generated embedding with dimension: {len(embedding)}")
+                return embedding
+            
+            if self.embedder is not None:
+                embedding = self.embedder.embed(face_chip[np.newaxis])[0].tolist()
+                self._mark_ready()
+                logger.info(f"Generated embedding with dimension: {len(embedding)}")
+                return embedding
+            
             # Generate embedding
-            DeepFace = get_deepface()
+            DeepFace = self._embedding_deepface()
             embedding_objs = DeepFace.represent(
-                img_path=image,
+                img_path=face_chip,
                 model_name=self.MODEL_NAME,
-                detector_backend=self.DETECTOR_BACKEND,
-                enforce_detection=True,
-                align=True
+                detector_backend="skip",
+                enforce_detection=False,
+                align=False
             )
             
             if not embedding_objs:
@@ -278,6 +765,11 @@ class FaceRecognitionService:
             
             # Extract embedding vector
             embedding = embedding_objs[0]['embedding']
+            if self.precision != "fp32":
+                # Stored and compared as float32 whatever the compute precision
+                embedding = np.asarray(embedding, dtype=np.float32).tolist()
+            
+            self._mark_ready()
             
             logger.info(f"Generated embedding with dimension: {len(embedding)}")
             
@@ -287,6 +779,189 @@ class FaceRecognitionService:
             logger.error(f"Embedding generation error: {str(e)}")
             raise
     
+    def _mark_ready(self) -> None:
+        """A real embedding succeeded, so the models are loaded and working"""
+        if self.model_state == MODEL_FAILED:
+            logger.info(f"Models recovered after failed warmup ({self.warmup_error})")
+            self.model_state = MODEL_READY
+            self.warmup_error = None
+        elif self.model_state == MODEL_NOT_LOADED:
+            self.model_state = MODEL_READY
+    
+    def _embed_batch(self, face_chips: np.ndarray) -> np.ndarray:
+        """
+        Run one forward pass of the embedding model over a batch of chips
+        
+        Args:
+            face_chips: Aligned chips stacked as (N, height, width, 3)
+            
+        Returns:
+            Embeddings as (N, 512) array
+        """
+        if self.embedder is not None:
+            return self.embedder.embed(face_chips)
+        DeepFace = self._embedding_deepface()
+        model = DeepFace.build_model(self.MODEL_NAME)
+        return np.asarray(model.predict(face_chips, verbose=0), dtype=np.float32)
+    
+    def _build_keras_model(self):
+        """Facenet512 for the compiled path, from the model store when it has been built"""
+        DeepFace = self._embedding_deepface()
+        prefix = os.path.join(self.detector_model_dir, KERAS_WEIGHTS)
+        if self.model_store and has_arrays(prefix):
+            return build_keras_model(prefix)
+        return DeepFace.build_model(self.MODEL_NAME)
+    
+    def _embedding_deepface(self):
+        """DeepFace, with the Keras precision policy set before it builds Facenet512"""
+        if not self._precision_policy_set:
+            if self.precision == "bf16":
+                import tensorflow as tf
+                tf.keras.mixed_precision.set_global_policy("mixed_bfloat16")
+            self._precision_policy_set = True
+        return get_deepface()
+    
+    def _cache_config(self) -> str:
+        """Settings that change the pipeline result, part of the cache key"""
+        return "|".join(str(value) for value in (
+            self.MODEL_NAME,
+            self.engine,
+            self.precision,
+            self.compiled_inference,
+            self._backend(),
+            self.alignment,
+            self.MODEL_INPUT_SIZE,
+            self.MIN_FACE_SIZE,
+            self.MIN_IMAGE_SIZE,
+            self.MAX_IMAGE_SIZE,
+            self.QUALITY_THRESHOLD
+        ))
+    
+    def _process_image(
+        self,
+        image_data: bytes,
+        roi: Optional[Tuple[float, float, float, float]] = None,
+        detector: Optional[str] = None
+    ) -> Dict:
+        """
+        Run the decode -> detect/align -> embed pipeline on raw image bytes
+        
+        With the result cache enabled, identical image bytes are processed
+        once; repeats and concurrent duplicates get the same result, with
+        timings reduced to the lookup time (cache_ms).
+        
+        Args:
+            image_data: Raw image bytes
+            roi: Normalized (x, y, w, h) hint of where the face is, see _detect_face
+            detector: Detector backend override, see _find_faces
+            
+        Returns:
+            Dictionary with face_region, quality_score, embedding and
+            per-stage timings in milliseconds
+        """
+        if self.result_cache is None:
+            return self._run_pipeline(image_data, roi, detector)
+        
+        start = time.perf_counter()
+        computed = []
+        
+        def compute():
+            computed.append(True)
+            return self._run_pipeline(image_data, roi, detector)
+        
+        # The hint and detector can change which face is chosen, so they are
+        # part of the key
+        config = self._cache_config()
+        if roi is not None:
+            config += f"|roi={roi}"
+        if detector is not None and detector != self._backend():
+            config += f"|detector={detector}"
+        
+        result = self.result_cache.get_or_compute(image_key(image_data, config), compute)
+        if not computed:
+            result['timings'] = {'cache_ms': round((time.perf_counter() - start) * 1000, 2)}
+        return result
+    
+    def _run_pipeline(
+        self,
+        image_data: bytes,
+        roi: Optional[Tuple[float, float, float, float]] = None,
+        detector: Optional[str] = None
+    ) -> Dict:
+        """Uncached decode -> detect/align -> embed; see _process_image"""
+        # Validate format and size from the header before decoding
+        start = time.perf_counter()
+        width, height, image_format = self._read_image_header(image_data)
+        self._validate_dimensions(width, height)
+        
+        # Load image, reduced in the DCT domain if it is oversized
+        scale = self._decode_scale(width, height, image_format)
+        image = self._load_image_from_bytes(image_data, scale)
+        decode_ms = (time.perf_counter() - start) * 1000
+        
+        result = self._analyze_image(image, scale, roi, detector)
+        if result['roi_hit'] is not None:
+            (self.roi_hits if result['roi_hit'] else self.roi_fallbacks).inc()
+        timings = {'decode_ms': decode_ms, **result['timings']}
+        result['timings'] = {stage: round(ms, 2) for stage, ms in timings.items()}
+        
+        return result
+    
+    def _analyze_image(
+        self,
+        image: np.ndarray,
+        scale: int = 1,
+        roi: Optional[Tuple[float, float, float, float]] = None,
+        detector: Optional[str] = None
+    ) -> Dict:
+        """
+        Detect, align and embed the face in a decoded image
+        
+        Args:
+            image: Decoded BGR image
+            scale: Original pixels per image pixel, see _detect_face
+            roi: Normalized ROI hint, see _detect_face
+            detector: Detector backend override, see _find_faces
+            
+        Returns:
+            Dictionary with face_region, quality_score, embedding, roi_hit
+            and per-stage timings in milliseconds
+        """
+        timings = {}
+        
+        # Detect and align face with quality checks
+        start = time.perf_counter()
+        face_region, quality_score, face_chip, roi_hit = self._detect_face(image, scale, roi, detector)
+        timings['detect_ms'] = (time.perf_counter() - start) * 1000
+        
+        # Generate embedding from the aligned chip
+        start = time.perf_counter()
+        embedding = self._generate_embedding(face_chip)
+        timings['embed_ms'] = (time.perf_counter() - start) * 1000
+        self.embed_time_ms.observe(timings['embed_ms'])
+        
+        return {
+            'face_region': face_region,
+            'quality_score': quality_score,
+            'embedding': embedding,
+            'roi_hit': roi_hit,
+            'timings': timings
+        }
+    
+    def gate_stats(self) -> Dict:
+        """Quality gate counts, timings and the embedding compute they saved"""
+        return self.quality_gates.stats(self.embed_time_ms.mean)
+    
+    def roi_stats(self) -> Dict:
+        """How often an ROI hint found the face without a full-frame pass"""
+        hits, fallbacks = self.roi_hits.value, self.roi_fallbacks.value
+        hinted = hits + fallbacks
+        return {
+            'hits': hits,
+            'fallbacks': fallbacks,
+            'hit_ratio': round(hits / hinted, 4) if hinted else 0.0
+        }
+    
     def _calculate_similarity(self, embedding1: List[float], embedding2: List[float]) -> float:
         """
         Calculate cosine similarity between two embeddings
@@ -313,59 +988,60 @@ class FaceRecognitionService:
         
         return cosine_distance
     
-    def enroll_face(self, image_data: bytes) -> Dict:
+    def enroll_face(
+        self,
+        image_data: bytes,
+        roi: Optional[Tuple[float, float, float, float]] = None,
+        detector: Optional[str] = None
+    ) -> Dict:
         """
         Enroll a face: detect face and generate embedding
         
         Args:
             image_data: Raw image bytes
+            roi: Optional normalized (x, y, w, h) where the face should be
+            detector: Optional detector backend for this request
             
         Returns:
             Dictionary with embedding and metadata
         """
-        # Load image
-        image = self._load_image_from_bytes(image_data)
-        
-        # Validate image size
-        self._validate_image_size(image)
-        
-        # Detect face with quality checks
-        face_region, quality_score = self._detect_face(image)
-        
-        # Generate embedding
-        embedding = self._generate_embedding(image)
+        result = self._process_image(image_data, roi, detector)
+        face_region = result['face_region']
         
         return {
-            'embedding': embedding,
-            'quality_score': quality_score,
+            'embedding': result['embedding'],
+            'quality_score': result['quality_score'],
             'face_size': {
                 'width': face_region['w'],
                 'height': face_region['h']
-            }
+            },
+            'timings': result['timings']
         }
     
-    def verify_face(self, image_data: bytes, stored_embedding: List[float]) -> Dict:
+    def verify_face(
+        self,
+        image_data: bytes,
+        stored_embedding: List[float],
+        roi: Optional[Tuple[float, float, float, float]] = None,
+        detector: Optional[str] = None
+    ) -> Dict:
         """
         Verify a face against stored embedding
         
         Args:
             image_data: Raw image bytes
             stored_embedding: Previously stored face embedding
+            roi: Optional normalized (x, y, w, h) where the face should be
+            detector: Optional detector backend for this request
             
         Returns:
             Dictionary with match result and confidence
         """
-        # Load image
-        image = self._load_image_from_bytes(image_data)
-        
-        # Validate image size
-        self._validate_image_size(image)
-        
         # Detect face (basic liveness check - ensures it's not a static low-quality image)
-        face_region, quality_score = self._detect_face(image)
-        
-        # Generate embedding for current image
-        current_embedding = self._generate_embedding(image)
+        # and generate embedding for current image in a single pass
+        result = self._process_image(image_data, roi, detector)
+        current_embedding = result['embedding']
+        quality_score = result['quality_score']
         
         # Calculate similarity
         distance = self._calculate_similarity(current_embedding, stored_embedding)
@@ -390,5 +1066,48 @@ class FaceRecognitionService:
             'confidence': round(confidence, 2),
             'similarity_score': round(distance, 4),
             'threshold': self.VERIFICATION_THRESHOLD,
-            'quality_score': quality_score
+            'quality_score': quality_score,
+            'timings': result['timings']
+        }
+    
+    def identify_face(self, image_data: bytes, gallery, top_k: int = 5) -> Dict:
+        """
+        Identify a face against every template in a gallery (1:N)
+        
+        Args:
+            image_data: Raw image bytes
+            gallery: FaceGallery with enrolled templates
+            top_k: Number of candidates to return
+            
+        Returns:
+            Dictionary with ranked candidate matches
+        """
+        result = self._process_image(image_data)
+        
+        start = time.perf_counter()
+        candidates = gallery.search(result['embedding'], top_k=top_k)
+        search_ms = (time.perf_counter() - start) * 1000
+        
+        matches = [
+            {
+                'identity_id': identity_id,
+                'match': distance <= self.VERIFICATION_THRESHOLD,
+                'confidence': round(max(0, min(100, (1 - distance) * 100)), 2),
+                'similarity_score': round(distance, 4)
+            }
+            for identity_id, distance in candidates
+        ]
+        
+        logger.info(
+            f"Identification - Gallery size: {len(gallery)}, "
+            f"Best distance: {matches[0]['similarity_score'] if matches else None}, "
+            f"Search: {search_ms:.2f}ms"
+        )
+        
+        return {
+            'matches': matches,
+            'gallery_size': len(gallery),
+            'threshold': self.VERIFICATION_THRESHOLD,
+            'quality_score': result['quality_score'],
+            'timings': {**result['timings'], 'search_ms': round(search_ms, 2)}
         }
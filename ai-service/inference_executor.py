@@ -0,0 +1,138 @@
+"""
+Inference Executor
+Runs blocking face recognition work off the asyncio event loop with a
+fixed number of inference slots and a bounded wait queue
+"""
+
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+import logging
+
+from metrics import Histogram, Counter
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceQueueFullException(Exception):
+    """Raised when all inference slots are busy and the wait queue is full"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class InferenceExecutor:
+    """
+    Bounded executor for blocking inference calls
+
+    At most `slots` calls run concurrently and at most `max_queue` more may
+    wait for a slot. Anything beyond that is rejected immediately so callers
+    can shed load instead of timing out.
+    """
+
+    def __init__(self, slots: int = 1, max_queue: int = 8):
+        if slots < 1:
+            raise ValueError("slots must be at least 1")
+        if max_queue < 0:
+            raise ValueError("max_queue must not be negative")
+
+        self.slots = slots
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(max_workers=slots, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._pending = 0  # Queued + running
+        self._running = 0
+
+        # Metrics
+        self.wait_time_ms = Histogram()
+        self.run_time_ms = Histogram()
+        self.completed = Counter()
+        self.rejected = Counter()
+
+        logger.info(f"Inference executor started with {slots} slot(s), queue size {max_queue}")
+
+    @property
+    def queue_depth(self) -> int:
+        """Number of calls waiting for a free slot"""
+        with self._lock:
+            return self._pending - self._running
+
+    @property
+    def in_flight(self) -> int:
+        """Number of calls currently running"""
+        return self._running
+
+    def _retry_after(self) -> int:
+        """Estimate seconds until a queue position frees up"""
+        mean_run_s = self.run_time_ms.mean / 1000 or 1.0
+        waves = (self.max_queue + self.slots) / self.slots
+        return max(1, math.ceil(mean_run_s * waves))
+
+    def _release(self, _future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def run(self, fn: Callable, *args, **kwargs) -> Any:
+        """
+        Run a blocking callable in an inference slot
+
+        Args:
+            fn: Blocking callable
+            *args, **kwargs: Passed through to fn
+
+        Returns:
+            Result of fn
+
+        Raises:
+            InferenceQueueFullException: All slots busy and wait queue full
+        """
+        with self._lock:
+            if self._pending >= self.slots + self.max_queue:
+                self.rejected.inc()
+                raise InferenceQueueFullException(
+                    "Service is busy. Please retry shortly.",
+                    retry_after=self._retry_after()
+                )
+            self._pending += 1
+
+        enqueued_at = time.perf_counter()
+
+        def task():
+            started_at = time.perf_counter()
+            self.wait_time_ms.observe((started_at - enqueued_at) * 1000)
+            with self._lock:
+                self._running += 1
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._running -= 1
+                self.run_time_ms.observe((time.perf_counter() - started_at) * 1000)
+                self.completed.inc()
+
+        # The slot is released when the task finishes or is cancelled before
+        # starting, not when the awaiting request goes away
+        future = self._executor.submit(task)
+        future.add_done_callback(self._release)
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> Dict:
+        """Queue and latency metrics for /metrics"""
+        return {
+            'slots': self.slots,
+            'max_queue': self.max_queue,
+            'in_flight': self.in_flight,
+            'queue_depth': self.queue_depth,
+            'completed': self.completed.value,
+            'rejected': self.rejected.value,
+            'wait_time_ms': self.wait_time_ms.snapshot(),
+            'run_time_ms': self.run_time_ms.snapshot()
+        }
+
+    def shutdown(self) -> None:
+        """Stop accepting work and release worker threads"""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -3,13 +3,42 @@ Face Recognition Microservice for Attendance System
 A stateless AI service for face enrollment and verification
 """
 
-# Import patch first to handle compatibility issues
-import startup_patch
+import os
 
-from fastapi import FastAPI, HTTPException, File, UploadFile, status
-from fastapi.responses import JSONResponse
+# "local" runs the models in this process; "shared" sends decoded images to
+# the inference process started with `python shared_inference.py`
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "local")
+
+# "deepface" runs Facenet512 on TensorFlow; "opencv-dnn" and "onnxruntime"
+# run its ONNX export through cv2.dnn or ONNX Runtime without TensorFlow
+FACE_ENGINE = os.getenv("FACE_ENGINE", "deepface")
+# Embedding precision: fp32, or a reduced one the engine supports (bf16 for
+# deepface, fp16 for opencv-dnn, fp16/int8 for onnxruntime)
+EMBEDDING_PRECISION = os.getenv("EMBEDDING_PRECISION", "fp32")
+# deepface engine: "on" or "xla" calls Facenet512 through a traced
+# tf.function instead of DeepFace.represent
+COMPILED_INFERENCE = os.getenv("COMPILED_INFERENCE", "off")
+# Map Facenet512 weights from the model store (model_store.py) when built
+MODEL_STORE = os.getenv("MODEL_STORE", "true").lower() in ("1", "true", "yes")
+
+# Split the host's CPUs (and cgroup quota) between the WORKERS processes:
+# TensorFlow, OpenCV and BLAS thread counts, optionally pinned to CPUs.
+# Applied before any of them is imported; "off" keeps library defaults
+from thread_planner import THREAD_PLAN_MODES, apply_thread_plan
+
+THREAD_PLAN_MODE = os.getenv("THREAD_PLAN", "auto")
+if THREAD_PLAN_MODE not in THREAD_PLAN_MODES:
+    raise ValueError(f"THREAD_PLAN must be one of: {', '.join(THREAD_PLAN_MODES)}")
+WORKERS = int(os.getenv("WORKERS") or os.getenv("WEB_CONCURRENCY") or "1")
+CPU_PINNING = os.getenv("CPU_PINNING", "false").lower() in ("1", "true", "yes")
+THREAD_PLAN = apply_thread_plan(WORKERS, CPU_PINNING) if THREAD_PLAN_MODE == "auto" else None
+
+from fastapi import FastAPI, HTTPException, File, Form, Query, Request, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, Response
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Optional, List, Tuple
 import uvicorn
 import logging
 from datetime import datetime
@@ -19,8 +48,23 @@ from face_recognition_service import (
     FaceNotDetectedException,
     MultipleFacesException,
     LowQualityImageException,
-    InvalidImageException
+    InvalidImageException,
+    MODEL_READY
+)
+from inference_executor import InferenceExecutor, InferenceQueueFullException
+from face_gallery import FaceGallery
+from ann_index import create_index
+from embedding_codec import (
+    MEDIA_TYPE as EMBEDDING_MEDIA_TYPE,
+    EMBEDDING_FORMATS,
+    encode_embedding,
+    encode_embedding_base64,
+    decode_embedding,
+    decode_embedding_field
 )
+from template_cache import TemplateCache
+from face_detection import MODEL_DIR, NATIVE_DETECTORS, parse_detector_list, parse_roi_hint
+from shared_inference import RemoteFaceRecognitionService, DEFAULT_SOCKET, load_authkey
 
 # Configure logging
 logging.basicConfig(
@@ -28,21 +72,133 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+if THREAD_PLAN is not None:
+    logger.info(f"Thread plan: {THREAD_PLAN}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Application startup and shutdown"""
+    if EAGER_WARMUP:
+        # uvicorn starts listening only after startup completes, so traffic
+        # never reaches a worker with cold models
+        try:
+            await inference_executor.run(face_service.warmup)
+        except Exception:
+            logger.error("Starting without warm models; /ready will report not ready", exc_info=True)
+    if face_gallery.index is not None:
+        await run_in_threadpool(face_gallery.build_index)
+    yield
+    inference_executor.shutdown()
+    face_service.close()
+
 
 # Initialize FastAPI app
 app = FastAPI(
     title="Face Recognition Microservice",
     description="Stateless face recognition service for attendance systems",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Inference concurrency: slots run in parallel, the queue bounds how many
+# requests may wait for a slot before new ones are rejected with 503
+INFERENCE_SLOTS = int(os.getenv("INFERENCE_SLOTS", "1"))
+INFERENCE_QUEUE_SIZE = int(os.getenv("INFERENCE_QUEUE_SIZE", "8"))
+
+# Load models and run a dummy inference before accepting traffic
+EAGER_WARMUP = os.getenv("EAGER_WARMUP", "true").lower() in ("1", "true", "yes")
+
+# Micro-batching of embedding forward passes across concurrent requests.
+# Only useful with INFERENCE_SLOTS > 1; a batch size of 1 disables it
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "1"))
+EMBEDDING_BATCH_MAX_WAIT_MS = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+
+# Results cached by image hash, so client retries of the same bytes are
+# answered without recomputing; 0 disables the cache
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "256"))
+RESULT_CACHE_TTL_SECONDS = float(os.getenv("RESULT_CACHE_TTL_SECONDS", "30"))
+
+# "landmarks" levels the eyes before embedding; "none" skips alignment
+FACE_ALIGNMENT = os.getenv("FACE_ALIGNMENT", "landmarks")
+
+# Default face detector (unset: FaceRecognitionService.DETECTOR_BACKEND,
+# or yunet for the other engines), and the other backends a request
+# may pick with the `detector` form field
+DETECTOR_BACKEND = os.getenv("DETECTOR_BACKEND") or None
+EXTRA_DETECTOR_BACKENDS = parse_detector_list(os.getenv("ALLOWED_DETECTOR_BACKENDS", ""))
+DETECTOR_MODEL_DIR = os.getenv("DETECTOR_MODEL_DIR") or MODEL_DIR
+
+# ONNX Runtime threads per operator (unset: the thread plan's share, or
+# its default) and across operators (0: its default) and graph
+# optimization level, for FACE_ENGINE=onnxruntime
+ENGINE_OPTIONS = None
+if FACE_ENGINE == "onnxruntime":
+    ENGINE_OPTIONS = {
+        'intra_op_threads': int(
+            os.getenv("ORT_INTRA_OP_THREADS") or (THREAD_PLAN or {}).get('intra_op_threads', 0)
+        ),
+        'inter_op_threads': int(os.getenv("ORT_INTER_OP_THREADS", "0")),
+        'graph_optimization': os.getenv("ORT_GRAPH_OPTIMIZATION", "all")
+    }
+
 # Initialize face recognition service
-face_service = FaceRecognitionService()
+if INFERENCE_MODE == "shared":
+    face_service = RemoteFaceRecognitionService(
+        address=os.getenv("SHARED_INFERENCE_SOCKET", DEFAULT_SOCKET),
+        authkey=load_authkey(),
+        result_cache_size=RESULT_CACHE_SIZE,
+        result_cache_ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+        alignment=FACE_ALIGNMENT,
+        detector_backend=DETECTOR_BACKEND,
+        engine=FACE_ENGINE
+    )
+else:
+    face_service = FaceRecognitionService(
+        batch_max_size=EMBEDDING_BATCH_MAX_SIZE,
+        batch_max_wait_ms=EMBEDDING_BATCH_MAX_WAIT_MS,
+        result_cache_size=RESULT_CACHE_SIZE,
+        result_cache_ttl_seconds=RESULT_CACHE_TTL_SECONDS,
+        alignment=FACE_ALIGNMENT,
+        detector_backend=DETECTOR_BACKEND,
+        detector_model_dir=DETECTOR_MODEL_DIR,
+        engine=FACE_ENGINE,
+        engine_options=ENGINE_OPTIONS,
+        precision=EMBEDDING_PRECISION,
+        compiled_inference=COMPILED_INFERENCE,
+        model_store=MODEL_STORE
+    )
+ALLOWED_DETECTOR_BACKENDS = (face_service._backend(),) + EXTRA_DETECTOR_BACKENDS
+if FACE_ENGINE != "deepface" and not set(EXTRA_DETECTOR_BACKENDS) <= set(NATIVE_DETECTORS):
+    raise ValueError(f"ALLOWED_DETECTOR_BACKENDS must be native detectors with FACE_ENGINE={FACE_ENGINE}")
+
+# Enrolled templates for 1:N identification. With GALLERY_PATH set the
+# gallery is persisted and shared by all workers on this host
+# GALLERY_INDEX=ivf adds an approximate index for very large galleries
+face_gallery = FaceGallery(
+    dimension=FaceRecognitionService.EMBEDDING_DIMENSION,
+    path=os.getenv("GALLERY_PATH") or None,
+    index=create_index(
+        os.getenv("GALLERY_INDEX", "exact"),
+        dimension=FaceRecognitionService.EMBEDDING_DIMENSION,
+        n_probe=int(os.getenv("GALLERY_IVF_NPROBE", "16"))
+    )
+)
+
+# Templates sent to /verify, so repeat callers can send just the key
+template_cache = TemplateCache(
+    max_entries=int(os.getenv("TEMPLATE_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("TEMPLATE_CACHE_TTL_SECONDS", "3600"))
+)
+
+# Blocking inference runs here so the event loop stays responsive
+inference_executor = InferenceExecutor(slots=INFERENCE_SLOTS, max_queue=INFERENCE_QUEUE_SIZE)
 
 # Pydantic models for request/response validation
 class EnrollmentResponse(BaseModel):
     success: bool
     embedding: Optional[List[float]] = None
+    embedding_b64: Optional[str] = None
+    template_id: Optional[str] = None
     message: str
     face_detected: bool
     quality_score: Optional[float] = Field(None, ge=0, le=100)
@@ -58,6 +214,33 @@ class VerificationResponse(BaseModel):
     message: str
     similarity_score: Optional[float] = None
     threshold_used: float
+    template_id: Optional[str] = None
+    template_unknown: bool = False
+    timestamp: str
+
+class IdentificationMatch(BaseModel):
+    identity_id: str
+    match: bool
+    confidence: float = Field(..., ge=0, le=100)
+    similarity_score: float
+
+class IdentificationResponse(BaseModel):
+    success: bool
+    matches: List[IdentificationMatch]
+    message: str
+    gallery_size: int
+    threshold_used: float
+    quality_score: Optional[float] = Field(None, ge=0, le=100)
+    timestamp: str
+
+class GalleryEntryRequest(BaseModel):
+    embedding: List[float] = Field(..., description="Face embedding from enrollment")
+
+class GalleryResponse(BaseModel):
+    success: bool
+    identity_id: Optional[str] = None
+    gallery_size: int
+    message: str
     timestamp: str
 
 class HealthResponse(BaseModel):
@@ -65,6 +248,16 @@ class HealthResponse(BaseModel):
     service: str
     timestamp: str
 
+class ReadinessResponse(BaseModel):
+    ready: bool
+    model_state: str
+    warmup_duration_ms: Optional[float] = None
+    warmup_error: Optional[str] = None
+    queue_depth: int
+    in_flight: int
+    thread_plan: Optional[dict] = None
+    timestamp: str
+
 # Security logging
 class SecurityLogger:
     @staticmethod
@@ -76,6 +269,61 @@ class SecurityLogger:
 security_logger = SecurityLogger()
 
 
+def negotiate_embedding_format(request: Request, embedding_format: Optional[str]) -> str:
+    """
+    Pick the /enroll embedding encoding from the query flag or Accept header
+    
+    JSON stays the default so existing callers are unaffected.
+    """
+    if embedding_format is None:
+        accept = request.headers.get("accept", "")
+        return "binary" if EMBEDDING_MEDIA_TYPE in accept else "json"
+    if embedding_format not in EMBEDDING_FORMATS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"embedding_format must be one of: {', '.join(EMBEDDING_FORMATS)}"
+        )
+    return embedding_format
+
+
+def parse_roi(roi: Optional[str]) -> Optional[Tuple[float, float, float, float]]:
+    """Parse the optional ROI hint form field, rejecting malformed boxes"""
+    if not roi:
+        return None
+    try:
+        return parse_roi_hint(roi)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid roi: {str(e)}"
+        )
+
+
+def parse_detector(detector: Optional[str]) -> Optional[str]:
+    """Check the optional detector form field against ALLOWED_DETECTOR_BACKENDS"""
+    if not detector:
+        return None
+    if detector not in ALLOWED_DETECTOR_BACKENDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"detector must be one of: {', '.join(ALLOWED_DETECTOR_BACKENDS)}"
+        )
+    return detector
+
+
+def service_busy(exc: InferenceQueueFullException, endpoint: str) -> HTTPException:
+    """Build the fast-fail response for a full inference queue"""
+    logger.warning(
+        f"Inference queue full - Endpoint: {endpoint} | "
+        f"Queue depth: {inference_executor.queue_depth} | Retry-After: {exc.retry_after}s"
+    )
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(exc),
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
 @app.get("/", response_model=dict)
 async def root():
     """Root endpoint with API information"""
@@ -85,7 +333,11 @@ async def root():
         "endpoints": {
             "enrollment": "/enroll",
             "verification": "/verify",
-            "health": "/health"
+            "identification": "/identify",
+            "gallery": "/gallery/{identity_id}",
+            "health": "/health",
+            "readiness": "/ready",
+            "metrics": "/metrics"
         }
     }
 
@@ -100,8 +352,63 @@ async def health_check():
     )
 
 
+@app.get("/ready", response_model=ReadinessResponse)
+async def readiness_check():
+    """
+    Readiness endpoint for load balancers
+    
+    Returns 200 only once the models are loaded and warmed, 503 otherwise.
+    """
+    if INFERENCE_MODE == "shared" and face_service.model_state != MODEL_READY:
+        # The inference process warms on its own schedule
+        await run_in_threadpool(face_service.refresh_state)
+    ready = face_service.model_state == MODEL_READY
+    body = ReadinessResponse(
+        ready=ready,
+        model_state=face_service.model_state,
+        warmup_duration_ms=face_service.warmup_duration_ms,
+        warmup_error=face_service.warmup_error,
+        queue_depth=inference_executor.queue_depth,
+        in_flight=inference_executor.in_flight,
+        thread_plan=THREAD_PLAN,
+        timestamp=datetime.utcnow().isoformat()
+    )
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content=body.model_dump()
+    )
+
+
+@app.get("/metrics", response_model=dict)
+async def metrics():
+    """Inference queue depth, wait time, run time, batching histograms, cache, ROI hint and quality gate counters"""
+    response = {
+        "inference": inference_executor.stats(),
+        "timestamp": datetime.utcnow().isoformat()
+    }
+    if face_service.embedding_batcher is not None:
+        response["embedding_batcher"] = face_service.embedding_batcher.stats()
+    response["gallery"] = face_gallery.stats()
+    response["template_cache"] = template_cache.stats()
+    response["roi_hint"] = face_service.roi_stats()
+    try:
+        response["quality_gates"] = await run_in_threadpool(face_service.gate_stats)
+    except (OSError, EOFError) as e:
+        logger.warning(f"Quality gate stats unavailable: {str(e)}")
+    if face_service.result_cache is not None:
+        response["result_cache"] = face_service.result_cache.stats()
+    return response
+
+
 @app.post("/enroll", response_model=EnrollmentResponse, status_code=status.HTTP_200_OK)
-async def enroll_face(image: UploadFile = File(...)):
+async def enroll_face(
+    request: Request,
+    image: UploadFile = File(...),
+    identity_id: Optional[str] = Form(None),
+    roi: Optional[str] = Form(None),
+    detector: Optional[str] = Form(None),
+    embedding_format: Optional[str] = Query(None)
+):
     """
     Face Enrollment Endpoint
     
@@ -110,11 +417,22 @@ async def enroll_face(image: UploadFile = File(...)):
     
     Args:
         image: Image file (JPEG, PNG)
+        identity_id: Optional ID to also add the template to the 1:N gallery
+        roi: Optional "x,y,w,h" face guide box as fractions of the image
+            size; detection searches it first and falls back to the full frame
+        detector: Optional detector backend, one of ALLOWED_DETECTOR_BACKENDS
+        embedding_format: "json" (default), "base64" or "binary"; binary is
+            also selected by `Accept: application/x-face-embedding`
     
     Returns:
-        EnrollmentResponse with embedding vector or error details
+        EnrollmentResponse with embedding vector or error details, or the
+        raw encoded embedding for the binary format
     """
     try:
+        embedding_format = negotiate_embedding_format(request, embedding_format)
+        roi_hint = parse_roi(roi)
+        detector = parse_detector(detector)
+        
         # Read image data
         image_data = await image.read()
         
@@ -123,7 +441,7 @@ async def enroll_face(image: UploadFile = File(...)):
             security_logger.log_suspicious_activity(
                 endpoint="/enroll",
                 reason="Invalid file type",
-                content_type=image.content_type or "None"
+                details=f"Content type: {image.content_type or 'None'}"
             )
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -131,11 +449,32 @@ async def enroll_face(image: UploadFile = File(...)):
             )
         
         # Process face and generate embedding
-        result = face_service.enroll_face(image_data)
+        result = await inference_executor.run(face_service.enroll_face, image_data, roi_hint, detector)
+        
+        if identity_id:
+            await run_in_threadpool(face_gallery.add, identity_id, result['embedding'])
+        
+        template_id = template_cache.put(result['embedding'])
+        
+        if embedding_format == "binary":
+            return Response(
+                content=encode_embedding(result['embedding']),
+                media_type=EMBEDDING_MEDIA_TYPE,
+                headers={
+                    "X-Quality-Score": str(result.get('quality_score')),
+                    "X-Template-Id": template_id
+                }
+            )
+        
+        embedding_b64 = None
+        if embedding_format == "base64":
+            embedding_b64 = encode_embedding_base64(result['embedding'])
         
         return EnrollmentResponse(
             success=True,
-            embedding=result['embedding'],
+            embedding=result['embedding'] if embedding_format == "json" else None,
+            embedding_b64=embedding_b64,
+            template_id=template_id,
             message="Face enrolled successfully",
             face_detected=True,
             quality_score=result.get('quality_score'),
@@ -189,6 +528,12 @@ async def enroll_face(image: UploadFile = File(...)):
             detail=str(e)
         )
         
+    except InferenceQueueFullException as e:
+        raise service_busy(e, "/enroll")
+        
+    except HTTPException:
+        raise
+        
     except Exception as e:
         logger.error(f"Enrollment error: {str(e)}", exc_info=True)
         raise HTTPException(
@@ -200,7 +545,11 @@ async def enroll_face(image: UploadFile = File(...)):
 @app.post("/verify", response_model=VerificationResponse, status_code=status.HTTP_200_OK)
 async def verify_face(
     image: UploadFile = File(...),
-    stored_embedding: str = None  # JSON string of embedding
+    stored_embedding: Optional[str] = Form(None),
+    stored_embedding_file: Optional[UploadFile] = File(None),
+    template_id: Optional[str] = Form(None),
+    roi: Optional[str] = Form(None),
+    detector: Optional[str] = Form(None)
 ):
     """
     Face Verification Endpoint
@@ -210,28 +559,62 @@ async def verify_face(
     
     Args:
         image: Live face image
-        stored_embedding: JSON string of stored face embedding
+        stored_embedding: Stored face embedding as a JSON array or base64
+        stored_embedding_file: Stored face embedding as a raw binary part
+            (application/x-face-embedding), instead of stored_embedding
+        template_id: Key of a template cached by an earlier /enroll or
+            /verify; with an embedding, the key to cache it under
+        roi: Optional "x,y,w,h" face guide box as fractions of the image size
+        detector: Optional detector backend, one of ALLOWED_DETECTOR_BACKENDS
     
     Returns:
-        VerificationResponse with match result and confidence score
+        VerificationResponse with match result and confidence score, or
+        template_unknown=true when only a key was sent and it is not cached
     """
     try:
+        roi_hint = parse_roi(roi)
+        detector = parse_detector(detector)
+        
         # Validate stored embedding
-        if not stored_embedding:
+        if not stored_embedding and stored_embedding_file is None and not template_id:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="stored_embedding is required"
             )
         
-        # Parse embedding
-        import json
-        try:
-            embedding_list = json.loads(stored_embedding)
-        except json.JSONDecodeError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid stored_embedding format. Must be valid JSON array."
-            )
+        if not stored_embedding and stored_embedding_file is None:
+            # Key only: use the cached template or ask for the full one
+            embedding_list = template_cache.get(template_id)
+            if embedding_list is None:
+                return VerificationResponse(
+                    success=False,
+                    match=False,
+                    confidence=0.0,
+                    message="Template unknown. Please resend the request with stored_embedding.",
+                    threshold_used=face_service.VERIFICATION_THRESHOLD,
+                    template_id=template_id,
+                    template_unknown=True,
+                    timestamp=datetime.utcnow().isoformat()
+                )
+        else:
+            # Parse embedding
+            try:
+                if stored_embedding_file is not None:
+                    embedding_list = decode_embedding(
+                        await stored_embedding_file.read(),
+                        expected_dimension=FaceRecognitionService.EMBEDDING_DIMENSION
+                    )
+                else:
+                    embedding_list = decode_embedding_field(
+                        stored_embedding,
+                        expected_dimension=FaceRecognitionService.EMBEDDING_DIMENSION
+                    )
+                template_id = template_cache.put(embedding_list, template_id)
+            except ValueError as e:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail=f"Invalid stored_embedding: {str(e)}"
+                )
         
         # Read image data
         image_data = await image.read()
@@ -241,7 +624,7 @@ async def verify_face(
             security_logger.log_suspicious_activity(
                 endpoint="/verify",
                 reason="Invalid file type",
-                content_type=image.content_type or "None"
+                details=f"Content type: {image.content_type or 'None'}"
             )
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
@@ -249,7 +632,7 @@ async def verify_face(
             )
         
         # Perform verification
-        result = face_service.verify_face(image_data, embedding_list)
+        result = await inference_executor.run(face_service.verify_face, image_data, embedding_list, roi_hint, detector)
         
         # Log failed verification attempts
         if not result['match']:
@@ -266,6 +649,7 @@ async def verify_face(
             message="Verification completed successfully",
             similarity_score=result.get('similarity_score'),
             threshold_used=result['threshold'],
+            template_id=template_id,
             timestamp=datetime.utcnow().isoformat()
         )
         
@@ -317,6 +701,9 @@ async def verify_face(
             detail=str(e)
         )
         
+    except InferenceQueueFullException as e:
+        raise service_busy(e, "/verify")
+        
     except HTTPException:
         raise
         
@@ -328,6 +715,152 @@ async def verify_face(
         )
 
 
+@app.post("/identify", response_model=IdentificationResponse, status_code=status.HTTP_200_OK)
+async def identify_face(
+    image: UploadFile = File(...),
+    top_k: int = Form(5, ge=1, le=100)
+):
+    """
+    Face Identification Endpoint (1:N)
+    
+    Embeds the probe face and ranks every template in the gallery.
+    
+    Args:
+        image: Live face image
+        top_k: Number of candidates to return
+    
+    Returns:
+        IdentificationResponse with ranked candidates
+    """
+    try:
+        # Read image data
+        image_data = await image.read()
+        
+        # Validate file type
+        if not image.content_type or not image.content_type.startswith('image/'):
+            security_logger.log_suspicious_activity(
+                endpoint="/identify",
+                reason="Invalid file type",
+                details=f"Content type: {image.content_type or 'None'}"
+            )
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Invalid file type. Only image files are accepted."
+            )
+        
+        result = await inference_executor.run(face_service.identify_face, image_data, face_gallery, top_k)
+        
+        if not any(candidate['match'] for candidate in result['matches']):
+            security_logger.log_suspicious_activity(
+                endpoint="/identify",
+                reason="Face identification failed",
+                details=f"Gallery size: {result['gallery_size']}, Threshold: {result['threshold']}"
+            )
+        
+        return IdentificationResponse(
+            success=True,
+            matches=result['matches'],
+            message="Identification completed successfully",
+            gallery_size=result['gallery_size'],
+            threshold_used=result['threshold'],
+            quality_score=result['quality_score'],
+            timestamp=datetime.utcnow().isoformat()
+        )
+        
+    except FaceNotDetectedException as e:
+        security_logger.log_suspicious_activity(
+            endpoint="/identify",
+            reason="No face detected in identification",
+            details=str(e)
+        )
+        return IdentificationResponse(
+            success=False,
+            matches=[],
+            message=str(e),
+            gallery_size=len(face_gallery),
+            threshold_used=face_service.VERIFICATION_THRESHOLD,
+            timestamp=datetime.utcnow().isoformat()
+        )
+        
+    except (MultipleFacesException, LowQualityImageException, InvalidImageException) as e:
+        security_logger.log_suspicious_activity(
+            endpoint="/identify",
+            reason=f"{type(e).__name__} in identification",
+            details=str(e)
+        )
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=str(e)
+        )
+        
+    except InferenceQueueFullException as e:
+        raise service_busy(e, "/identify")
+        
+    except HTTPException:
+        raise
+        
+    except Exception as e:
+        logger.error(f"Identification error: {str(e)}", exc_info=True)
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Internal server error during face identification"
+        )
+
+
+@app.put("/gallery/{identity_id}", response_model=GalleryResponse)
+async def add_gallery_entry(identity_id: str, entry: GalleryEntryRequest):
+    """Add or replace an identity's template in the 1:N gallery"""
+    try:
+        await run_in_threadpool(face_gallery.add, identity_id, entry.embedding)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    
+    return GalleryResponse(
+        success=True,
+        identity_id=identity_id,
+        gallery_size=len(face_gallery),
+        message="Template added to gallery",
+        timestamp=datetime.utcnow().isoformat()
+    )
+
+
+@app.post("/gallery/index", response_model=GalleryResponse)
+async def rebuild_gallery_index():
+    """Retrain the approximate gallery index on the current templates"""
+    if face_gallery.index is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Gallery uses exact search; set GALLERY_INDEX to enable an index"
+        )
+    await run_in_threadpool(face_gallery.build_index)
+    
+    return GalleryResponse(
+        success=True,
+        gallery_size=len(face_gallery),
+        message=f"Rebuilt {face_gallery.index.name} index",
+        timestamp=datetime.utcnow().isoformat()
+    )
+
+
+@app.delete("/gallery/{identity_id}", response_model=GalleryResponse)
+async def remove_gallery_entry(identity_id: str):
+    """Remove an identity from the 1:N gallery"""
+    removed = await run_in_threadpool(face_gallery.remove, identity_id)
+    if not removed:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Identity {identity_id} is not in the gallery"
+        )
+    
+    return GalleryResponse(
+        success=True,
+        identity_id=identity_id,
+        gallery_size=len(face_gallery),
+        message="Template removed from gallery",
+        timestamp=datetime.utcnow().isoformat()
+    )
+
+
 # Exception handlers
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
@@ -337,7 +870,8 @@ async def http_exception_handler(request, exc):
             "success": False,
             "message": exc.detail,
             "timestamp": datetime.utcnow().isoformat()
-        }
+        },
+        headers=getattr(exc, "headers", None)
     )
 
 
@@ -0,0 +1,93 @@
+"""
+Lightweight in-process metrics
+Histograms and counters exposed as JSON on the /metrics endpoint
+"""
+
+import threading
+from collections import deque
+from typing import Dict, Iterable
+
+# Default bucket upper bounds for latency histograms (milliseconds)
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+class Histogram:
+    """
+    Thread-safe fixed-bucket histogram
+    
+    Keeps cumulative bucket counts plus a bounded window of recent samples
+    so percentiles reflect current behaviour rather than all-time history.
+    """
+    
+    def __init__(self, buckets: Iterable[float] = LATENCY_BUCKETS_MS, window: int = 1024):
+        self._bounds = tuple(sorted(buckets))
+        self._counts = [0] * (len(self._bounds) + 1)  # Last slot is +Inf
+        self._recent = deque(maxlen=window)
+        self._count = 0
+        self._sum = 0.0
+        self._max = 0.0
+        self._lock = threading.Lock()
+    
+    def observe(self, value: float) -> None:
+        """Record a single sample"""
+        with self._lock:
+            index = len(self._bounds)
+            for i, bound in enumerate(self._bounds):
+                if value <= bound:
+                    index = i
+                    break
+            self._counts[index] += 1
+            self._recent.append(value)
+            self._count += 1
+            self._sum += value
+            self._max = max(self._max, value)
+    
+    @property
+    def count(self) -> int:
+        return self._count
+    
+    @property
+    def mean(self) -> float:
+        return self._sum / self._count if self._count else 0.0
+    
+    def percentile(self, p: float) -> float:
+        """Percentile (0-100) over the recent-sample window"""
+        with self._lock:
+            ordered = sorted(self._recent)
+        if not ordered:
+            return 0.0
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+    
+    def snapshot(self) -> Dict:
+        """JSON-serializable summary"""
+        with self._lock:
+            counts = list(self._counts)
+        buckets = {f"le_{bound:g}": n for bound, n in zip(self._bounds, counts)}
+        buckets["le_inf"] = counts[-1]
+        return {
+            'count': self._count,
+            'mean': round(self.mean, 3),
+            'p50': round(self.percentile(50), 3),
+            'p95': round(self.percentile(95), 3),
+            'p99': round(self.percentile(99), 3),
+            'max': round(self._max, 3),
+            'buckets': buckets
+        }
+
+
+class Counter:
+    """Thread-safe monotonically increasing counter"""
+    
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+    
+    def inc(self, amount: int = 1) -> None:
+        with self._lock:
+            self._value += amount
+    
+    @property
+    def value(self) -> int:
+        return self._value
+
@@ -0,0 +1,234 @@
+"""
+Model Store
+Facenet512 weights converted once, at image build time, into flat files
+that every process memory-maps read-only
+
+A stored artifact is a pair of files:
+    <name>.bin   the arrays back to back, each aligned to ALIGNMENT bytes
+    <name>.json  manifest: name, dtype, shape, offset and size of each array
+
+Mapped arrays are views of the page cache, so all workers on a node share
+one physical copy and loading costs no parsing. Two artifacts are kept:
+
+  KERAS_WEIGHTS   DeepFace's Facenet512 weights in Keras order; the
+                  deepface engine builds the architecture and sets these
+                  instead of downloading and parsing the .h5. Keras copies
+                  them into its variables, so this saves the download and
+                  the parse, not the per-process copy
+  MAPPED_ONNX     the ONNX export with its initializers moved into the
+                  store (as ONNX external data, so the file stays a valid
+                  model); the onnxruntime engine hands the mapped arrays to
+                  ONNX Runtime without copying them
+
+Build the store while building the image (needs TensorFlow and DeepFace;
+onnx and tf2onnx for the ONNX artifact):
+    python model_store.py build
+"""
+
+import argparse
+import json
+import logging
+import os
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from face_detection import MODEL_DIR
+
+logger = logging.getLogger(__name__)
+
+ALIGNMENT = 64
+
+KERAS_WEIGHTS = "facenet512.keras"
+MAPPED_ONNX = "facenet512.mapped"  # facenet512.mapped.onnx + .bin/.json
+
+FORMAT_VERSION = 1
+
+
+def has_arrays(prefix: str) -> bool:
+    return os.path.isfile(f"{prefix}.json") and os.path.isfile(f"{prefix}.bin")
+
+
+def write_arrays(prefix: str, arrays: List[Tuple[str, np.ndarray]]) -> List[Dict]:
+    """
+    Write named arrays as <prefix>.bin and <prefix>.json
+
+    Both files are written under temporary names and moved into place, the
+    manifest last, so readers never see a partial store.
+
+    Returns:
+        The manifest entries, in order
+
+    Raises:
+        ValueError: Two arrays share a name
+    """
+    if len({name for name, _ in arrays}) != len(arrays):
+        raise ValueError("Array names must be unique")
+    entries, offset = [], 0
+    for name, array in arrays:
+        offset = -(-offset // ALIGNMENT) * ALIGNMENT
+        entries.append({
+            'name': name,
+            'dtype': np.dtype(array.dtype).str,
+            'shape': list(array.shape),
+            'offset': offset,
+            'nbytes': int(array.nbytes)
+        })
+        offset += array.nbytes
+
+    partial = f"{prefix}.{os.getpid()}.tmp"
+    try:
+        with open(partial, "wb") as f:
+            for entry, (_, array) in zip(entries, arrays):
+                f.seek(entry['offset'])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(offset)
+        os.replace(partial, f"{prefix}.bin")
+        with open(partial, "w") as f:
+            json.dump({
+                'format': FORMAT_VERSION,
+                'file': os.path.basename(f"{prefix}.bin"),
+                'size': offset,
+                'arrays': entries
+            }, f)
+        os.replace(partial, f"{prefix}.json")
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return entries
+
+
+def map_arrays(prefix: str) -> Dict[str, np.ndarray]:
+    """
+    Map a stored artifact read-only
+
+    Returns:
+        Arrays by name, in stored order; views of one shared mapping
+
+    Raises:
+        RuntimeError: The store is missing, of another format, or truncated
+    """
+    if not has_arrays(prefix):
+        raise RuntimeError(f"Model store {prefix}.bin/.json not found; create it with model_store.py build")
+    with open(f"{prefix}.json") as f:
+        manifest = json.load(f)
+    if manifest.get('format') != FORMAT_VERSION:
+        raise RuntimeError(f"{prefix}.json has format {manifest.get('format')}, expected {FORMAT_VERSION}")
+    if os.path.getsize(f"{prefix}.bin") != manifest['size']:
+        raise RuntimeError(f"{prefix}.bin does not match its manifest; rebuild the store")
+
+    mapping = np.memmap(f"{prefix}.bin", dtype=np.uint8, mode="r")
+    arrays = {}
+    for entry in manifest['arrays']:
+        raw = mapping[entry['offset']:entry['offset'] + entry['nbytes']]
+        arrays[entry['name']] = raw.view(np.dtype(entry['dtype'])).reshape(entry['shape'])
+    return arrays
+
+
+def build_keras_model(prefix: str):
+    """
+    Facenet512 with the stored weights, without DeepFace's weight download
+
+    Raises:
+        RuntimeError: The store is missing or does not fit the architecture
+    """
+    arrays = map_arrays(prefix)
+    from face_recognition_service import get_deepface
+    get_deepface()  # Keras compatibility patch before the model code loads
+    from deepface.basemodels import Facenet
+
+    model = Facenet.InceptionResNetV2(dimension=512)
+    weights = list(arrays.values())
+    if len(weights) != len(model.weights):
+        raise RuntimeError(f"{prefix} holds {len(weights)} arrays, Facenet512 has {len(model.weights)}")
+    model.set_weights(weights)
+    return model
+
+
+def store_onnx(source: str, prefix: str) -> str:
+    """
+    Move an ONNX model's initializers into the store
+
+    Writes <prefix>.bin/.json and <prefix>.onnx, whose initializers point
+    into <prefix>.bin as external data.
+
+    Returns:
+        Path of the written model
+    """
+    import onnx
+    from onnx import TensorProto, numpy_helper
+
+    model = onnx.load(source)
+    initializers = list(model.graph.initializer)
+    entries = write_arrays(prefix, [(tensor.name, numpy_helper.to_array(tensor)) for tensor in initializers])
+    for tensor, entry in zip(initializers, entries):
+        for field in ('raw_data', 'float_data', 'int32_data', 'int64_data', 'double_data', 'uint64_data'):
+            tensor.ClearField(field)
+        tensor.data_location = TensorProto.EXTERNAL
+        del tensor.external_data[:]
+        for key, value in (
+            ('location', os.path.basename(f"{prefix}.bin")),
+            ('offset', str(entry['offset'])),
+            ('length', str(entry['nbytes']))
+        ):
+            item = tensor.external_data.add()
+            item.key = key
+            item.value = value
+    output = f"{prefix}.onnx"
+    onnx.save(model, output)
+    return output
+
+
+def build(model_dir: str, with_onnx: bool = True) -> None:
+    """
+    Convert Facenet512 into the store and check it reproduces DeepFace
+
+    Raises:
+        RuntimeError: Embeddings from the store differ from DeepFace's by
+            more than EMBEDDING_TOLERANCE
+    """
+    from embedding_engines import EMBEDDING_TOLERANCE, FACENET_ONNX, cosine_distances
+    from face_recognition_service import FaceRecognitionService, get_deepface
+
+    model = get_deepface().build_model(FaceRecognitionService.MODEL_NAME)
+    prefix = os.path.join(model_dir, KERAS_WEIGHTS)
+    # Keras weight names need not be unique; the order is what set_weights uses
+    write_arrays(prefix, [
+        (f"{index:04d}/{weight.name}", weight.numpy()) for index, weight in enumerate(model.weights)
+    ])
+
+    height, width = FaceRecognitionService.MODEL_INPUT_SIZE
+    chips = np.random.default_rng(0).random((4, height, width, 3), dtype=np.float32)
+    expected = np.asarray(model.predict(chips, verbose=0))
+    actual = np.asarray(build_keras_model(prefix).predict(chips, verbose=0))
+    distance = float(cosine_distances(expected, actual).max())
+    if distance > EMBEDDING_TOLERANCE:
+        raise RuntimeError(f"Stored weights differ from DeepFace (cosine distance {distance:.2e})")
+    logger.info(f"Wrote {prefix}.bin ({os.path.getsize(prefix + '.bin') / 1e6:.1f} MB)")
+
+    if with_onnx:
+        source = os.path.join(model_dir, FACENET_ONNX)
+        if not os.path.isfile(source):
+            from export_onnx import export
+            export(source)
+        output = store_onnx(source, os.path.join(model_dir, MAPPED_ONNX))
+        logger.info(f"Wrote {output} and its weights")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Facenet512 model store")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_command = commands.add_parser('build', help="Convert the weights (once, at image build)")
+    build_command.add_argument('--model-dir', default=MODEL_DIR)
+    build_command.add_argument('--no-onnx', action='store_true', help="Only the Keras weights")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    build(args.model_dir, with_onnx=not args.no_onnx)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,336 @@
+"""
+Preload Server
+Production entry point that loads the service once and forks the HTTP
+workers from it, so they share its memory copy-on-write instead of each
+importing and loading everything again
+
+Run with:
+    python preload_server.py --workers 4 --host 0.0.0.0 --port 8000
+
+The parent imports main (the app and its FaceRecognitionService), loads
+what can safely cross a fork, moves everything it allocated out of the
+garbage collector's reach (gc.freeze, so collections in the workers do
+not write to the shared pages) and forks the workers, which accept on one
+shared listening socket. What is loaded before the fork depends on the
+engine:
+
+  opencv-dnn    detector and embedding network loaded and warmed
+  onnxruntime   the same, when each worker runs ONNX Runtime on one
+                intra-op thread; its thread pool cannot be restarted
+                after a fork, so with more threads each worker creates its
+                own session (the weights are still shared through the
+                model store)
+  deepface      TensorFlow and DeepFace imported; TensorFlow's runtime
+                threads do not survive a fork, so each worker builds
+                Facenet512 itself while it warms up
+
+The parent runs OpenCV single-threaded, so no thread pool crosses the
+fork. Each worker then takes its share of the CPUs (thread_planner, slot =
+its index) and restarts the service's background threads.
+
+Workers are recycled: after --max-requests requests (plus up to
+--max-requests-jitter, so they do not all restart together) a worker
+finishes its open requests and exits, and with --max-rss-mb the parent
+replaces any worker whose own memory grows past the ceiling. That is its
+private pages only (USS); the pages it still shares with the parent are
+what this mode saves, so they do not count. Replacements are forked from
+the same parent and skip what it preloaded.
+
+A worker replaced for memory gets its replacement right away, in the same
+slot, while it finishes its open requests for up to --graceful-timeout.
+Until it exits the host runs workers + 1 processes, and with CPU_PINNING
+the two share that slot's CPUs; the old worker no longer accepts
+connections, so it only competes for them with the requests it is
+finishing.
+"""
+
+import argparse
+import gc
+import logging
+import multiprocessing
+import os
+import random
+import signal
+import socket
+import time
+from typing import Optional
+
+from thread_planner import apply_thread_plan
+
+logger = logging.getLogger(__name__)
+
+PRELOAD_MODELS = "models"
+PRELOAD_IMPORTS = "imports"
+PRELOAD_NONE = "none"
+
+
+def preloads_models(service) -> bool:
+    """Whether the service's models can be loaded and warmed before forking"""
+    if service.engine == "opencv-dnn":
+        return True
+    if service.engine == "onnxruntime":
+        embedder = service.embedder
+        # One intra-op thread and sequential execution start no pool
+        return embedder.intra_op_threads == 1 and embedder.inter_op_threads <= 1
+    return False
+
+
+def preload(service) -> str:
+    """
+    Load what can cross a fork into the calling (parent) process
+
+    Failures are logged, not raised: the workers load the models again
+    while they warm up and report not ready until they have.
+
+    Returns:
+        PRELOAD_MODELS when the service was warmed, PRELOAD_IMPORTS when
+        only its libraries were imported, PRELOAD_NONE when nothing was
+        (a failure, or models that run in the shared inference process)
+    """
+    import cv2
+    from shared_inference import RemoteFaceRecognitionService
+
+    if isinstance(service, RemoteFaceRecognitionService):
+        return PRELOAD_NONE
+    # Serial OpenCV starts no thread pool that the workers would inherit
+    # without its threads
+    cv2.setNumThreads(1)
+    try:
+        if preloads_models(service):
+            service.warmup()
+            return PRELOAD_MODELS
+        if service.engine == "onnxruntime":
+            import onnxruntime  # noqa: F401
+        elif service.engine == "deepface":
+            from face_recognition_service import get_deepface
+            get_deepface()
+    except Exception:
+        logger.error("Preloading failed; workers will load the models themselves", exc_info=True)
+        return PRELOAD_NONE
+    return PRELOAD_IMPORTS
+
+
+def worker_private_mb(pid: int) -> Optional[float]:
+    """
+    Unique memory (USS) of a process in MB, or None once it is gone
+
+    Private_Clean + Private_Dirty from /proc/<pid>/smaps_rollup, or from
+    /proc/<pid>/smaps on kernels without the rollup. Copy-on-write pages
+    still shared with the parent are not counted.
+    """
+    private_kb = 0
+    for name in ("smaps_rollup", "smaps"):
+        try:
+            with open(f"/proc/{pid}/{name}") as f:
+                for line in f:
+                    if line.startswith(("Private_Clean:", "Private_Dirty:")):
+                        private_kb += int(line.split()[1])
+        except FileNotFoundError:
+            if name == "smaps_rollup" and os.path.exists(f"/proc/{pid}"):
+                continue
+            return None
+        except (OSError, ValueError, IndexError):
+            return None
+        return private_kb / 1024
+    return None
+
+
+class PreloadServer:
+    """
+    Parent of the HTTP workers, forked after the service is preloaded
+
+    Crashed workers are restarted, workers that reached their request
+    limit are replaced, and workers whose private memory is over the
+    ceiling are stopped gracefully and replaced. The replacement takes the
+    slot (and, when pinned, the CPUs) of the worker it replaces while that
+    one finishes its open requests.
+    """
+
+    def __init__(
+        self,
+        app_module,
+        host: str = "0.0.0.0",
+        port: int = 8000,
+        workers: int = 1,
+        max_requests: int = 0,
+        max_requests_jitter: int = 0,
+        max_rss_mb: float = 0,
+        graceful_timeout: float = 30.0,
+        pin_cpus: bool = False,
+        log_level: str = "info"
+    ):
+        """
+        Args:
+            app_module: The imported main module (app, face_service,
+                THREAD_PLAN)
+            host: Address to listen on
+            port: Port to listen on
+            workers: HTTP worker processes
+            max_requests: Requests after which a worker is replaced; 0
+                keeps workers for good
+            max_requests_jitter: Up to this many requests are added to
+                each worker's limit at random
+            max_rss_mb: Private memory (USS) above which a worker is
+                replaced; 0 disables the check
+            graceful_timeout: Seconds a stopping worker gets to finish its
+                requests before it is killed
+            pin_cpus: Pin each worker to its own CPUs
+            log_level: uvicorn log level in the workers
+        """
+        if workers < 1:
+            raise ValueError("workers must be at least 1")
+        self.app_module = app_module
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_requests = max_requests
+        self.max_requests_jitter = max_requests_jitter
+        self.max_rss_mb = max_rss_mb
+        self.graceful_timeout = graceful_timeout
+        self.pin_cpus = pin_cpus
+        self.log_level = log_level
+        self.preloaded: Optional[str] = None
+        self._stopping = False
+
+    def _worker_main(self, listener: socket.socket, index: int, max_requests: int) -> None:
+        # uvicorn installs its own handlers; until then, the defaults
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+        import cv2
+        import uvicorn
+
+        app_module = self.app_module
+        if app_module.THREAD_PLAN is not None:
+            app_module.THREAD_PLAN = apply_thread_plan(self.workers, self.pin_cpus, slot=index)
+        else:
+            cv2.setNumThreads(-1)  # OpenCV's default again
+        app_module.face_service.after_fork()
+
+        logger.info(f"Worker {index} (pid {os.getpid()}) serving on {self.host}:{self.port}")
+        config = uvicorn.Config(
+            app_module.app,
+            log_level=self.log_level,
+            limit_max_requests=max_requests or None
+        )
+        uvicorn.Server(config).run(sockets=[listener])
+
+    def serve_forever(self) -> None:
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(2048)
+
+        start = time.perf_counter()
+        self.preloaded = preload(self.app_module.face_service)
+        logger.info(f"Preloaded {self.preloaded} in {(time.perf_counter() - start) * 1000:.0f}ms")
+        # Collections in the workers would otherwise touch (and copy) every
+        # object allocated so far
+        gc.freeze()
+
+        context = multiprocessing.get_context('fork')
+        workers, retiring = {}, []
+
+        def start_worker(index):
+            limit = 0
+            if self.max_requests:
+                limit = self.max_requests + random.randint(0, self.max_requests_jitter)
+            worker = context.Process(
+                target=self._worker_main,
+                args=(listener, index, limit),
+                name=f"face-worker-{index}"
+            )
+            worker.start()
+            workers[index] = worker
+
+        def retire(worker):
+            # SIGTERM: uvicorn stops accepting and finishes open requests
+            worker.terminate()
+            retiring.append((worker, time.monotonic() + self.graceful_timeout))
+
+        def stop(signum, frame):
+            self._stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        for index in range(self.workers):
+            start_worker(index)
+
+        try:
+            while not self._stopping:
+                for index, worker in list(workers.items()):
+                    if not worker.is_alive():
+                        if worker.exitcode == 0:
+                            logger.info(f"Worker {index} (pid {worker.pid}) exited; replacing it")
+                        else:
+                            logger.warning(f"Worker {index} (pid {worker.pid}) died ({worker.exitcode}); restarting")
+                        start_worker(index)
+                        continue
+                    private = worker_private_mb(worker.pid) if self.max_rss_mb else None
+                    if private is not None and private > self.max_rss_mb:
+                        logger.warning(
+                            f"Worker {index} (pid {worker.pid}) private memory {private:.0f} MB is over "
+                            f"{self.max_rss_mb:.0f} MB; replacing it"
+                        )
+                        retire(worker)
+                        start_worker(index)
+
+                for worker, deadline in list(retiring):
+                    if not worker.is_alive():
+                        worker.join()
+                        retiring.remove((worker, deadline))
+                    elif time.monotonic() > deadline:
+                        worker.kill()
+                time.sleep(1)
+        finally:
+            for worker in workers.values():
+                retire(worker)
+            for worker, deadline in retiring:
+                worker.join(timeout=max(0.0, deadline - time.monotonic()))
+                if worker.is_alive():
+                    worker.kill()
+                    worker.join()
+            listener.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Face recognition service with preloaded, forked workers")
+    parser.add_argument('--host', default=os.getenv("HOST", "0.0.0.0"))
+    parser.add_argument('--port', type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument('--workers', type=int,
+                        default=int(os.getenv("WORKERS") or os.getenv("WEB_CONCURRENCY") or "1"))
+    parser.add_argument('--max-requests', type=int, default=int(os.getenv("MAX_REQUESTS", "0")),
+                        help="Replace a worker after this many requests (0: never)")
+    parser.add_argument('--max-requests-jitter', type=int, default=int(os.getenv("MAX_REQUESTS_JITTER", "0")),
+                        help="Add up to this many requests to each worker's limit")
+    parser.add_argument('--max-rss-mb', type=float, default=float(os.getenv("MAX_WORKER_RSS_MB", "0")),
+                        help="Replace a worker whose private memory (USS) exceeds this (0: never)")
+    parser.add_argument('--graceful-timeout', type=float, default=30.0)
+    parser.add_argument('--log-level', default="info")
+    args = parser.parse_args()
+
+    # main.py plans this process's threads as it is imported: plan them for
+    # the workers, but pin only the workers, after the fork
+    pin_cpus = os.getenv("CPU_PINNING", "false").lower() in ("1", "true", "yes")
+    os.environ["WORKERS"] = str(args.workers)
+    os.environ["CPU_PINNING"] = "false"
+    import main as app_module
+
+    server = PreloadServer(
+        app_module,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        max_requests=args.max_requests,
+        max_requests_jitter=args.max_requests_jitter,
+        max_rss_mb=args.max_rss_mb,
+        graceful_timeout=args.graceful_timeout,
+        pin_cpus=pin_cpus,
+        log_level=args.log_level
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+"""
+Reduced-precision Facenet512 models and their accuracy guardrail
+
+  fp16     half-precision copy of the ONNX export (inputs and outputs stay
+           float32), for the onnxruntime engine
+  int8     post-training static quantization of the ONNX export, with
+           activation ranges calibrated on face chips from local images,
+           for the onnxruntime engine
+  report   guardrail: embeds a labelled image set at fp32 (the production
+           reference) and at a reduced precision, and reports the cosine
+           distance drift between the two and the FAR/FRR at
+           VERIFICATION_THRESHOLD when fp32 templates are verified against
+           reduced-precision probes. Exits non-zero when a limit is exceeded.
+
+Face chips are cut by the service's own detector and alignment, so
+calibration and the report see what production feeds the model. The
+report runs every engine in its own interpreter, since the bf16 Keras
+policy is process-wide.
+
+Needs onnx and onnxconverter-common (fp16) or onnxruntime (int8):
+    pip install onnx onnxconverter-common onnxruntime
+    python quantize_model.py fp16
+    python quantize_model.py int8 path/to/calibration/faces/
+    python quantize_model.py report path/to/people/ --engine onnxruntime --precision int8
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+from typing import Dict, List, Tuple
+
+import cv2
+import numpy as np
+
+from embedding_engines import ENGINES, FACENET_ONNX, PRECISION_MODELS, PRECISIONS, cosine_distances
+from face_detection import MODEL_DIR
+from face_recognition_service import (
+    FaceNotDetectedException,
+    FaceRecognitionService,
+    LowQualityImageException,
+    MultipleFacesException
+)
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def image_paths(root: str) -> List[str]:
+    if not os.path.isdir(root):
+        return [root]
+    return sorted(
+        os.path.join(folder, name)
+        for folder, _, names in os.walk(root)
+        for name in names if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+
+def face_chips(paths: List[str]) -> Tuple[np.ndarray, List[int]]:
+    """
+    Aligned chips for every image with a usable face
+
+    Returns:
+        (N, height, width, 3) chips and the index in paths of each chip
+    """
+    service = FaceRecognitionService()
+    chips, kept = [], []
+    for index, path in enumerate(paths):
+        image = cv2.imread(path)
+        if image is None:
+            continue
+        try:
+            chips.append(service._detect_face(image)[2])
+            kept.append(index)
+        except (FaceNotDetectedException, LowQualityImageException, MultipleFacesException) as e:
+            logger.info(f"Skipping {path}: {e}")
+    if not chips:
+        raise SystemExit("No usable faces found")
+    return np.stack(chips).astype(np.float32), kept
+
+
+def convert_fp16(model_dir: str) -> str:
+    import onnx
+    from onnxconverter_common import float16
+
+    source = os.path.join(model_dir, FACENET_ONNX)
+    output = os.path.join(model_dir, PRECISION_MODELS["fp16"])
+    model = float16.convert_float_to_float16(onnx.load(source), keep_io_types=True)
+    onnx.save(model, output)
+    return output
+
+
+def quantize_int8(model_dir: str, calibration_paths: List[str]) -> str:
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_static
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    chips, _ = face_chips(calibration_paths)
+    logger.info(f"Calibrating on {len(chips)} face chips")
+
+    source = os.path.join(model_dir, FACENET_ONNX)
+    output = os.path.join(model_dir, PRECISION_MODELS["int8"])
+
+    class ChipReader(CalibrationDataReader):
+        def __init__(self, input_name):
+            blobs = np.ascontiguousarray(chips.transpose(0, 3, 1, 2))
+            self._batches = iter([{input_name: blob[np.newaxis]} for blob in blobs])
+
+        def get_next(self):
+            return next(self._batches, None)
+
+    import onnx
+    input_name = onnx.load(source).graph.input[0].name
+    with tempfile.TemporaryDirectory() as folder:
+        prepared = os.path.join(folder, "prepared.onnx")
+        quant_pre_process(source, prepared)
+        # QDQ with per-channel weights keeps the embedding drift well below
+        # per-tensor quantization on this network
+        quantize_static(
+            prepared,
+            output,
+            ChipReader(input_name),
+            quant_format=QuantFormat.QDQ,
+            per_channel=True,
+            activation_type=QuantType.QInt8,
+            weight_type=QuantType.QInt8
+        )
+    return output
+
+
+def verification_rates(
+    templates: np.ndarray,
+    probes: np.ndarray,
+    labels: List[str],
+    threshold: float
+) -> Dict:
+    """
+    FAR and FRR over every pair of distinct images, each pair verified as
+    template i against probe j
+    """
+    genuine = impostor = false_accepts = false_rejects = 0
+    for i, j in itertools.combinations(range(len(labels)), 2):
+        distance = float(cosine_distances(templates[i:i + 1], probes[j:j + 1])[0])
+        match = distance <= threshold
+        if labels[i] == labels[j]:
+            genuine += 1
+            false_rejects += not match
+        else:
+            impostor += 1
+            false_accepts += match
+    return {
+        'genuine': genuine,
+        'impostor': impostor,
+        'FAR': round(false_accepts / impostor, 4) if impostor else 0.0,
+        'FRR': round(false_rejects / genuine, 4) if genuine else 0.0
+    }
+
+
+def guardrail(reference: np.ndarray, candidate: np.ndarray, labels: List[str], threshold: float) -> Dict:
+    """
+    Compare reduced-precision embeddings against the fp32 reference
+
+    Args:
+        reference: (N, 512) fp32 embeddings, as stored in production
+        candidate: (N, 512) embeddings of the same chips at the reduced precision
+        labels: Identity of each chip
+        threshold: Verification threshold (cosine distance)
+
+    Returns:
+        Drift statistics and the verification rates before and after
+    """
+    drift = cosine_distances(reference, candidate)
+    before = verification_rates(reference, reference, labels, threshold)
+    after = verification_rates(reference, candidate, labels, threshold)
+    return {
+        'drift': {
+            'mean': float(drift.mean()),
+            'p95': float(np.percentile(drift, 95)),
+            'max': float(drift.max())
+        },
+        'before': before,
+        'after': after,
+        'far_change': round(after['FAR'] - before['FAR'], 4),
+        'frr_change': round(after['FRR'] - before['FRR'], 4)
+    }
+
+
+def embed_child(engine: str, precision: str, chips_path: str, output: str) -> None:
+    """Runs in a spawned interpreter so each precision gets a fresh model"""
+    service = FaceRecognitionService(engine=engine, precision=precision)
+    np.save(output, service._embed_batch(np.load(chips_path)))
+
+
+def embed_in_child(engine: str, precision: str, chips_path: str) -> np.ndarray:
+    output = f"{chips_path}.{engine}.{precision}.npy"
+    command = [
+        sys.executable, os.path.abspath(__file__), 'embed',
+        '--engine', engine, '--precision', precision, '--chips', chips_path, '--output', output
+    ]
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        last = process.stderr.strip().splitlines()[-1] if process.stderr.strip() else ""
+        raise SystemExit(f"{engine} {precision} embedding failed: {last}")
+    return np.load(output)
+
+
+def report(args) -> int:
+    people = sorted(
+        name for name in os.listdir(args.identities)
+        if os.path.isdir(os.path.join(args.identities, name))
+    )
+    paths, owners = [], []
+    for person in people:
+        for path in image_paths(os.path.join(args.identities, person)):
+            paths.append(path)
+            owners.append(person)
+    chips, kept = face_chips(paths)
+    labels = [owners[index] for index in kept]
+
+    with tempfile.TemporaryDirectory() as folder:
+        chips_path = os.path.join(folder, "chips.npy")
+        np.save(chips_path, chips)
+        reference = embed_in_child(args.reference_engine, "fp32", chips_path)
+        candidate = embed_in_child(args.engine, args.precision, chips_path)
+
+    threshold = FaceRecognitionService.VERIFICATION_THRESHOLD
+    result = guardrail(reference, candidate, labels, threshold)
+    result.update({
+        'reference': f"{args.reference_engine} fp32",
+        'candidate': f"{args.engine} {args.precision}",
+        'threshold': threshold,
+        'faces': len(labels),
+        'identities': len(set(labels))
+    })
+    print(json.dumps(result, indent=2))
+
+    failures = []
+    if result['drift']['max'] > args.max_drift:
+        failures.append(f"max drift {result['drift']['max']:.4f} > {args.max_drift}")
+    if result['far_change'] > args.max_far_increase:
+        failures.append(f"FAR +{result['far_change']} > {args.max_far_increase}")
+    if result['frr_change'] > args.max_frr_increase:
+        failures.append(f"FRR +{result['frr_change']} > {args.max_frr_increase}")
+    for failure in failures:
+        logger.error(f"Guardrail failed: {failure}")
+    return 1 if failures else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    commands.add_parser('fp16', help="Write the fp16 model")
+
+    int8 = commands.add_parser('int8', help="Calibrate and write the int8 model")
+    int8.add_argument('images', nargs='+', help="Face images or directories for calibration")
+
+    guard = commands.add_parser('report', help="Drift and FAR/FRR against fp32")
+    guard.add_argument('identities', help="Directory with one sub-directory of face images per person")
+    guard.add_argument('--engine', choices=ENGINES, default="onnxruntime")
+    guard.add_argument('--precision', choices=PRECISIONS, default="int8")
+    guard.add_argument('--reference-engine', choices=ENGINES, default="deepface",
+                       help="Engine producing the production fp32 embeddings")
+    guard.add_argument('--max-drift', type=float, default=0.02, help="Largest cosine distance from fp32")
+    guard.add_argument('--max-far-increase', type=float, default=0.0)
+    guard.add_argument('--max-frr-increase', type=float, default=0.01)
+
+    embed = commands.add_parser('embed', help=argparse.SUPPRESS)
+    embed.add_argument('--engine', choices=ENGINES, required=True)
+    embed.add_argument('--precision', choices=PRECISIONS, required=True)
+    embed.add_argument('--chips', required=True)
+    embed.add_argument('--output', required=True)
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    if args.command == 'fp16':
+        logger.info(f"Wrote {convert_fp16(args.model_dir)}")
+    elif args.command == 'int8':
+        paths = [path for root in args.images for path in image_paths(root)]
+        logger.info(f"Wrote {quantize_int8(args.model_dir, paths)}")
+    elif args.command == 'report':
+        sys.exit(report(args))
+    else:
+        embed_child(args.engine, args.precision, args.chips, args.output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+Result Cache
+Bounded LRU cache of pipeline results keyed by a hash of the image bytes,
+with coalescing of identical requests that are still being computed
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Callable, Dict
+import logging
+
+import numpy as np
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Rough per-entry cost of the key, dicts and face region beyond the embedding
+ENTRY_OVERHEAD_BYTES = 1024
+
+
+def image_key(image_data: bytes, config: str) -> str:
+    """Hash of the raw image bytes and the settings that affect the result"""
+    digest = hashlib.blake2b(image_data, digest_size=16)
+    digest.update(config.encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    LRU/TTL cache of detect + embed results with in-flight coalescing
+
+    The first request for a key computes the result; identical requests
+    that arrive meanwhile wait on its future instead of recomputing.
+    Only successful results are stored; a failure is shared with the
+    waiters of that computation and then forgotten.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 30.0):
+        """
+        Args:
+            max_entries: Results kept before the least recently used is evicted
+            ttl_seconds: Lifetime of a result; 0 disables expiry
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._in_flight: Dict[str, Future] = {}
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = Counter()
+        self.misses = Counter()
+        self.coalesced = Counter()
+        self.evictions = Counter()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get_or_compute(self, key: str, compute: Callable[[], Dict]) -> Dict:
+        """
+        Return the cached result for `key`, computing it at most once
+
+        Args:
+            key: Result key from image_key()
+            compute: Produces the pipeline result on a miss
+
+        Returns:
+            Result dictionary; callers get their own copy
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                self._drop(key)
+                entry = None
+
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits.inc()
+                return self._unpack(entry[0])
+
+            future = self._in_flight.get(key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self._in_flight[key] = future
+                self.misses.inc()
+            else:
+                self.coalesced.inc()
+
+        if not owner:
+            return self._unpack(future.result())
+
+        try:
+            packed = self._pack(compute())
+        except BaseException as e:
+            with self._lock:
+                del self._in_flight[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            del self._in_flight[key]
+            self._store(key, packed)
+        future.set_result(packed)
+        return self._unpack(packed)
+
+    def _pack(self, result: Dict) -> Dict:
+        # A float64 array is a quarter of the size of a list of Python floats
+        # and converts back to exactly the same values
+        packed = dict(result)
+        packed['embedding'] = np.asarray(result['embedding'], dtype=np.float64)
+        return packed
+
+    def _unpack(self, packed: Dict) -> Dict:
+        result = dict(packed)
+        result['embedding'] = packed['embedding'].tolist()
+        result['timings'] = dict(packed['timings'])
+        return result
+
+    def _store(self, key: str, packed: Dict) -> None:
+        if self.max_entries <= 0:
+            return
+        if key in self._entries:
+            self._drop(key)
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else None
+        self._entries[key] = (packed, expires_at)
+        self._memory_bytes += self._entry_bytes(packed)
+        while len(self._entries) > self.max_entries:
+            self._drop(next(iter(self._entries)))
+            self.evictions.inc()
+
+    def _drop(self, key: str) -> None:
+        packed, _ = self._entries.pop(key)
+        self._memory_bytes -= self._entry_bytes(packed)
+
+    @staticmethod
+    def _entry_bytes(packed: Dict) -> int:
+        return packed['embedding'].nbytes + ENTRY_OVERHEAD_BYTES
+
+    def stats(self) -> Dict:
+        """Hit ratio and memory footprint for /metrics"""
+        hits, misses, coalesced = self.hits.value, self.misses.value, self.coalesced.value
+        lookups = hits + misses + coalesced
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'memory_bytes': self._memory_bytes,
+            'in_flight': len(self._in_flight),
+            'hits': hits,
+            'misses': misses,
+            'coalesced': coalesced,
+            'hit_ratio': round((hits + coalesced) / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions.value
+        }
@@ -0,0 +1,479 @@
+"""
+Shared Inference Process
+Lets lightweight HTTP workers hand decoded images over shared memory to
+one or more inference processes that own the TensorFlow models
+
+Run the inference side with:
+    python shared_inference.py --processes 1 --threads 4
+
+and start the HTTP workers with INFERENCE_MODE=shared. Both sides need
+the same random SHARED_INFERENCE_AUTHKEY.
+"""
+
+import argparse
+import errno
+import logging
+import os
+import signal
+import threading
+import time
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from face_detection import MODEL_DIR
+from thread_planner import (
+    THREAD_PLAN_MODES,
+    apply_thread_plan,
+    available_cpus,
+    cgroup_cpu_limit,
+    plan_threads
+)
+from face_recognition_service import (
+    FaceRecognitionService,
+    FaceNotDetectedException,
+    MultipleFacesException,
+    LowQualityImageException,
+    InvalidImageException,
+    MODEL_READY,
+    MODEL_FAILED,
+    MODEL_LOADING
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "/tmp/face-inference.sock"
+AUTHKEY_ENV = "SHARED_INFERENCE_AUTHKEY"
+# Former built-in default; anyone could read it from the source
+INSECURE_AUTHKEYS = {"face-inference"}
+
+# Exceptions that cross the process boundary with their type preserved
+REMOTE_EXCEPTIONS = {
+    cls.__name__: cls for cls in (
+        FaceNotDetectedException,
+        MultipleFacesException,
+        LowQualityImageException,
+        InvalidImageException
+    )
+}
+
+
+def load_authkey() -> str:
+    """
+    Shared secret for the inference socket from SHARED_INFERENCE_AUTHKEY
+
+    Raises:
+        ValueError: Unset, or a publicly known value
+    """
+    authkey = os.getenv(AUTHKEY_ENV, "")
+    if not authkey or authkey in INSECURE_AUTHKEYS:
+        raise ValueError(
+            f"{AUTHKEY_ENV} must be set to a random secret shared by the HTTP workers "
+            f"and the inference process, e.g. the output of "
+            f"python -c 'import secrets; print(secrets.token_hex(32))'"
+        )
+    return authkey
+
+
+def _attach_segment(name: str) -> shared_memory.SharedMemory:
+    """Attach to a client's segment without letting our resource tracker unlink it"""
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        resource_tracker.unregister(segment._name, "shared_memory")
+    except Exception:
+        pass
+    return segment
+
+
+class RemoteFaceRecognitionService(FaceRecognitionService):
+    """
+    FaceRecognitionService whose detect/embed stage runs in a shared
+    inference process
+
+    Decoding, size validation and verification logic stay in the HTTP
+    worker; only the decoded image crosses over, through a per-thread
+    shared memory segment that is reused between requests.
+    """
+
+    def __init__(
+        self,
+        address: str = DEFAULT_SOCKET,
+        authkey: Optional[str] = None,
+        result_cache_size: int = 0,
+        result_cache_ttl_seconds: float = 30.0,
+        alignment: str = "landmarks",
+        detector_backend: Optional[str] = None,
+        engine: str = "deepface"
+    ):
+        super().__init__(
+            result_cache_size=result_cache_size,
+            result_cache_ttl_seconds=result_cache_ttl_seconds,
+            alignment=alignment,
+            detector_backend=detector_backend,
+            engine=engine
+        )
+        self.address = address
+        self.authkey = (authkey or load_authkey()).encode()
+        self._local = threading.local()
+        self._segments = []
+        self._segments_lock = threading.Lock()
+
+    def _segment(self, nbytes: int) -> shared_memory.SharedMemory:
+        segment = getattr(self._local, 'segment', None)
+        if segment is not None and segment.size >= nbytes:
+            return segment
+
+        if segment is not None:
+            with self._segments_lock:
+                self._segments.remove(segment)
+            segment.close()
+            segment.unlink()
+
+        segment = shared_memory.SharedMemory(create=True, size=nbytes)
+        self._local.segment = segment
+        with self._segments_lock:
+            self._segments.append(segment)
+        return segment
+
+    def _call(self, request: Tuple):
+        with Client(self.address, family='AF_UNIX', authkey=self.authkey) as conn:
+            conn.send(request)
+            reply = conn.recv()
+
+        if reply[0] == 'error':
+            _, name, message = reply
+            raise REMOTE_EXCEPTIONS.get(name, RuntimeError)(message)
+        return reply[1]
+
+    def _analyze_image(
+        self,
+        image: np.ndarray,
+        scale: int = 1,
+        roi: Optional[Tuple[float, float, float, float]] = None,
+        detector: Optional[str] = None
+    ) -> Dict:
+        image = np.ascontiguousarray(image)
+        segment = self._segment(image.nbytes)
+        np.ndarray(image.shape, dtype=image.dtype, buffer=segment.buf)[...] = image
+
+        start = time.perf_counter()
+        result = self._call(('analyze', segment.name, image.shape, image.dtype.str, scale, roi, detector))
+        round_trip_ms = (time.perf_counter() - start) * 1000
+
+        timings = result['timings']
+        timings['transport_ms'] = max(0.0, round_trip_ms - sum(timings.values()))
+        return result
+
+    def _embed_batch(self, face_chips: np.ndarray) -> np.ndarray:
+        raise NotImplementedError("Embeddings are computed by the shared inference process")
+
+    def status(self) -> Dict:
+        """Model state of the inference process that answers"""
+        return self._call(('status',))
+
+    def gate_stats(self) -> Dict:
+        """Quality gate counters of the inference process that answers"""
+        return self.status()['quality_gates']
+
+    def warmup(self, timeout: float = 300.0) -> float:
+        """
+        Wait until the shared inference process has warm models
+
+        Args:
+            timeout: Seconds to wait for the inference process
+
+        Returns:
+            Warmup duration reported by the inference process, in milliseconds
+        """
+        self.model_state = MODEL_LOADING
+        deadline = time.monotonic() + timeout
+        last_error = None
+
+        while time.monotonic() < deadline:
+            try:
+                remote = self.status()
+                if remote['model_state'] == MODEL_READY:
+                    self.model_state = MODEL_READY
+                    self.warmup_duration_ms = remote['warmup_duration_ms']
+                    logger.info(f"Shared inference process ready at {self.address}")
+                    return self.warmup_duration_ms
+                if remote['model_state'] == MODEL_FAILED:
+                    last_error = remote.get('warmup_error')
+                    break
+            except (OSError, EOFError) as e:
+                last_error = str(e)
+            time.sleep(0.5)
+
+        self.model_state = MODEL_FAILED
+        self.warmup_error = f"Shared inference process not ready: {last_error}"
+        raise RuntimeError(self.warmup_error)
+
+    def refresh_state(self) -> str:
+        """
+        Pull the model state from the inference process
+
+        /ready calls this until the models are ready, so workers started
+        without EAGER_WARMUP, or whose warmup gave up, notice once the
+        inference process has warmed.
+        """
+        try:
+            remote = self.status()
+        except (OSError, EOFError) as e:
+            self.warmup_error = f"Shared inference process unreachable: {str(e)}"
+            return self.model_state
+
+        self.model_state = remote['model_state']
+        self.warmup_duration_ms = remote['warmup_duration_ms']
+        self.warmup_error = remote.get('warmup_error')
+        return self.model_state
+
+    def close(self) -> None:
+        with self._segments_lock:
+            for segment in self._segments:
+                segment.close()
+                segment.unlink()
+            self._segments = []
+
+
+def _handle_connection(service: FaceRecognitionService, conn) -> None:
+    with conn:
+        request = conn.recv()
+        op = request[0]
+
+        if op == 'status':
+            conn.send(('ok', {
+                'pid': os.getpid(),
+                'model_state': service.model_state,
+                'warmup_duration_ms': service.warmup_duration_ms,
+                'warmup_error': service.warmup_error,
+                'quality_gates': service.gate_stats()
+            }))
+            return
+
+        if op != 'analyze':
+            conn.send(('error', 'RuntimeError', f"Unknown operation: {op}"))
+            return
+
+        _, name, shape, dtype, scale, roi, detector = request
+        segment = _attach_segment(name)
+        image = None
+        try:
+            image = np.ndarray(shape, dtype=np.dtype(dtype), buffer=segment.buf)
+            reply = ('ok', service._analyze_image(image, scale, roi, detector))
+        except Exception as e:
+            if type(e).__name__ not in REMOTE_EXCEPTIONS:
+                logger.error(f"Shared inference error: {str(e)}", exc_info=True)
+            reply = ('error', type(e).__name__, str(e))
+        finally:
+            # The array view must go before the mapping can be closed
+            del image
+            segment.close()
+        conn.send(reply)
+
+
+def serve_connections(listener: Listener, service: FaceRecognitionService, threads: int = 1) -> None:
+    """
+    Accept and answer requests until the listener is closed
+
+    A connection is only accepted when a handler thread is free, so with
+    several processes on one listener the kernel hands new requests to
+    whichever process is idle.
+    """
+    free_threads = threading.BoundedSemaphore(threads)
+    pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="shared-inference")
+
+    def handle(conn):
+        try:
+            _handle_connection(service, conn)
+        except Exception as e:
+            logger.warning(f"Shared inference connection failed: {str(e)}")
+        finally:
+            free_threads.release()
+
+    while True:
+        free_threads.acquire()
+        try:
+            conn = listener.accept()
+        except multiprocessing.AuthenticationError:
+            logger.warning("Rejected shared inference client with a bad authkey")
+            free_threads.release()
+            continue
+        except (EOFError, ConnectionError) as e:
+            # The client went away during the authkey handshake; that ends
+            # this connection, not the process and its warm models
+            logger.warning(f"Shared inference client dropped during handshake: {e!r}")
+            free_threads.release()
+            continue
+        except OSError as e:
+            free_threads.release()
+            if listener._listener is None or e.errno in (errno.EBADF, errno.EINVAL):
+                # Listener closed
+                break
+            logger.warning(f"Shared inference accept failed: {str(e)}")
+            time.sleep(0.1)
+            continue
+        pool.submit(handle, conn)
+
+    pool.shutdown(wait=True)
+
+
+class InferenceServer:
+    """
+    Parent of N inference processes sharing one listening socket
+
+    Children are forked before any model is loaded; each one builds its own
+    FaceRecognitionService and warms it, which imports and patches
+    TensorFlow if its engine uses it. With plan_threads, each child first
+    takes its share of the CPUs (thread_planner), slot = its index.
+    Crashed children are restarted.
+    """
+
+    def __init__(
+        self,
+        address: str = DEFAULT_SOCKET,
+        authkey: Optional[str] = None,
+        processes: int = 1,
+        threads: int = 1,
+        service_factory: Callable[[], FaceRecognitionService] = FaceRecognitionService,
+        plan_threads: bool = False,
+        pin_cpus: bool = False
+    ):
+        self.address = address
+        self.authkey = (authkey or load_authkey()).encode()
+        self.processes = processes
+        self.threads = threads
+        self.service_factory = service_factory
+        self.plan_threads = plan_threads
+        self.pin_cpus = pin_cpus
+        self._stopping = False
+
+    def _child_main(self, listener: Listener, index: int) -> None:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        if self.plan_threads:
+            plan = apply_thread_plan(self.processes, self.pin_cpus, slot=index)
+            logger.info(f"Inference process {index} thread plan: {plan}")
+
+        # TensorFlow and DeepFace are imported, and patched, on first use
+        service = self.service_factory()
+        try:
+            service.warmup()
+        except Exception:
+            logger.error(f"Inference process {index} starting without warm models", exc_info=True)
+
+        logger.info(f"Inference process {index} (pid {os.getpid()}) serving on {self.address}")
+        serve_connections(listener, service, self.threads)
+
+    def serve_forever(self) -> None:
+        if os.path.exists(self.address):
+            os.unlink(self.address)
+        # The socket is created 0660 rather than chmod-ed after the fact,
+        # so it is never reachable with looser permissions
+        previous_umask = os.umask(0o117)
+        try:
+            listener = Listener(self.address, family='AF_UNIX', authkey=self.authkey)
+        finally:
+            os.umask(previous_umask)
+
+        context = multiprocessing.get_context('fork')
+        children = {}
+
+        def start_child(index):
+            child = context.Process(
+                target=self._child_main,
+                args=(listener, index),
+                name=f"face-inference-{index}"
+            )
+            child.start()
+            children[index] = child
+
+        def stop(signum, frame):
+            self._stopping = True
+
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+
+        for index in range(self.processes):
+            start_child(index)
+
+        try:
+            while not self._stopping:
+                for index, child in list(children.items()):
+                    if not child.is_alive():
+                        logger.warning(f"Inference process {index} exited ({child.exitcode}); restarting")
+                        start_child(index)
+                time.sleep(1)
+        finally:
+            for child in children.values():
+                child.terminate()
+            for child in children.values():
+                child.join(timeout=10)
+            listener.close()
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shared face recognition inference process")
+    parser.add_argument('--socket', default=os.getenv("SHARED_INFERENCE_SOCKET", DEFAULT_SOCKET))
+    parser.add_argument('--processes', type=int, default=int(os.getenv("SHARED_INFERENCE_PROCESSES", "1")))
+    parser.add_argument('--threads', type=int, default=int(os.getenv("SHARED_INFERENCE_THREADS", "1")))
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+
+    batch_max_size = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", "1"))
+    batch_max_wait_ms = float(os.getenv("EMBEDDING_BATCH_MAX_WAIT_MS", "5"))
+    alignment = os.getenv("FACE_ALIGNMENT", "landmarks")
+    detector_backend = os.getenv("DETECTOR_BACKEND") or None
+    detector_model_dir = os.getenv("DETECTOR_MODEL_DIR") or MODEL_DIR
+    engine = os.getenv("FACE_ENGINE", "deepface")
+    precision = os.getenv("EMBEDDING_PRECISION", "fp32")
+    compiled_inference = os.getenv("COMPILED_INFERENCE", "off")
+    model_store = os.getenv("MODEL_STORE", "true").lower() in ("1", "true", "yes")
+    thread_plan = os.getenv("THREAD_PLAN", "auto")
+    if thread_plan not in THREAD_PLAN_MODES:
+        raise ValueError(f"THREAD_PLAN must be one of: {', '.join(THREAD_PLAN_MODES)}")
+    planned = {}
+    if thread_plan == "auto":
+        planned = plan_threads(args.processes, available_cpus(), cgroup_cpu_limit())
+    engine_options = None
+    if engine == "onnxruntime":
+        engine_options = {
+            'intra_op_threads': int(os.getenv("ORT_INTRA_OP_THREADS") or planned.get('intra_op_threads', 0)),
+            'inter_op_threads': int(os.getenv("ORT_INTER_OP_THREADS", "0")),
+            'graph_optimization': os.getenv("ORT_GRAPH_OPTIMIZATION", "all")
+        }
+
+    server = InferenceServer(
+        address=args.socket,
+        authkey=load_authkey(),
+        processes=args.processes,
+        threads=args.threads,
+        service_factory=lambda: FaceRecognitionService(
+            batch_max_size=batch_max_size,
+            batch_max_wait_ms=batch_max_wait_ms,
+            alignment=alignment,
+            detector_backend=detector_backend,
+            detector_model_dir=detector_model_dir,
+            engine=engine,
+            engine_options=engine_options,
+            precision=precision,
+            compiled_inference=compiled_inference,
+            model_store=model_store
+        ),
+        plan_threads=thread_plan == "auto",
+        pin_cpus=os.getenv("CPU_PINNING", "false").lower() in ("1", "true", "yes")
+    )
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,80 +1,77 @@
-"""Startup patch to fix TensorFlow/Keras compatibility issues"""
+"""
+TensorFlow/Keras compatibility patch
 
-import sys
-import importlib
+DeepFace's model code expects tf.keras.layers.LocallyConnected2D, which
+newer Keras releases dropped. apply() puts it back before DeepFace is
+imported. Importing this module does nothing; get_deepface() calls apply()
+the first time an engine needs DeepFace, so processes that never build the
+model never import TensorFlow.
+"""
 
-# Apply patch before any problematic imports
-print("Applying TensorFlow/Keras compatibility patch...")
+import logging
+import os
+import threading
 
-try:
-    import tensorflow as tf
-    
-    # Check if LocallyConnected2D is available
-    if not hasattr(tf.keras.layers, 'LocallyConnected2D'):
-        # Try to find it in various places
-        found_layer = None
-        
-        # Try tf_keras
+logger = logging.getLogger(__name__)
+
+_applied = False
+_lock = threading.Lock()
+
+
+def _find_locally_connected_2d():
+    """LocallyConnected2D from whichever Keras package still ships it"""
+    try:
+        from tf_keras.layers import LocallyConnected2D
+        return LocallyConnected2D
+    except ImportError:
+        pass
+    try:
+        import keras
+        if hasattr(keras.layers, 'LocallyConnected2D'):
+            return keras.layers.LocallyConnected2D
+    except ImportError:
+        pass
+    try:
+        from keras.src.layers import LocallyConnected2D
+        return LocallyConnected2D
+    except ImportError:
+        return None
+
+
+def apply() -> None:
+    """
+    Import TensorFlow and make tf.keras.layers.LocallyConnected2D available
+
+    Safe to call repeatedly and from several threads; only the first call
+    does any work. Failures are logged, not raised, so DeepFace can still
+    build models that do not use the layer.
+    """
+    global _applied
+    if _applied:
+        return
+    with _lock:
+        if _applied:
+            return
+        _applied = True
+        os.environ['TF_KERAS'] = '1'
         try:
-            from tf_keras.layers import LocallyConnected2D
-            found_layer = LocallyConnected2D
-            print("Found LocallyConnected2D in tf_keras.layers")
-        except ImportError:
-            pass
-        
-        # Try keras
-        if found_layer is None:
-            try:
-                import keras
-                if hasattr(keras.layers, 'LocallyConnected2D'):
-                    found_layer = keras.layers.LocallyConnected2D
-                    print("Found LocallyConnected2D in keras.layers")
-            except ImportError:
-                pass
-        
-        # Try keras.src
-        if found_layer is None:
-            try:
-                from keras.src.layers import LocallyConnected2D
-                found_layer = LocallyConnected2D
-                print("Found LocallyConnected2D in keras.src.layers")
-            except ImportError:
-                pass
-        
-        # Try keras.layers directly
-        if found_layer is None:
-            try:
-                from keras.layers import LocallyConnected2D
-                found_layer = LocallyConnected2D
-                print("Found LocallyConnected2D in keras.layers (direct import)")
-            except ImportError:
-                pass
-        
-        # If found, add it to tensorflow.keras.layers
-        if found_layer is not None:
-            tf.keras.layers.LocallyConnected2D = found_layer
-            print("Successfully patched LocallyConnected2D in tensorflow.keras.layers")
-        else:
-            # Create a minimal stub to allow import to succeed
-            class LocallyConnected2D:
-                def __init__(self, *args, **kwargs):
-                    raise NotImplementedError(
-                        "LocallyConnected2D is not available in your setup. "
-                        "This may affect some face recognition models."
-                    )
-            tf.keras.layers.LocallyConnected2D = LocallyConnected2D
-            print("Created stub for LocallyConnected2D to allow imports")
-    else:
-        print("LocallyConnected2D already exists in tensorflow.keras.layers")
-    
-    # Set environment variable to ensure compatibility
-    import os
-    os.environ['TF_KERAS'] = '1'
-    print("Set TF_KERAS=1 environment variable")
-    
-except Exception as e:
-    print(f"Error in startup patch: {e}")
-    import traceback
-    traceback.print_exc()
+            import tensorflow as tf
+
+            if hasattr(tf.keras.layers, 'LocallyConnected2D'):
+                return
+            layer = _find_locally_connected_2d()
+            if layer is None:
+                class LocallyConnected2D:
+                    """Stub so DeepFace imports; models using the layer fail when built"""
 
-print("TensorFlow/Keras compatibility patch applied.")
\ No newline at end of file
+                    def __init__(self, *args, **kwargs):
+                        raise NotImplementedError(
+                            "LocallyConnected2D is not available in your setup. "
+                            "This may affect some face recognition models."
+                        )
+                layer = LocallyConnected2D
+                logger.warning("LocallyConnected2D not found; installed a stub")
+            tf.keras.layers.LocallyConnected2D = layer
+            logger.info(f"Patched tf.keras.layers.LocallyConnected2D from {layer.__module__}")
+        except Exception:
+            logger.error("TensorFlow/Keras compatibility patch failed", exc_info=True)
@@ -0,0 +1,136 @@
+"""
+Template Cache
+Bounded LRU/TTL cache of stored embeddings so /verify callers can send a
+template key instead of re-uploading the embedding on every request
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+import logging
+
+import numpy as np
+
+from metrics import Counter
+
+logger = logging.getLogger(__name__)
+
+# Prefix of content-hash keys; caller-chosen keys must not use it unless
+# they are the real hash of the embedding sent with them
+HASH_PREFIX = "sha256:"
+
+
+def template_key(embedding) -> str:
+    """
+    Content hash of an embedding, independent of how it was transported
+
+    The hash is taken over the little-endian float32 values, so JSON,
+    base64 and binary forms of the same template share one key.
+    """
+    values = np.asarray(embedding, dtype="<f4").reshape(-1)
+    return HASH_PREFIX + hashlib.sha256(values.tobytes()).hexdigest()
+
+
+class TemplateCache:
+    """
+    Thread-safe LRU cache of templates with a per-entry time-to-live
+
+    Entries are keyed by a caller-supplied ID or by template_key(). A get
+    refreshes recency but not the expiry, so a template is re-sent at
+    least once per TTL.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 3600.0):
+        """
+        Args:
+            max_entries: Templates kept before the least recently used is evicted
+            ttl_seconds: Lifetime of an entry; 0 disables expiry
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        # Metrics
+        self.hits = Counter()
+        self.misses = Counter()
+        self.evictions = Counter()
+        self.expirations = Counter()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def put(self, embedding, template_id: Optional[str] = None) -> str:
+        """
+        Store a template
+
+        Args:
+            embedding: Validated embedding
+            template_id: Caller's key; defaults to the content hash
+
+        Returns:
+            Key the template is stored under
+
+        Raises:
+            ValueError: A "sha256:" key that is not the embedding's hash
+        """
+        embedding = np.asarray(embedding)
+        content_key = template_key(embedding)
+        if template_id is None:
+            template_id = content_key
+        elif template_id.startswith(HASH_PREFIX) and template_id != content_key:
+            raise ValueError("template_id does not match the embedding's content hash")
+
+        if not self.enabled:
+            return template_id
+
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds > 0 else None
+        with self._lock:
+            self._entries[template_id] = (embedding, expires_at)
+            self._entries.move_to_end(template_id)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions.inc()
+        return template_id
+
+    def get(self, template_id: str) -> Optional[np.ndarray]:
+        """
+        Look up a template
+
+        Returns:
+            The embedding, or None if it was never stored, evicted or expired
+        """
+        with self._lock:
+            entry = self._entries.get(template_id)
+            if entry is not None and entry[1] is not None and entry[1] <= time.monotonic():
+                del self._entries[template_id]
+                self.expirations.inc()
+                entry = None
+
+            if entry is None:
+                self.misses.inc()
+                return None
+
+            self._entries.move_to_end(template_id)
+            self.hits.inc()
+            return entry[0]
+
+    def stats(self) -> Dict:
+        """Hit/miss/eviction counters for /metrics"""
+        hits, misses = self.hits.value, self.misses.value
+        return {
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl_seconds,
+            'hits': hits,
+            'misses': misses,
+            'hit_ratio': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            'evictions': self.evictions.value,
+            'expirations': self.expirations.value
+        }
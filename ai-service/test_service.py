@@ -5,9 +5,12 @@ Run with: pytest test_service.py -v
 
 import pytest
 import numpy as np
+import cv2
 from io import BytesIO
 from PIL import Image
+import asyncio
 import json
+import threading
 
 from face_recognition_service import (
     FaceRecognitionService,
@@ -16,6 +19,40 @@ from face_recognition_service import (
     LowQualityImageException,
     InvalidImageException
 )
+from inference_executor import InferenceExecutor, InferenceQueueFullException
+from embedding_batcher import EmbeddingBatcher
+from preload_server import PRELOAD_NONE, preload, preloads_models
+from face_gallery import FaceGallery
+from ann_index import IVFIndex, create_index
+from embedding_codec import (
+    encode_embedding,
+    decode_embedding,
+    encode_embedding_base64,
+    decode_embedding_field
+)
+from template_cache import TemplateCache, template_key
+from model_store import ALIGNMENT, MAPPED_ONNX, map_arrays, write_arrays
+from thread_planner import cgroup_cpu_limit, claim_worker_slot, plan_threads
+from result_cache import ResultCache
+from embedding_engines import (
+    EMBEDDING_TOLERANCE,
+    DnnEmbedder,
+    KerasEmbedder,
+    OnnxRuntimeEmbedder,
+    compiled_batch_sizes,
+    cosine_distances,
+    create_embedder
+)
+from face_detection import (
+    HaarFaceDetector,
+    LBPFaceDetector,
+    YuNetFaceDetector,
+    create_detector,
+    parse_detector_list,
+    parse_roi_hint,
+    roi_region
+)
+from quality_gates import QualityGates, estimate_pose
 
 
 @pytest.fixture
@@ -88,6 +125,699 @@ class TestImageValidation:
         
         # Should not raise exception
         face_service._validate_image_size(image)
+    
+    def test_oversized_image_rejected_from_header(self, face_service, create_test_image, monkeypatch):
+        """Test size limits are enforced before any pixel data is decoded"""
+        def fail_decode(*args, **kwargs):
+            raise AssertionError("image was decoded")
+        monkeypatch.setattr(face_service, '_load_image_from_bytes', fail_decode)
+        
+        with pytest.raises(LowQualityImageException, match="too large"):
+            face_service._process_image(create_test_image(5000, 300))
+    
+    def test_decompression_bomb_rejected(self, face_service):
+        """Test a tiny file declaring a huge image is rejected from its header"""
+        import struct
+        import zlib
+        
+        def chunk(kind, data):
+            return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+        
+        bomb = (
+            b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', 50000, 50000, 8, 2, 0, 0, 0))
+            + chunk(b'IEND', b'')
+        )
+        with pytest.raises(LowQualityImageException, match="too large"):
+            face_service._process_image(bomb)
+    
+    def test_unsupported_format_rejected(self, face_service):
+        """Test formats outside the allow-list are refused"""
+        img_bytes = BytesIO()
+        Image.new('RGB', (200, 200)).save(img_bytes, format='ICO', sizes=[(200, 200)])
+        
+        with pytest.raises(InvalidImageException, match="Unsupported image format"):
+            face_service._process_image(img_bytes.getvalue())
+    
+    def test_oversized_jpeg_decoded_reduced(self, fake_deepface):
+        """Test DCT-reduced decoding and face coordinates in original pixels"""
+        service = FaceRecognitionService()
+        img_bytes = BytesIO()
+        rng = np.random.default_rng(0)
+        pixels = rng.integers(60, 200, size=(216, 384, 3), dtype=np.uint8).repeat(10, axis=0).repeat(10, axis=1)
+        Image.fromarray(pixels).save(img_bytes, format='JPEG')
+        
+        result = service._process_image(img_bytes.getvalue())
+        
+        decoded = fake_deepface.calls[0][1]['img_path']
+        assert decoded.shape == (1080, 1920, 3)
+        assert result['face_region'] == {'x': 200, 'y': 200, 'w': 400, 'h': 400}
+        assert service._decode_scale(1280, 720, "JPEG") == 1
+        assert service._decode_scale(3840, 2160, "PNG") == 1
+    
+    def test_exif_orientation_applied(self, face_service):
+        """Test phone photos are decoded upright, with either decoder"""
+        pixels = np.zeros((100, 200, 3), dtype=np.uint8)
+        pixels[:, :50] = (255, 0, 0)  # red strip on the left
+        image = Image.fromarray(pixels)
+        exif = image.getexif()
+        exif[0x0112] = 6  # rotate 90 degrees clockwise
+        img_bytes = BytesIO()
+        image.save(img_bytes, format='PNG', exif=exif)
+        
+        for decode in (face_service._load_image_from_bytes, face_service._load_image_with_pil):
+            decoded = decode(img_bytes.getvalue())
+            assert decoded.shape == (200, 100, 3)
+            assert tuple(decoded[0, 0]) == (0, 0, 255)  # red on top, in BGR
+
+
+class FakeDeepFace:
+    """Stand-in for the DeepFace module that records how it is called"""
+    
+    def __init__(self, face_region=None, confidence=1.0):
+        self.face_region = face_region or {'x': 100, 'y': 100, 'w': 200, 'h': 200}
+        self.confidence = confidence
+        self.calls = []
+    
+    def extract_faces(self, **kwargs):
+        self.calls.append(('extract_faces', kwargs))
+        height, width = kwargs.get('target_size', (224, 224))
+        return [{
+            'face': np.zeros((height, width, 3)),
+            'facial_area': self.face_region,
+            'confidence': self.confidence
+        }]
+    
+    def represent(self, **kwargs):
+        self.calls.append(('represent', kwargs))
+        return [{'embedding': [0.1] * 512, 'facial_area': self.face_region}]
+
+
+@pytest.fixture
+def fake_deepface(monkeypatch):
+    """
+    Replace the lazily imported DeepFace module with FakeDeepFace
+    
+    Detection is routed through DeepFace.extract_faces, as it is for every
+    backend except the built-in Haar detector.
+    """
+    import face_recognition_service
+    fake = FakeDeepFace()
+    monkeypatch.setattr(face_recognition_service, 'deepface_module', fake)
+    monkeypatch.setattr(FaceRecognitionService, 'DETECTOR_BACKEND', 'fake')
+    return fake
+
+
+@pytest.fixture
+def create_textured_image():
+    """Factory for noisy images that pass the quality threshold"""
+    def _create_image(width=400, height=400, seed=0):
+        rng = np.random.default_rng(seed)
+        pixels = rng.integers(60, 200, size=(height, width, 3), dtype=np.uint8)
+        img_bytes = BytesIO()
+        Image.fromarray(pixels).save(img_bytes, format='PNG')
+        return img_bytes.getvalue()
+    return _create_image
+
+
+class TestSinglePassPipeline:
+    """Test that detection runs once and the aligned chip feeds the model"""
+    
+    def test_detection_runs_once(self, face_service, fake_deepface, create_textured_image):
+        """Test that represent skips detection and receives the aligned chip"""
+        result = face_service.enroll_face(create_textured_image())
+        
+        names = [name for name, _ in fake_deepface.calls]
+        assert names == ['extract_faces', 'represent']
+        
+        represent_kwargs = fake_deepface.calls[1][1]
+        assert represent_kwargs['detector_backend'] == 'skip'
+        assert represent_kwargs['img_path'].shape == face_service.MODEL_INPUT_SIZE + (3,)
+        assert len(result['embedding']) == 512
+    
+    def test_stage_timings_reported(self, face_service, fake_deepface, create_textured_image):
+        """Test that per-stage timings are returned"""
+        result = face_service.verify_face(create_textured_image(), [0.1] * 512)
+        
+        assert set(result['timings']) == {'decode_ms', 'detect_ms', 'embed_ms'}
+        assert result['match']
+
+
+class StubCascade:
+    """Cascade stand-in that returns fixed boxes and records its input"""
+    
+    def __init__(self, boxes, scores=None):
+        self.boxes = boxes
+        self.scores = scores or [5.0] * len(boxes)
+        self.calls = []
+    
+    def detectMultiScale3(self, image, **kwargs):
+        self.calls.append((image.shape, kwargs))
+        return self.boxes, None, self.scores
+    
+    def detectMultiScale(self, image, *args, **kwargs):
+        self.calls.append((image.shape, kwargs))
+        return self.boxes
+
+
+class TestHaarDetection:
+    """Test detection on the downscaled working image"""
+    
+    def test_boxes_map_back_to_full_resolution(self, monkeypatch):
+        """Test the working image size, minimum window and box mapping"""
+        detector = HaarFaceDetector(detection_face_size=40, window_size=24)
+        cascade = StubCascade([(50, 20, 40, 40)])
+        monkeypatch.setattr(detector, '_cascade', lambda name: cascade)
+        
+        detections = detector.detect(np.zeros((1000, 2000, 3), dtype=np.uint8), min_face_size=80)
+        
+        shape, kwargs = cascade.calls[0]
+        assert shape == (500, 1000)
+        assert kwargs['minSize'] == (24, 24)
+        assert detections == [({'x': 100, 'y': 40, 'w': 80, 'h': 80}, 5.0)]
+    
+    def test_small_images_are_not_upscaled(self, monkeypatch):
+        """Test the working factor never exceeds 1"""
+        detector = HaarFaceDetector(detection_face_size=36)
+        cascade = StubCascade([])
+        monkeypatch.setattr(detector, '_cascade', lambda name: cascade)
+        
+        detector.detect(np.zeros((300, 400, 3), dtype=np.uint8), min_face_size=20)
+        
+        assert cascade.calls[0][0] == (300, 400)
+    
+    def test_find_eyes_searches_eye_band(self, monkeypatch):
+        """Test the eye search runs on the scaled eye band and maps back to the box"""
+        detector = HaarFaceDetector(eye_search_width=50)
+        eyes = StubCascade([(5, 10, 10, 10), (30, 5, 10, 10)])
+        monkeypatch.setattr(detector, '_cascade', lambda name: eyes)
+        image = np.full((400, 400, 3), 200, dtype=np.uint8)
+        
+        found = detector.find_eyes(image, {'x': 100, 'y': 50, 'w': 100, 'h': 200})
+        
+        shape, kwargs = eyes.calls[0]
+        assert shape == (45, 50)  # rows 30-120 of the box at half scale
+        assert kwargs['maxSize'] == (20, 20)
+        assert found == ((20.0, 60.0), (70.0, 50.0))
+    
+    def test_align_is_a_single_letterboxed_warp(self):
+        """Test the chip matches crop -> resize -> letterbox and eyes get levelled"""
+        detector = HaarFaceDetector()
+        rows, cols = np.mgrid[0:400, 0:400]
+        image = np.dstack([cols * 0.6, rows * 0.5, (rows + cols) * 0.3]).astype(np.uint8)
+        region = {'x': 100, 'y': 50, 'w': 100, 'h': 200}
+        
+        chip = detector.align(image, region, (160, 160))
+        
+        assert chip.shape == (160, 160, 3) and chip.dtype == np.float32
+        expected = cv2.resize(image[50:250, 100:200], (80, 160)) / 255
+        np.testing.assert_allclose(chip[:, 40:120], expected, atol=1.5 / 255)
+        assert chip[:, :40].max() == 0 and chip[:, 120:].max() == 0
+        
+        # Tilted eyes rotate the face, but never into the letterbox bars
+        tilted = detector.align(image, region, (160, 160), eyes=((20, 80), (80, 60)))
+        assert not np.allclose(tilted[:, 40:120], chip[:, 40:120])
+        assert tilted[:, :40].max() == 0 and tilted[:, 120:].max() == 0
+    
+    def test_real_cascades_load(self):
+        """Test the bundled OpenCV cascades load and find nothing in a blank frame"""
+        detector = HaarFaceDetector()
+        detector.load()
+        
+        assert detector.detect(np.full((480, 640, 3), 127, dtype=np.uint8), 80) == []
+    
+    def test_service_uses_working_image_detector(self, monkeypatch, create_textured_image):
+        """Test the opencv backend path feeds the aligned chip to the model"""
+        service = FaceRecognitionService()
+        monkeypatch.setattr(
+            service.face_detector, 'detect',
+            lambda image, min_face_size: [({'x': 50, 'y': 50, 'w': 200, 'h': 200}, 6.0)]
+        )
+        monkeypatch.setattr(service.face_detector, 'find_eyes', lambda image, region: None)
+        chips = []
+        monkeypatch.setattr(service, '_generate_embedding', lambda chip: chips.append(chip) or [0.1] * 512)
+        
+        result = service.enroll_face(create_textured_image())
+        
+        assert result['face_size'] == {'width': 200, 'height': 200}
+        assert chips[0].shape == service.MODEL_INPUT_SIZE + (3,)
+
+
+class TestROIHint:
+    """Test detection seeded by the client's face guide box"""
+    
+    def test_parse_roi_hint(self):
+        """Test well-formed hints parse and malformed ones are rejected"""
+        assert parse_roi_hint("0.25,0.1,0.5,0.8") == (0.25, 0.1, 0.5, 0.8)
+        for text in ["0.1,0.2,0.3", "a,b,c,d", "0,0,0,0.5", "1.2,0,0.5,0.5", "0,0,nan,0.5"]:
+            with pytest.raises(ValueError):
+                parse_roi_hint(text)
+    
+    def test_roi_region_adds_margin_and_clips(self):
+        """Test the searched box is widened and kept inside the image"""
+        assert roi_region((0.25, 0.25, 0.5, 0.5), (400, 800, 3), 0.5) == {'x': 0, 'y': 0, 'w': 800, 'h': 400}
+        assert roi_region((0.4, 0.4, 0.2, 0.2), (1000, 1000, 3), 0.5) == {'x': 300, 'y': 300, 'w': 400, 'h': 400}
+    
+    def _service(self, monkeypatch, detections):
+        service = FaceRecognitionService()
+        searched = []
+        
+        def detect(image, min_face_size):
+            searched.append(image.shape[:2])
+            return detections(image)
+        
+        monkeypatch.setattr(service.face_detector, 'detect', detect)
+        monkeypatch.setattr(service.face_detector, 'find_eyes', lambda image, region: None)
+        monkeypatch.setattr(service, '_generate_embedding', lambda chip: [0.1] * 512)
+        return service, searched
+    
+    def test_hint_hit_skips_full_frame(self, monkeypatch, create_textured_image):
+        """Test a face inside the hint is found without scanning the full frame"""
+        service, searched = self._service(
+            monkeypatch, lambda image: [({'x': 20, 'y': 30, 'w': 100, 'h': 100}, 6.0)]
+        )
+        
+        result = service._process_image(create_textured_image(1000, 1000), roi=(0.4, 0.4, 0.2, 0.2))
+        
+        assert searched == [(300, 300)]
+        assert result['face_region'] == {'x': 370, 'y': 380, 'w': 100, 'h': 100}
+        assert service.roi_stats() == {'hits': 1, 'fallbacks': 0, 'hit_ratio': 1.0}
+    
+    def test_empty_hint_falls_back_to_full_frame(self, monkeypatch, create_textured_image):
+        """Test the full frame is searched when the hinted box has no face"""
+        service, searched = self._service(
+            monkeypatch,
+            lambda image: [({'x': 600, 'y': 600, 'w': 150, 'h': 150}, 6.0)] if image.shape[0] == 1000 else []
+        )
+        
+        result = service._process_image(create_textured_image(1000, 1000), roi=(0.1, 0.1, 0.2, 0.2))
+        
+        assert searched == [(300, 300), (1000, 1000)]
+        assert result['face_region']['x'] == 600
+        assert service.roi_stats()['fallbacks'] == 1
+    
+    def test_invalid_roi_rejected_by_endpoint(self, fake_deepface, create_textured_image):
+        """Test a malformed roi form field is a client error"""
+        from fastapi.testclient import TestClient
+        import main
+        client = TestClient(main.app)
+        
+        response = client.post(
+            "/enroll",
+            files={'image': ('face.png', create_textured_image(), 'image/png')},
+            data={'roi': '0.5,0.5'}
+        )
+        assert response.status_code == 400
+        
+        response = client.post(
+            "/enroll",
+            files={'image': ('face.png', create_textured_image(), 'image/png')},
+            data={'roi': '0.2,0.1,0.6,0.8'}
+        )
+        assert response.json()['success']
+        assert 'roi_hint' in client.get("/metrics").json()
+
+
+class TestDetectorBackends:
+    """Test the pluggable detector backends and per-request selection"""
+    
+    def test_backend_names(self, tmp_path):
+        """Test backend lists are validated and native backends are built by name"""
+        assert parse_detector_list(" lbp, yunet ,") == ('lbp', 'yunet')
+        with pytest.raises(ValueError):
+            parse_detector_list("opencv,haar")
+        with pytest.raises(ValueError):
+            FaceRecognitionService(detector_backend="haar")
+        
+        assert isinstance(create_detector("opencv"), HaarFaceDetector)
+        lbp = create_detector("lbp", str(tmp_path))
+        assert isinstance(lbp, LBPFaceDetector)
+        assert (lbp.window_size, lbp.detection_face_size) == (45, 68)
+        with pytest.raises(RuntimeError):
+            lbp.load()  # no cascade file in tmp_path
+    
+    def test_yunet_landmarks_become_box_relative_eyes(self, monkeypatch):
+        """Test YuNet boxes map back to the full image with eye centres for alignment"""
+        detector = YuNetFaceDetector(detection_face_size=40)
+        sizes = []
+        
+        class StubModel:
+            def setInputSize(self, size):
+                sizes.append(size)
+            
+            def detect(self, image):
+                face = np.zeros(15, dtype=np.float32)
+                face[:4] = (50, 20, 40, 40)
+                face[4:8] = (80, 35, 60, 36)  # subject's right eye first
+                face[14] = 0.95
+                return 1, face[None]
+        
+        monkeypatch.setattr(detector, '_model', lambda: StubModel())
+        
+        faces = detector.detect_faces(np.zeros((1000, 2000, 3), dtype=np.uint8), min_face_size=80)
+        
+        assert sizes == [(1000, 500)]
+        assert faces[0]['facial_area'] == {'x': 100, 'y': 40, 'w': 80, 'h': 80}
+        assert faces[0]['confidence'] == pytest.approx(0.95)
+        assert faces[0]['eyes'] == ((20.0, 32.0), (60.0, 30.0))
+    
+    def test_yunet_find_eyes_on_another_detectors_box(self, monkeypatch):
+        """Test YuNet landmarks for a given face box, picking the face at its centre"""
+        detector = YuNetFaceDetector()
+        sizes = []
+        
+        class StubModel:
+            def setInputSize(self, size):
+                sizes.append(size)
+            
+            def detect(self, image):
+                faces = np.zeros((2, 15), dtype=np.float32)
+                faces[0, :8] = (0, 0, 20, 20, 5, 5, 15, 5)
+                faces[1, :8] = (60, 60, 40, 40, 100, 80, 60, 80)
+                return 2, faces
+        
+        monkeypatch.setattr(detector, '_model', lambda: StubModel())
+        
+        eyes = detector.find_eyes(np.zeros((1000, 2000, 3), dtype=np.uint8), {'x': 100, 'y': 40, 'w': 80, 'h': 80})
+        
+        assert sizes == [(160, 160)]  # box plus 25% margin, scaled to 160px
+        assert np.allclose(eyes, ((25.0, 40.0), (55.0, 40.0)))
+    
+    def test_landmarks_come_from_yunet_when_installed(self, tmp_path):
+        """Test alignment uses YuNet landmarks when its model file is present"""
+        assert FaceRecognitionService(detector_model_dir=str(tmp_path))._landmarker().name == "opencv"
+        
+        (tmp_path / "face_detection_yunet_2023mar.onnx").write_bytes(b"")
+        assert FaceRecognitionService(detector_model_dir=str(tmp_path))._landmarker().name == "yunet"
+    
+    def test_request_override_uses_that_backend(self, monkeypatch, create_textured_image):
+        """Test a per-request detector replaces the default and its eyes skip the eye search"""
+        service = FaceRecognitionService(result_cache_size=8)
+        
+        class StubDetector:
+            def detect_faces(self, image, min_face_size):
+                return [{
+                    'facial_area': {'x': 50, 'y': 50, 'w': 200, 'h': 200},
+                    'confidence': 0.99, 'face': None, 'eyes': ((60.0, 80.0), (140.0, 80.0))
+                }]
+        
+        monkeypatch.setitem(service._native_detectors, 'yunet', StubDetector())
+        monkeypatch.setattr(service.face_detector, 'detect', lambda image, min_face_size: [])
+        monkeypatch.setattr(service.face_detector, 'find_eyes', lambda image, region: 1 / 0)
+        monkeypatch.setattr(service, '_generate_embedding', lambda chip: [0.1] * 512)
+        image = create_textured_image()
+        
+        assert service.enroll_face(image, detector='yunet')['face_size'] == {'width': 200, 'height': 200}
+        with pytest.raises(FaceNotDetectedException):
+            service.enroll_face(image)  # cached result is per detector
+
+
+class TestEmbeddingEngines:
+    """Test the TensorFlow-free embedding engines"""
+    
+    def test_dnn_embedder_feeds_nchw_batches(self, monkeypatch, tmp_path):
+        """Test chips are transposed to NCHW and one row per chip comes back"""
+        embedder = DnnEmbedder(str(tmp_path / "facenet512.onnx"))
+        with pytest.raises(RuntimeError, match="export_onnx"):
+            embedder.load()
+        
+        class StubNet:
+            def setInput(self, blob):
+                self.blob = blob
+            
+            def forward(self):
+                return np.ones((len(self.blob), 512), dtype=np.float32)
+        
+        net = StubNet()
+        monkeypatch.setattr(embedder, '_net', lambda: net)
+        chips = np.zeros((3, 160, 160, 3), dtype=np.float32)
+        chips[:, 0, 1, 2] = 1.0
+        
+        assert embedder.embed(chips).shape == (3, 512)
+        assert net.blob.shape == (3, 3, 160, 160) and net.blob[0, 2, 0, 1] == 1.0
+    
+    def test_dnn_engine_never_touches_deepface(self, monkeypatch, create_textured_image):
+        """Test the opencv-dnn engine defaults to yunet and embeds without DeepFace"""
+        import face_recognition_service
+        with pytest.raises(ValueError):
+            FaceRecognitionService(engine="opencv-dnn", detector_backend="mtcnn")
+        
+        service = FaceRecognitionService(engine="opencv-dnn")
+        assert service._backend() == "yunet"
+        
+        monkeypatch.setattr(face_recognition_service, 'get_deepface', lambda: 1 / 0)
+        monkeypatch.setattr(service.embedder, 'embed', lambda chips: np.full((len(chips), 512), 0.5))
+        yunet = service._native_detector("yunet")
+        with pytest.raises(RuntimeError, match="YuNet model not found"):
+            service.warmup()
+        
+        monkeypatch.setattr(yunet, 'load', lambda: None)
+        monkeypatch.setattr(yunet, 'detect_faces', lambda image, min_face_size: [
+            {'facial_area': {'x': 50, 'y': 50, 'w': 200, 'h': 200}, 'confidence': 0.95, 'face': None}
+        ])
+        monkeypatch.setattr(service.face_detector, 'find_eyes', lambda image, region: None)
+        
+        service.warmup()
+        result = service.enroll_face(create_textured_image())
+        
+        assert result['embedding'] == [0.5] * 512
+        assert service.model_state == "ready"
+    
+    def test_onnxruntime_converts_once(self, monkeypatch, tmp_path):
+        """Test a missing ONNX export is converted on first load and reused after"""
+        import export_onnx
+        with pytest.raises(ValueError):
+            OnnxRuntimeEmbedder(str(tmp_path / "facenet512.onnx"), graph_optimization="max")
+        
+        exports = []
+        monkeypatch.setattr(export_onnx, 'export', lambda path: exports.append(path) or open(path, 'wb').close())
+        embedder = OnnxRuntimeEmbedder(str(tmp_path / "facenet512.onnx"), intra_op_threads=2)
+        
+        embedder._ensure_model()
+        embedder._ensure_model()
+        
+        assert exports == [str(tmp_path / "facenet512.onnx")]
+    
+    def test_onnxruntime_embeddings_match_deepface(self, tmp_path):
+        """Test templates stay comparable: ONNX Runtime vs DeepFace on the same chips"""
+        pytest.importorskip("onnxruntime")
+        pytest.importorskip("tensorflow")
+        pytest.importorskip("deepface")
+        from face_detection import MODEL_DIR
+        from face_recognition_service import get_deepface
+        import os
+        
+        model_path = os.path.join(MODEL_DIR, "facenet512.onnx")
+        if not os.path.isfile(model_path):
+            pytest.importorskip("tf2onnx")
+            model_path = str(tmp_path / "facenet512.onnx")
+        embedder = OnnxRuntimeEmbedder(model_path)
+        
+        chips = np.random.default_rng(1).random((8, 160, 160, 3), dtype=np.float32)
+        expected = np.asarray(get_deepface().build_model("Facenet512").predict(chips, verbose=0))
+        actual = embedder.embed(chips)
+        
+        assert cosine_distances(expected, actual).max() <= EMBEDDING_TOLERANCE
+        # Verification decisions between stored (Keras) and new (ONNX) templates are unchanged
+        service = FaceRecognitionService()
+        for i in range(1, len(chips)):
+            keras = service._calculate_similarity(expected[0], expected[i])
+            mixed = service._calculate_similarity(expected[0], actual[i])
+            assert abs(keras - mixed) <= EMBEDDING_TOLERANCE * 2
+    
+    def test_precision_follows_engine_support(self, tmp_path):
+        """Test unsupported precisions are refused and reduced models are never converted"""
+        with pytest.raises(ValueError, match="fp32, bf16"):
+            FaceRecognitionService(precision="int8")
+        with pytest.raises(ValueError):
+            create_embedder("opencv-dnn", str(tmp_path), precision="int8")
+        
+        dnn = create_embedder("opencv-dnn", str(tmp_path), precision="fp16")
+        assert dnn.model_path == str(tmp_path / "facenet512.onnx") and dnn.precision == "fp16"
+        
+        embedder = create_embedder("onnxruntime", str(tmp_path), precision="int8")
+        assert embedder.model_path == str(tmp_path / "facenet512.int8.onnx")
+        with pytest.raises(RuntimeError, match="quantize_model.py"):
+            embedder.load()
+        
+        service = FaceRecognitionService(engine="onnxruntime", precision="fp16", detector_model_dir=str(tmp_path))
+        assert "fp16" in service._cache_config()
+    
+    def test_precision_guardrail_reports_drift_and_rates(self):
+        """Test the guardrail compares fp32 templates against reduced-precision probes"""
+        from quantize_model import guardrail
+        
+        rng = np.random.default_rng(0)
+        people = rng.normal(size=(3, 512))
+        reference = np.repeat(people, 2, axis=0) + 0.1 * rng.normal(size=(6, 512))
+        labels = ['a', 'a', 'b', 'b', 'c', 'c']
+        
+        same = guardrail(reference, reference.copy(), labels, 0.40)
+        assert same['drift']['max'] < 1e-9
+        assert same['before'] == same['after'] == {'genuine': 3, 'impostor': 12, 'FAR': 0.0, 'FRR': 0.0}
+        
+        # A probe drifting onto another identity is falsely accepted and rejected
+        drifted = reference.copy()
+        drifted[5] = reference[0]
+        result = guardrail(reference, drifted, labels, 0.40)
+        assert result['drift']['max'] > 0.5
+        assert result['far_change'] > 0 and result['frr_change'] > 0
+    
+    def test_compiled_batches_padded_to_traced_sizes(self):
+        """Test every batch runs through a function traced for a fixed size, never a new one"""
+        assert compiled_batch_sizes(1) == (1,)
+        assert compiled_batch_sizes(6) == (1, 2, 4, 6)
+        with pytest.raises(ValueError):
+            FaceRecognitionService(engine="opencv-dnn", compiled_inference="on")
+        
+        service = FaceRecognitionService(batch_max_size=4, compiled_inference="on")
+        embedder = service.embedder
+        assert isinstance(embedder, KerasEmbedder) and embedder.batch_sizes == (1, 2, 4)
+        service.close()
+        
+        shapes = []
+        
+        def traced(batch):
+            shapes.append(batch.shape)
+            return batch.reshape(len(batch), -1)[:, :512] + np.arange(len(batch))[:, np.newaxis]
+        
+        embedder._functions = {size: traced for size in embedder.batch_sizes}
+        chips = np.random.default_rng(0).random((7, 160, 160, 3), dtype=np.float32)
+        embeddings = embedder.embed(chips)
+        
+        assert [shape[0] for shape in shapes] == [4, 4]
+        assert embeddings.shape == (7, 512)
+        np.testing.assert_allclose(embeddings[4:], chips[4:].reshape(3, -1)[:, :512] + np.arange(3)[:, np.newaxis])
+        
+        shapes.clear()
+        embedder.embed(chips[:1])
+        assert shapes == [(1, 160, 160, 3)]
+    
+    def test_compiled_embeddings_match_represent(self):
+        """Test the compiled model call reproduces DeepFace.represent on the same chips"""
+        pytest.importorskip("tensorflow")
+        pytest.importorskip("deepface")
+        from face_recognition_service import get_deepface
+        
+        service = FaceRecognitionService(batch_max_size=4, compiled_inference="on")
+        chips = np.random.default_rng(2).random((5, 160, 160, 3), dtype=np.float32)
+        expected = np.array([
+            get_deepface().represent(
+                img_path=chip, model_name="Facenet512", detector_backend="skip", enforce_detection=False, align=False
+            )[0]['embedding']
+            for chip in chips
+        ])
+        
+        assert cosine_distances(expected, service._embed_batch(chips)).max() <= EMBEDDING_TOLERANCE
+        single = np.array([service._generate_embedding(chip) for chip in chips])
+        assert cosine_distances(expected, single).max() <= EMBEDDING_TOLERANCE
+        service.close()
+
+
+class TestModelStore:
+    """Test the memory-mapped model store"""
+    
+    def test_round_trip_is_aligned_and_read_only(self, tmp_path):
+        """Test stored arrays map back equal, aligned and read-only"""
+        prefix = str(tmp_path / "weights")
+        arrays = [
+            ("conv/kernel", np.arange(27, dtype=np.float32).reshape(3, 3, 3)),
+            ("bn/count", np.array([7], dtype=np.int64)),
+            ("dense/bias", np.ones(5, dtype=np.float16))
+        ]
+        with pytest.raises(ValueError):
+            write_arrays(prefix, arrays + [arrays[0]])
+        with pytest.raises(RuntimeError, match="model_store.py build"):
+            map_arrays(prefix)
+        
+        entries = write_arrays(prefix, arrays)
+        mapped = map_arrays(prefix)
+        
+        assert list(mapped) == [name for name, _ in arrays]
+        assert all(entry['offset'] % ALIGNMENT == 0 for entry in entries)
+        for name, array in arrays:
+            assert mapped[name].dtype == array.dtype and np.array_equal(mapped[name], array)
+        with pytest.raises(ValueError):
+            mapped["conv/kernel"][0, 0, 0] = 1.0
+        
+        with open(f"{prefix}.bin", "r+b") as f:
+            f.truncate(16)
+        with pytest.raises(RuntimeError, match="rebuild"):
+            map_arrays(prefix)
+    
+    def test_onnxruntime_uses_store_when_built(self, tmp_path):
+        """Test fp32 onnxruntime picks the mapped model only once it exists"""
+        assert create_embedder("onnxruntime", str(tmp_path)).mapped_weights is None
+        
+        prefix = str(tmp_path / MAPPED_ONNX)
+        write_arrays(prefix, [("w", np.zeros(4, dtype=np.float32))])
+        open(f"{prefix}.onnx", "wb").close()
+        embedder = create_embedder("onnxruntime", str(tmp_path))
+        
+        assert embedder.model_path == f"{prefix}.onnx" and embedder.mapped_weights == prefix
+        assert create_embedder("onnxruntime", str(tmp_path), model_store=False).mapped_weights is None
+        assert create_embedder("onnxruntime", str(tmp_path), precision="fp16").mapped_weights is None
+
+
+class TestQualityGates:
+    """Test the cheap rejection gates that run before the embedding model"""
+    
+    def test_blank_frame_rejected_before_detection(self, face_service, create_test_image, monkeypatch):
+        """Test a featureless frame is rejected as blurry without running detection"""
+        def fail_detect(*args, **kwargs):
+            raise AssertionError("detector ran")
+        monkeypatch.setattr(face_service, '_find_faces', fail_detect)
+        
+        with pytest.raises(LowQualityImageException, match="blurry"):
+            face_service.enroll_face(create_test_image(400, 400))
+        
+        gates = face_service.gate_stats()['gates']
+        assert gates['blur']['rejected'] == 1
+        assert gates['exposure']['passed'] + gates['exposure']['rejected'] == 0
+    
+    def test_exposure_gate(self):
+        """Test frames dominated by clipped pixels are rejected"""
+        gates = QualityGates()
+        rng = np.random.default_rng(0)
+        dark = rng.integers(0, 12, size=(240, 320, 3), dtype=np.uint8)
+        bright = rng.integers(244, 256, size=(240, 320, 3), dtype=np.uint8)
+        normal = rng.integers(60, 200, size=(240, 320, 3), dtype=np.uint8)
+        
+        assert "underexposed" in gates.check_frame(dark)
+        assert "overexposed" in gates.check_frame(bright)
+        assert gates.check_frame(normal) is None
+    
+    def test_edge_gate(self):
+        """Test a face box touching the frame edge is rejected"""
+        gates = QualityGates(edge_margin=2)
+        
+        assert gates.check_edges({'x': 0, 'y': 50, 'w': 100, 'h': 100}, (400, 400, 3)) is not None
+        assert gates.check_edges({'x': 50, 'y': 50, 'w': 349, 'h': 100}, (400, 400, 3)) is not None
+        assert gates.check_edges({'x': 50, 'y': 50, 'w': 100, 'h': 100}, (400, 400, 3)) is None
+    
+    def test_pose_gate(self):
+        """Test yaw and roll estimates from eye centres"""
+        gates = QualityGates(max_yaw=40, max_roll=30)
+        
+        assert estimate_pose(((40, 60), (120, 60)), 160) == pytest.approx((0.0, 0.0))
+        yaw, roll = estimate_pose(((100, 60), (140, 60)), 160)
+        assert yaw == pytest.approx(30.0) and roll == 0
+        
+        assert gates.check_pose(((40, 40), (120, 100)), 160) is not None  # ~37 degree roll
+        assert gates.check_pose(((120, 60), (156, 60)), 160) is not None  # ~47 degree yaw
+        assert gates.check_pose(((45, 60), (115, 65)), 160) is None
+        assert gates.check_pose(None, 160) is None
+    
+    def test_rejections_estimate_saved_compute(self):
+        """Test stats count rejections and price them at the mean embedding time"""
+        gates = QualityGates()
+        gates.check_edges({'x': 0, 'y': 0, 'w': 10, 'h': 10}, (100, 100, 3))
+        gates.check_edges({'x': 0, 'y': 0, 'w': 10, 'h': 10}, (100, 100, 3))
+        
+        stats = gates.stats(embed_ms_mean=150.0)
+        assert stats['rejected'] == 2
+        assert stats['embed_ms_saved'] == 300.0
+        assert stats['gates']['edge']['time_ms']['count'] == 2
 
 
 class TestEmbeddingGeneration:
@@ -154,9 +884,9 @@ class TestQualityScoring:
 class TestSecurityFeatures:
     """Test security-related functionality"""
     
-    def test_no_face_rejection(self, face_service, create_test_image):
+    def test_no_face_rejection(self, face_service, create_textured_image):
         """Test rejection of images without faces"""
-        image_bytes = create_test_image(400, 400)
+        image_bytes = create_textured_image(400, 400)
         
         with pytest.raises(FaceNotDetectedException):
             face_service.enroll_face(image_bytes)
@@ -194,6 +924,884 @@ class TestVerificationThresholds:
         assert confidence > 95
 
 
+class TestInferenceExecutor:
+    """Test bounded inference executor and backpressure"""
+    
+    def test_runs_blocking_call(self):
+        """Test that results come back through the executor"""
+        executor = InferenceExecutor(slots=1, max_queue=1)
+        try:
+            assert asyncio.run(executor.run(lambda x: x * 2, 21)) == 42
+            assert executor.stats()['completed'] == 1
+        finally:
+            executor.shutdown()
+    
+    def test_rejects_when_queue_full(self):
+        """Test fast rejection once slots and queue are exhausted"""
+        executor = InferenceExecutor(slots=1, max_queue=1)
+        release = threading.Event()
+        
+        async def scenario():
+            running = asyncio.ensure_future(executor.run(release.wait))
+            queued = asyncio.ensure_future(executor.run(release.wait))
+            await asyncio.sleep(0.05)
+            assert executor.in_flight == 1
+            assert executor.queue_depth == 1
+            
+            with pytest.raises(InferenceQueueFullException) as exc_info:
+                await executor.run(release.wait)
+            assert exc_info.value.retry_after >= 1
+            
+            release.set()
+            await asyncio.gather(running, queued)
+        
+        try:
+            asyncio.run(scenario())
+            stats = executor.stats()
+            assert stats['rejected'] == 1
+            assert stats['queue_depth'] == 0
+            assert stats['wait_time_ms']['count'] == 2
+        finally:
+            executor.shutdown()
+    
+    def test_busy_response_has_retry_after(self, monkeypatch, create_test_image):
+        """Test that a full queue maps to 503 with Retry-After"""
+        from fastapi.testclient import TestClient
+        import main
+        
+        async def reject(*args, **kwargs):
+            raise InferenceQueueFullException("Service is busy. Please retry shortly.", retry_after=3)
+        
+        monkeypatch.setattr(main.inference_executor, 'run', reject)
+        client = TestClient(main.app)
+        response = client.post(
+            "/enroll",
+            files={'image': ('face.jpg', create_test_image(), 'image/jpeg')}
+        )
+        
+        assert response.status_code == 503
+        assert response.headers['retry-after'] == '3'
+
+
+class TestEmbeddingBatcher:
+    """Test micro-batching of embedding forward passes"""
+    
+    def test_concurrent_chips_share_a_batch(self):
+        """Test that concurrent calls are coalesced and results fan back out"""
+        batch_sizes = []
+        
+        def embed_batch(chips):
+            batch_sizes.append(len(chips))
+            return chips.reshape(len(chips), -1)[:, :4] + 1
+        
+        batcher = EmbeddingBatcher(embed_batch, max_batch_size=8, max_wait_ms=200)
+        results = {}
+        
+        def worker(i):
+            results[i] = batcher.embed(np.full((2, 2, 3), i, dtype=np.float32))
+        
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        batcher.close()
+        
+        assert sum(batch_sizes) == 4
+        assert max(batch_sizes) > 1
+        for i in range(4):
+            assert np.allclose(results[i], i + 1)
+        assert batcher.stats()['batch_size']['count'] == len(batch_sizes)
+    
+    def test_batch_failure_propagates(self):
+        """Test that a failed forward pass raises in every waiting caller"""
+        def embed_batch(chips):
+            raise RuntimeError("model exploded")
+        
+        batcher = EmbeddingBatcher(embed_batch, max_batch_size=4, max_wait_ms=1)
+        with pytest.raises(RuntimeError, match="model exploded"):
+            batcher.embed(np.zeros((2, 2, 3), dtype=np.float32))
+        batcher.close()
+        
+        assert batcher.stats()['failed_batches'] == 1
+    
+    def test_short_model_output_fails_every_chip(self):
+        """Test that a model returning too few rows cannot strand a caller"""
+        batcher = EmbeddingBatcher(lambda chips: np.zeros((len(chips) - 1, 4)), max_batch_size=4, max_wait_ms=200)
+        errors = []
+        
+        def worker():
+            try:
+                batcher.embed(np.zeros((2, 2, 3), dtype=np.float32))
+            except RuntimeError as e:
+                errors.append(e)
+        
+        threads = [threading.Thread(target=worker) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=5)
+        batcher.close()
+        
+        assert len(errors) == 2
+        assert "rows" in str(errors[0])
+    
+    def test_closed_batcher_rejects_chips(self):
+        """Test that embed after close raises instead of queueing"""
+        batcher = EmbeddingBatcher(lambda chips: chips.reshape(len(chips), -1), max_batch_size=2)
+        batcher.close()
+        with pytest.raises(RuntimeError, match="closed"):
+            batcher.embed(np.zeros((2, 2, 3), dtype=np.float32))
+
+
+class TestWarmupAndReadiness:
+    """Test eager model warmup and the readiness endpoint"""
+    
+    def test_warmup_marks_models_ready(self, face_service, fake_deepface):
+        """Test that warmup runs the pipeline and records its duration"""
+        assert face_service.model_state == 'not_loaded'
+        
+        duration = face_service.warmup()
+        
+        assert face_service.model_state == 'ready'
+        assert face_service.warmup_duration_ms == duration
+        assert 'represent' in [name for name, _ in fake_deepface.calls]
+    
+    def test_warmup_failure_is_reported(self, face_service, monkeypatch):
+        """Test that a failed warmup leaves the service not ready"""
+        def broken_embedding(face_chip):
+            raise RuntimeError("weights missing")
+        
+        monkeypatch.setattr(face_service, '_generate_embedding', broken_embedding)
+        with pytest.raises(RuntimeError):
+            face_service.warmup()
+        
+        assert face_service.model_state == 'failed'
+        assert face_service.warmup_error == "weights missing"
+    
+    def test_successful_embedding_recovers_failed_warmup(self, face_service, fake_deepface):
+        """Test that a working model clears a failed warmup"""
+        face_service.model_state = 'failed'
+        face_service.warmup_error = "timed out"
+        
+        face_service._generate_embedding(np.zeros((160, 160, 3), dtype=np.float32))
+        
+        assert face_service.model_state == 'ready'
+        assert face_service.warmup_error is None
+    
+    def test_ready_endpoint_tracks_model_state(self, monkeypatch):
+        """Test that /ready is 503 until models are warm"""
+        from fastapi.testclient import TestClient
+        import main
+        
+        client = TestClient(main.app)
+        monkeypatch.setattr(main.face_service, 'model_state', 'loading')
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()['model_state'] == 'loading'
+        
+        monkeypatch.setattr(main.face_service, 'model_state', 'ready')
+        response = client.get("/ready")
+        assert response.status_code == 200
+        assert response.json()['queue_depth'] == 0
+        assert response.json()['thread_plan'] == main.THREAD_PLAN
+    
+    def test_startup_never_imports_tensorflow(self):
+        """Test the service and app import without TensorFlow or DeepFace"""
+        import os
+        import subprocess
+        import sys
+        
+        code = (
+            "import sys, main; "
+            "print(sorted({'tensorflow', 'deepface', 'startup_patch'} & set(sys.modules)))"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env={**os.environ, 'EAGER_WARMUP': 'false'},
+            capture_output=True,
+            text=True
+        )
+        
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.strip().splitlines()[-1] == "[]"
+    
+    def test_patch_applied_before_deepface_import(self, monkeypatch):
+        """Test the first get_deepface() applies the Keras patch, once, before importing DeepFace"""
+        import sys
+        import types
+        import face_recognition_service
+        import startup_patch
+        
+        module = types.ModuleType("deepface")
+        module.DeepFace = object()
+        patches = []
+        
+        def apply():
+            # DeepFace only becomes importable once the patch has run
+            patches.append(1)
+            sys.modules["deepface"] = module
+        
+        monkeypatch.setitem(sys.modules, "deepface", None)
+        monkeypatch.setattr(startup_patch, 'apply', apply)
+        monkeypatch.setattr(face_recognition_service, 'deepface_module', None)
+        
+        assert face_recognition_service.get_deepface() is module.DeepFace
+        assert face_recognition_service.get_deepface() is module.DeepFace
+        assert patches == [1]
+
+
+class TestThreadPlanner:
+    """Test the per-worker CPU thread layout"""
+    
+    def test_cpus_split_between_workers(self, tmp_path):
+        """Test the cgroup quota caps the CPUs and each worker gets an even, disjoint share"""
+        (tmp_path / "cpu.max").write_text("max 100000\n")
+        assert cgroup_cpu_limit(str(tmp_path)) is None
+        (tmp_path / "cpu.max").write_text("250000 100000\n")
+        assert cgroup_cpu_limit(str(tmp_path)) == 2.5
+        v1 = tmp_path / "v1"
+        (v1 / "cpu").mkdir(parents=True)
+        (v1 / "cpu" / "cpu.cfs_quota_us").write_text("400000")
+        (v1 / "cpu" / "cpu.cfs_period_us").write_text("100000")
+        assert cgroup_cpu_limit(str(v1)) == 4.0
+        
+        plan = plan_threads(4, list(range(16)))
+        assert plan['intra_op_threads'] == plan['opencv_threads'] == plan['blas_threads'] == 4
+        assert plan['inter_op_threads'] == 2 and plan['pinned_cpus'] is None
+        
+        assert plan_threads(4, list(range(16)), cpu_quota=2.5)['intra_op_threads'] == 1
+        assert plan_threads(8, list(range(4)))['intra_op_threads'] == 1
+        
+        pinned = [plan_threads(4, list(range(8)), pin=True, slot=slot)['pinned_cpus'] for slot in range(4)]
+        assert pinned == [[0, 1], [2, 3], [4, 5], [6, 7]]
+        assert plan_threads(2, [4, 5, 6], pin=True, slot=1)['pinned_cpus'] == [5]
+        with pytest.raises(ValueError):
+            plan_threads(0, [0])
+    
+    def test_worker_slots_claimed_once(self, tmp_path):
+        """Test each process takes a different slot until all are taken"""
+        import thread_planner
+        
+        slots = [claim_worker_slot(2, str(tmp_path)) for _ in range(3)]
+        
+        assert slots == [0, 1, None]
+        for handle in thread_planner._slot_locks[-2:]:
+            handle.close()
+        del thread_planner._slot_locks[-2:]
+        assert claim_worker_slot(2, str(tmp_path)) == 0
+        thread_planner._slot_locks.pop().close()
+
+
+class RecordingInferenceService:
+    """Inference-side stand-in that checks the image it receives"""
+    model_state = 'ready'
+    warmup_duration_ms = 12.5
+    warmup_error = None
+
+    def gate_stats(self):
+        return {'rejected': 0}
+
+    def _analyze_image(self, image, scale=1, roi=None, detector=None):
+        if image.mean() == 0:
+            raise FaceNotDetectedException("No face detected in the image.")
+        return {
+            'face_region': {'x': 0, 'y': 0, 'w': image.shape[1], 'h': image.shape[0]},
+            'quality_score': 75.0,
+            'embedding': [float(image[0, 0, 0])] * 512,
+            'roi_hit': None if roi is None else True,
+            'timings': {'detect_ms': 1.0, 'embed_ms': 2.0}
+        }
+
+
+def serve_recording_service(address):
+    """Inference process entry point for TestSharedInference"""
+    from multiprocessing.connection import Listener
+    from shared_inference import serve_connections
+    
+    listener = Listener(address, family='AF_UNIX', authkey=b'test-key')
+    serve_connections(listener, RecordingInferenceService(), 2)
+
+
+class TestSharedInference:
+    """Test shipping decoded images to a shared inference process"""
+    
+    @pytest.fixture
+    def remote_service(self, tmp_path):
+        import multiprocessing
+        from shared_inference import RemoteFaceRecognitionService
+        
+        address = str(tmp_path / 'inference.sock')
+        server = multiprocessing.get_context('spawn').Process(
+            target=serve_recording_service,
+            args=(address,),
+            daemon=True
+        )
+        server.start()
+        
+        service = RemoteFaceRecognitionService(address=address, authkey='test-key')
+        service.warmup(timeout=30)
+        yield service
+        service.close()
+        server.terminate()
+        server.join()
+    
+    def test_round_trip_through_shared_memory(self, remote_service, create_test_image):
+        """Test that the decoded image reaches the inference side intact"""
+        result = remote_service.enroll_face(create_test_image(400, 300, color=(9, 9, 9)))
+        
+        assert result['face_size'] == {'width': 400, 'height': 300}
+        assert abs(result['embedding'][0] - 9) <= 2  # JPEG rounding
+        assert 'transport_ms' in result['timings']
+    
+    def test_remote_exceptions_keep_their_type(self, remote_service, create_test_image):
+        """Test that pipeline exceptions are re-raised with the same class"""
+        with pytest.raises(FaceNotDetectedException):
+            remote_service.verify_face(create_test_image(400, 400, color=(0, 0, 0)), [0.1] * 512)
+    
+    def test_warmup_waits_for_inference_process(self, remote_service):
+        """Test that the HTTP worker reports the inference process state"""
+        assert remote_service.model_state == 'ready'
+        assert remote_service.warmup_duration_ms == 12.5
+    
+    def test_client_dropped_mid_handshake_keeps_process_serving(self, remote_service):
+        """Test that a client closing before the authkey handshake ends only its connection"""
+        import socket
+        
+        pid = remote_service.status()['pid']
+        for _ in range(3):
+            with socket.socket(socket.AF_UNIX) as dropped:
+                dropped.connect(remote_service.address)
+        
+        assert remote_service.status()['pid'] == pid
+    
+    def test_ready_state_polled_without_warmup(self, remote_service):
+        """Test that a worker that never warmed picks up the remote state"""
+        from shared_inference import RemoteFaceRecognitionService
+        
+        cold = RemoteFaceRecognitionService(address=remote_service.address, authkey='test-key')
+        assert cold.model_state == 'not_loaded'
+        assert cold.refresh_state() == 'ready'
+        cold.close()
+    
+    def test_well_known_authkey_refused(self, monkeypatch):
+        """Test that shared mode will not start without a real secret"""
+        from shared_inference import InferenceServer, load_authkey
+        
+        monkeypatch.delenv('SHARED_INFERENCE_AUTHKEY', raising=False)
+        with pytest.raises(ValueError):
+            InferenceServer()
+        monkeypatch.setenv('SHARED_INFERENCE_AUTHKEY', 'face-inference')
+        with pytest.raises(ValueError):
+            load_authkey()
+        monkeypatch.setenv('SHARED_INFERENCE_AUTHKEY', 'a1b2c3')
+        assert load_authkey() == 'a1b2c3'
+
+
+class TestPreloadServer:
+    """Test the preload-then-fork server"""
+    
+    def test_only_fork_safe_engines_warm_before_fork(self, monkeypatch):
+        """Test models load before the fork only when no runtime thread pool would cross it"""
+        assert preloads_models(FaceRecognitionService(engine="opencv-dnn"))
+        assert not preloads_models(FaceRecognitionService())
+        single = FaceRecognitionService(engine="onnxruntime", engine_options={'intra_op_threads': 1})
+        assert preloads_models(single)
+        assert not preloads_models(FaceRecognitionService(engine="onnxruntime", engine_options={'intra_op_threads': 2}))
+        
+        threads = cv2.getNumThreads()
+        monkeypatch.setattr(single, 'warmup', lambda: 1 / 0)
+        try:
+            assert preload(single) == PRELOAD_NONE
+            assert cv2.getNumThreads() == 1
+        finally:
+            cv2.setNumThreads(threads)
+    
+    def test_batcher_restarts_in_forked_child(self):
+        """Test a batcher created before a fork embeds in the child after after_fork()"""
+        import os
+        batcher = EmbeddingBatcher(lambda chips: chips.reshape(len(chips), -1)[:, :2], max_batch_size=4)
+        pid = os.fork()
+        if pid == 0:
+            batcher.after_fork()
+            ok = batcher.embed(np.ones((2, 2, 3))).tolist() == [1.0, 1.0]
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        batcher.close()
+        
+        assert os.waitstatus_to_exitcode(status) == 0
+    
+    def test_memory_ceiling_ignores_shared_pages(self):
+        """Test a forked worker's measured memory excludes pages it shares with the parent"""
+        import multiprocessing
+        import os
+        import time
+        from preload_server import worker_private_mb
+        
+        shared = np.ones(64 * 1024 * 1024 // 8)  # 64 MB, touched before the fork
+        child = multiprocessing.get_context('fork').Process(target=time.sleep, args=(30,), daemon=True)
+        child.start()
+        try:
+            time.sleep(0.5)
+            with open(f"/proc/{child.pid}/statm") as f:
+                rss_mb = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+            assert rss_mb > 64
+            assert worker_private_mb(child.pid) < 32
+        finally:
+            child.terminate()
+            child.join()
+            del shared
+        
+        assert worker_private_mb(child.pid) is None
+    
+    def test_workers_replaced_after_max_requests(self):
+        """Test forked workers serve, are replaced at their request limit, and stop on SIGTERM"""
+        import os
+        import signal
+        import socket
+        import subprocess
+        import sys
+        import time
+        import urllib.request
+        
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = subprocess.Popen(
+            [sys.executable, "preload_server.py", "--host", "127.0.0.1", "--port", str(port),
+             "--workers", "2", "--max-requests", "2", "--log-level", "warning"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env={**os.environ, 'EAGER_WARMUP': 'false', 'THREAD_PLAN': 'off'},
+            stderr=subprocess.PIPE,
+            text=True
+        )
+        try:
+            statuses, deadline = [], time.monotonic() + 30
+            while len(statuses) < 8 and time.monotonic() < deadline:
+                try:
+                    with urllib.request.urlopen(f"http://127.0.0.1:{port}/health", timeout=5) as response:
+                        statuses.append(response.status)
+                except OSError:
+                    time.sleep(0.2)
+            time.sleep(1.5)
+        finally:
+            server.send_signal(signal.SIGTERM)
+            _, log = server.communicate(timeout=30)
+        
+        assert statuses == [200] * 8
+        assert "exited; replacing it" in log
+        assert server.returncode == 0
+
+
+class TestFaceGallery:
+    """Test the vectorized 1:N gallery"""
+    
+    def test_search_matches_calculate_similarity(self, face_service):
+        """Test that ranking and distances agree with _calculate_similarity"""
+        rng = np.random.default_rng(7)
+        templates = rng.standard_normal((50, 512))
+        gallery = FaceGallery(dimension=512, initial_capacity=4)
+        for i, template in enumerate(templates):
+            gallery.add(f"user-{i}", template)
+        
+        probe = templates[17] + rng.standard_normal(512) * 0.1
+        results = gallery.search(probe, top_k=5)
+        
+        expected = sorted(
+            (face_service._calculate_similarity(probe, template), f"user-{i}")
+            for i, template in enumerate(templates)
+        )[:5]
+        assert [identity for identity, _ in results] == [identity for _, identity in expected]
+        for (_, distance), (expected_distance, _) in zip(results, expected):
+            assert abs(distance - expected_distance) < 1e-5
+    
+    def test_remove_keeps_rows_consistent(self):
+        """Test that removal moves the last row without mixing identities"""
+        gallery = FaceGallery(dimension=4)
+        gallery.add("a", [1, 0, 0, 0])
+        gallery.add("b", [0, 1, 0, 0])
+        gallery.add("c", [0, 0, 1, 0])
+        
+        assert gallery.remove("a")
+        assert not gallery.remove("a")
+        assert len(gallery) == 2
+        assert gallery.search([0, 0, 1, 0], top_k=1)[0][0] == "c"
+        assert gallery.search([0, 1, 0, 0], top_k=1)[0][0] == "b"
+    
+    def test_rejects_bad_embeddings(self):
+        """Test dimension and zero-vector validation"""
+        gallery = FaceGallery(dimension=4)
+        with pytest.raises(ValueError):
+            gallery.add("a", [1, 0, 0])
+        with pytest.raises(ValueError):
+            gallery.add("a", [0, 0, 0, 0])
+    
+    def test_persisted_gallery_syncs_between_instances(self, tmp_path):
+        """Test that workers sharing GALLERY_PATH see each other's changes"""
+        path = str(tmp_path / 'gallery.npz')
+        worker_1 = FaceGallery(dimension=4, path=path)
+        worker_2 = FaceGallery(dimension=4, path=path)
+        
+        worker_1.add("a", [1, 0, 0, 0])
+        worker_2.add("b", [0, 1, 0, 0])
+        
+        assert worker_1.search([0, 1, 0, 0], top_k=2)[0][0] == "b"
+        assert len(worker_1) == 2
+        
+        worker_1.remove("b")
+        assert "b" not in worker_2
+    
+    def test_persisted_writes_append_and_compact(self, tmp_path):
+        """Test enrollments append to the log and are folded into the snapshot"""
+        snapshot, log = tmp_path / 'gallery.npz', tmp_path / 'gallery.npz.log'
+        path = str(snapshot)
+        writer = FaceGallery(dimension=4, path=path, compact_ratio=1.0, compact_min_records=5)
+        
+        for i in range(4):
+            writer.add(f"user-{i}", [1, i, 0, 0])
+        writer.remove("user-0")
+        assert not snapshot.exists()
+        assert log.stat().st_size > 0
+        
+        reader = FaceGallery(dimension=4, path=path)
+        assert len(reader) == 3
+        assert "user-0" not in reader
+        
+        writer.add("user-9", [0, 0, 0, 1])
+        assert snapshot.exists()
+        assert log.stat().st_size == 0
+        assert reader.search([0, 0, 0, 1], top_k=1)[0][0] == "user-9"
+        assert len(FaceGallery(dimension=4, path=path)) == 4
+    
+    def test_identify_endpoint(self, monkeypatch, fake_deepface, create_textured_image):
+        """Test enrolling into the gallery and identifying without a username"""
+        from fastapi.testclient import TestClient
+        import main
+        
+        monkeypatch.setattr(main, 'face_gallery', FaceGallery(dimension=512))
+        main.face_gallery.add("someone-else", [-0.1] * 512)
+        client = TestClient(main.app)
+        
+        response = client.post(
+            "/enroll",
+            files={'image': ('face.png', create_textured_image(), 'image/png')},
+            data={'identity_id': 'alice'}
+        )
+        assert response.status_code == 200
+        
+        response = client.post(
+            "/identify",
+            files={'image': ('face.png', create_textured_image(seed=1), 'image/png')},
+            data={'top_k': '2'}
+        )
+        body = response.json()
+        assert body['gallery_size'] == 2
+        assert body['matches'][0]['identity_id'] == 'alice'
+        assert body['matches'][0]['match']
+        assert not body['matches'][1]['match']
+
+
+class TestANNIndex:
+    """Test the IVF gallery index"""
+    
+    @pytest.fixture
+    def clustered_templates(self):
+        rng = np.random.default_rng(3)
+        centers = rng.standard_normal((40, 512))
+        return centers[rng.integers(0, 40, size=2000)] + 0.5 * rng.standard_normal((2000, 512))
+    
+    def test_reranked_results_match_exact_search(self, clustered_templates):
+        """Test recall and that distances come from exact re-ranking"""
+        exact = FaceGallery(dimension=512)
+        indexed = FaceGallery(dimension=512, index=IVFIndex(n_lists=32, n_probe=4))
+        for i, template in enumerate(clustered_templates):
+            exact.add(f"user-{i}", template)
+            indexed.add(f"user-{i}", template)
+        indexed.build_index()
+        
+        rng = np.random.default_rng(4)
+        hits = 0
+        for target in rng.integers(0, len(clustered_templates), size=20):
+            probe = clustered_templates[target] + 0.2 * rng.standard_normal(512)
+            expected = exact.search(probe, top_k=5)
+            found = indexed.search(probe, top_k=5)
+            hits += len({i for i, _ in found} & {i for i, _ in expected})
+            assert found[0] == pytest.approx(expected[0])
+        
+        assert hits / (20 * 5) >= 0.9
+    
+    def test_incremental_add_and_remove(self, clustered_templates):
+        """Test that enrollments and deletions after training are searchable"""
+        gallery = FaceGallery(dimension=512, index=IVFIndex(n_lists=16, n_probe=2))
+        for i, template in enumerate(clustered_templates[:500]):
+            gallery.add(f"user-{i}", template)
+        gallery.build_index()
+        
+        newcomer = clustered_templates[1500]
+        gallery.add("newcomer", newcomer)
+        assert gallery.search(newcomer, top_k=1)[0][0] == "newcomer"
+        
+        gallery.remove("newcomer")
+        assert gallery.search(newcomer, top_k=1)[0][0] != "newcomer"
+        assert gallery.index.stats()['size'] == 500
+    
+    def test_retrain_resizes_automatic_list_count(self, clustered_templates):
+        """Test n_lists=None is re-derived from the gallery size at each train"""
+        index = IVFIndex(n_probe=2)
+        index.train(clustered_templates[:100].astype(np.float32))
+        assert index.stats()['n_lists'] == 40
+        
+        index.train(clustered_templates.astype(np.float32))
+        assert index.n_lists is None
+        assert index.stats()['n_lists'] == int(4 * np.sqrt(2000))
+    
+    def test_retrain_never_exposes_empty_index(self, clustered_templates):
+        """Test searches during a rebuild see either the old or the new index"""
+        gallery = FaceGallery(dimension=512, index=IVFIndex(n_lists=16, n_probe=16))
+        for i, template in enumerate(clustered_templates[:300]):
+            gallery.add(f"user-{i}", template)
+        gallery.build_index()
+        
+        prepare = gallery.index.prepare
+        seen_during_build = []
+        
+        def slow_prepare(vectors, ids):
+            state = prepare(vectors, ids)
+            # Searches and enrollments while the new index is being built
+            seen_during_build.append(gallery.search(clustered_templates[7], top_k=1))
+            gallery.add("late", clustered_templates[1999])
+            return state
+        
+        gallery.index.prepare = slow_prepare
+        gallery.build_index()
+        
+        assert seen_during_build[0][0][0] == "user-7"
+        assert gallery.search(clustered_templates[1999], top_k=1)[0][0] == "late"
+        assert gallery.index.stats()['size'] == 301
+    
+    def test_create_index(self):
+        """Test index selection by name"""
+        assert create_index("exact") is None
+        assert isinstance(create_index("ivf", n_probe=8), IVFIndex)
+        with pytest.raises(ValueError):
+            create_index("hnsw-typo")
+
+
+class TestEmbeddingCodec:
+    """Test the binary embedding encoding and its use on /enroll and /verify"""
+    
+    def test_round_trip(self):
+        """Test float32 is lossless and float16 is close"""
+        embedding = np.random.default_rng(0).standard_normal(512).astype(np.float32)
+        
+        payload = encode_embedding(embedding)
+        assert len(payload) == 8 + 512 * 4
+        np.testing.assert_array_equal(decode_embedding(payload, expected_dimension=512), embedding)
+        
+        half = decode_embedding(encode_embedding(embedding, dtype="float16"))
+        np.testing.assert_allclose(half, embedding, rtol=1e-3, atol=1e-3)
+    
+    def test_rejects_malformed_payloads(self):
+        """Test header, length and dimension checks"""
+        payload = encode_embedding([0.1] * 512)
+        
+        with pytest.raises(ValueError):
+            decode_embedding(b"JUNK" + payload[4:])
+        with pytest.raises(ValueError):
+            decode_embedding(payload[:-4])
+        with pytest.raises(ValueError):
+            decode_embedding(payload, expected_dimension=128)
+        with pytest.raises(ValueError):
+            decode_embedding_field("not base64!")
+    
+    def test_form_field_accepts_json_and_base64(self):
+        """Test both encodings of stored_embedding parse to the same vector"""
+        embedding = [0.25, -0.5, 0.125]
+        
+        from_json = decode_embedding_field(json.dumps(embedding))
+        from_base64 = decode_embedding_field(encode_embedding_base64(embedding))
+        
+        np.testing.assert_array_equal(from_json, from_base64)
+    
+    def test_enroll_and_verify_endpoints(self, fake_deepface, create_textured_image):
+        """Test negotiated output formats and binary input on /verify"""
+        from fastapi.testclient import TestClient
+        import main
+        client = TestClient(main.app)
+        
+        def enroll(**kwargs):
+            return client.post(
+                "/enroll",
+                files={'image': ('face.png', create_textured_image(), 'image/png')},
+                **kwargs
+            )
+        
+        body = enroll(params={'embedding_format': 'base64'}).json()
+        assert body['embedding'] is None
+        stored_b64 = body['embedding_b64']
+        
+        response = enroll(headers={'Accept': 'application/x-face-embedding'})
+        assert response.headers['content-type'] == 'application/x-face-embedding'
+        np.testing.assert_allclose(decode_embedding(response.content), [0.1] * 512, rtol=1e-6)
+        
+        assert enroll(params={'embedding_format': 'xml'}).status_code == 400
+        
+        for data, files in [
+            ({'stored_embedding': json.dumps([0.1] * 512)}, {}),
+            ({'stored_embedding': stored_b64}, {}),
+            ({}, {'stored_embedding_file': ('e.bin', response.content, 'application/x-face-embedding')})
+        ]:
+            result = client.post(
+                "/verify",
+                files={'image': ('face.png', create_textured_image(seed=1), 'image/png'), **files},
+                data=data
+            ).json()
+            assert result['match']
+            assert result['similarity_score'] == pytest.approx(0.0, abs=1e-4)
+        
+        response = client.post(
+            "/verify",
+            files={'image': ('face.png', create_textured_image(seed=1), 'image/png')},
+            data={'stored_embedding': json.dumps([0.1] * 3)}
+        )
+        assert response.status_code == 400
+
+
+class TestTemplateCache:
+    """Test the /verify template cache"""
+    
+    def test_lru_eviction_and_ttl(self, monkeypatch):
+        """Test least recently used eviction and expiry"""
+        import template_cache
+        now = [1000.0]
+        monkeypatch.setattr(template_cache.time, 'monotonic', lambda: now[0])
+        
+        cache = TemplateCache(max_entries=2, ttl_seconds=60)
+        cache.put([0.1] * 4, "a")
+        cache.put([0.2] * 4, "b")
+        assert cache.get("a") is not None
+        cache.put([0.3] * 4, "c")
+        
+        assert cache.get("b") is None
+        assert cache.stats()['evictions'] == 1
+        
+        now[0] += 61
+        assert cache.get("a") is None
+        assert cache.stats()['expirations'] == 1
+        assert cache.stats()['hits'] == 1
+        assert cache.stats()['misses'] == 2
+    
+    def test_content_hash_keys(self):
+        """Test default keys are content hashes and forged hash keys are rejected"""
+        cache = TemplateCache()
+        key = cache.put(np.array([0.1] * 4))
+        
+        assert key == template_key([0.1] * 4)
+        assert cache.get(key) is not None
+        with pytest.raises(ValueError):
+            cache.put([0.2] * 4, key)
+    
+    def test_verify_by_template_id(self, monkeypatch, fake_deepface, create_textured_image):
+        """Test a cache miss asks for the embedding and later calls send only the key"""
+        from fastapi.testclient import TestClient
+        import main
+        monkeypatch.setattr(main, 'template_cache', TemplateCache())
+        client = TestClient(main.app)
+        stored = [0.1] * 512
+        key = template_key(stored)
+        
+        def verify(data):
+            return client.post(
+                "/verify",
+                files={'image': ('face.png', create_textured_image(), 'image/png')},
+                data=data
+            ).json()
+        
+        body = verify({'template_id': key})
+        assert body['template_unknown']
+        assert not body['match']
+        
+        body = verify({'template_id': key, 'stored_embedding': json.dumps(stored)})
+        assert body['match'] and body['template_id'] == key
+        
+        body = verify({'template_id': key})
+        assert body['match'] and not body['template_unknown']
+        assert main.template_cache.stats()['hits'] == 1
+
+
+class TestResultCache:
+    """Test the image-hash result cache and in-flight coalescing"""
+    
+    def test_repeated_image_is_processed_once(self, fake_deepface, create_textured_image):
+        """Test a retry with identical bytes skips detection and embedding"""
+        service = FaceRecognitionService(result_cache_size=8)
+        image = create_textured_image()
+        
+        first = service.enroll_face(image)
+        second = service.enroll_face(image)
+        
+        assert second['embedding'] == first['embedding']
+        assert 'cache_ms' in second['timings']
+        assert [name for name, _ in fake_deepface.calls].count('represent') == 1
+        
+        service.enroll_face(create_textured_image(seed=1))
+        assert [name for name, _ in fake_deepface.calls].count('represent') == 2
+    
+    def test_concurrent_duplicates_share_one_computation(self):
+        """Test requests arriving mid-computation wait on the same future"""
+        cache = ResultCache(max_entries=8)
+        release = threading.Event()
+        calls = []
+        
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return {'embedding': [0.5] * 4, 'timings': {}}
+        
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(cache.get_or_compute("k", compute)))
+            for _ in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        while cache.coalesced.value < 3:
+            release.wait(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+        
+        assert len(calls) == 1
+        assert all(result['embedding'] == [0.5] * 4 for result in results)
+        assert cache.stats()['hit_ratio'] == 0.75
+    
+    def test_failures_are_not_cached(self):
+        """Test an exception reaches the caller and the next request recomputes"""
+        cache = ResultCache(max_entries=8)
+        
+        def fail():
+            raise FaceNotDetectedException("No face")
+        
+        with pytest.raises(FaceNotDetectedException):
+            cache.get_or_compute("k", fail)
+        result = cache.get_or_compute("k", lambda: {'embedding': [1.0], 'timings': {}})
+        
+        assert result['embedding'] == [1.0]
+        assert cache.stats()['misses'] == 2
+    
+    def test_eviction_and_memory_footprint(self):
+        """Test the LRU bound and that memory accounting follows evictions"""
+        cache = ResultCache(max_entries=2)
+        for key in ("a", "b", "c"):
+            cache.get_or_compute(key, lambda: {'embedding': [0.0] * 512, 'timings': {}})
+        
+        stats = cache.stats()
+        assert stats['size'] == 2
+        assert stats['evictions'] == 1
+        assert stats['memory_bytes'] == 2 * (512 * 8 + 1024)
+
+
 # Integration tests (require actual face images)
 class TestEndToEndWorkflow:
     """Test complete enrollment and verification workflow"""
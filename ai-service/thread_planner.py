@@ -0,0 +1,176 @@
+"""
+Thread Planner
+Splits the CPUs available to the service between its worker processes, so
+TensorFlow, OpenCV and BLAS do not each start a pool per core in every
+worker
+
+Thread counts are passed through the environment variables the libraries
+read when they initialize, so apply_thread_plan() must run before numpy,
+cv2 or TensorFlow is imported. Variables already set explicitly are left
+alone.
+"""
+
+import fcntl
+import logging
+import os
+import tempfile
+from typing import Dict, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+THREAD_PLAN_MODES = ("auto", "off")
+
+# Read by the BLAS/OpenMP runtimes numpy and TensorFlow load
+BLAS_THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+# Worker slots are claimed by locking one of these files; the lock goes
+# away with the process, so a restarted worker takes over its slot
+SLOT_LOCK_PREFIX = "face-service-cpu-slot"
+_slot_locks = []
+
+
+def cgroup_cpu_limit(root: str = CGROUP_ROOT) -> Optional[float]:
+    """
+    CPU quota of the container, in CPUs
+
+    Reads cgroup v2 cpu.max, then cgroup v1 cpu.cfs_quota_us and
+    cpu.cfs_period_us.
+
+    Returns:
+        The quota, or None when there is none
+    """
+    try:
+        with open(os.path.join(root, "cpu.max")) as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as f:
+            quota = int(f.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as f:
+            period = int(f.read())
+        return None if quota <= 0 else quota / period
+    except (OSError, ValueError):
+        return None
+
+
+def available_cpus() -> List[int]:
+    """CPUs this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def plan_threads(
+    workers: int,
+    cpus: Sequence[int],
+    cpu_quota: Optional[float] = None,
+    pin: bool = False,
+    slot: Optional[int] = None
+) -> Dict:
+    """
+    Threads per library for one worker
+
+    Usable CPUs are the affinity set, capped by the cgroup quota (rounded
+    down, at least 1), shared evenly between workers. TensorFlow splits
+    each operator over the worker's share (intra-op) and runs at most two
+    operators at once (inter-op); OpenCV and BLAS get the same share.
+
+    Args:
+        workers: Worker processes on this host
+        cpus: CPUs available to the service
+        cpu_quota: cgroup CPU quota, in CPUs
+        pin: Pin the worker to its own CPUs
+        slot: Index of this worker, for pinning
+
+    Returns:
+        The layout, as reported on /ready
+    """
+    if workers < 1:
+        raise ValueError("workers must be at least 1")
+    usable = len(cpus)
+    if cpu_quota is not None:
+        usable = max(1, min(usable, int(cpu_quota)))
+    per_worker = max(1, usable // workers)
+
+    pinned = None
+    if pin and slot is not None:
+        start = (slot * per_worker) % len(cpus)
+        pinned = [cpus[(start + offset) % len(cpus)] for offset in range(per_worker)]
+
+    return {
+        'workers': workers,
+        'cpus': len(cpus),
+        'cpu_quota': cpu_quota,
+        'threads_per_worker': per_worker,
+        'intra_op_threads': per_worker,
+        'inter_op_threads': 2 if per_worker >= 4 else 1,
+        'opencv_threads': per_worker,
+        'blas_threads': per_worker,
+        'slot': slot,
+        'pinned_cpus': pinned
+    }
+
+
+def claim_worker_slot(workers: int, lock_dir: Optional[str] = None) -> Optional[int]:
+    """
+    Take the first free worker slot
+
+    Slots are scoped to the parent process (the uvicorn or gunicorn
+    master), so separate deployments on one host do not share them.
+
+    Returns:
+        Slot index, or None when all are taken (more processes than workers)
+    """
+    lock_dir = lock_dir or tempfile.gettempdir()
+    for slot in range(workers):
+        path = os.path.join(lock_dir, f"{SLOT_LOCK_PREFIX}-{os.getppid()}-{slot}.lock")
+        handle = open(path, "a")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        # Held open for the life of the process
+        _slot_locks.append(handle)
+        return slot
+    return None
+
+
+def apply_thread_plan(workers: int, pin: bool = False, slot: Optional[int] = None) -> Dict:
+    """
+    Plan this worker's threads and apply them
+
+    Sets TF_NUM_INTRAOP_THREADS, TF_NUM_INTEROP_THREADS and the BLAS
+    variables unless already set, cv2.setNumThreads and, with pin, the CPU
+    affinity. The returned layout shows the values in effect.
+
+    Args:
+        workers: Worker processes on this host
+        pin: Pin this worker to its own CPUs
+        slot: Index of this worker when the caller knows it; otherwise a
+            free slot is claimed for pinning
+    """
+    if pin and slot is None:
+        slot = claim_worker_slot(workers)
+    if pin and slot is None:
+        logger.warning(f"No free CPU slot among {workers} workers; this process is not pinned")
+    plan = plan_threads(workers, available_cpus(), cgroup_cpu_limit(), pin, slot)
+
+    os.environ.setdefault("TF_NUM_INTRAOP_THREADS", str(plan['intra_op_threads']))
+    os.environ.setdefault("TF_NUM_INTEROP_THREADS", str(plan['inter_op_threads']))
+    for name in BLAS_THREAD_VARIABLES:
+        os.environ.setdefault(name, str(plan['blas_threads']))
+    plan['intra_op_threads'] = int(os.environ["TF_NUM_INTRAOP_THREADS"])
+    plan['inter_op_threads'] = int(os.environ["TF_NUM_INTEROP_THREADS"])
+    plan['blas_threads'] = int(os.environ["OMP_NUM_THREADS"])
+
+    import cv2
+    cv2.setNumThreads(plan['opencv_threads'])
+
+    if plan['pinned_cpus'] is not None:
+        os.sched_setaffinity(0, plan['pinned_cpus'])
+    return plan
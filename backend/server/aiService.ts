@@ -1,6 +1,7 @@
 import axios from 'axios';
 import FormData from 'form-data';
 import * as fs from 'fs';
+import { createHash } from 'crypto';
 
 interface EnrollmentResponse {
   success: boolean;
@@ -8,6 +9,7 @@ interface EnrollmentResponse {
   message: string;
   face_detected: boolean;
   quality_score?: number;
+  template_id?: string;
   timestamp: string;
 }
 
@@ -18,9 +20,18 @@ interface VerificationResponse {
   message: string;
   similarity_score?: number;
   threshold_used: number;
+  template_id?: string;
+  template_unknown?: boolean;
   timestamp: string;
 }
 
+// Same key the AI service derives: SHA-256 of the little-endian float32 values
+function templateIdFor(embedding: number[]): string {
+  const values = Float32Array.from(embedding);
+  const hash = createHash('sha256').update(Buffer.from(values.buffer)).digest('hex');
+  return `sha256:${hash}`;
+}
+
 interface HealthResponse {
   status: string;
   service: string;
@@ -34,13 +45,17 @@ export class AIService {
     this.baseUrl = process.env.AI_SERVICE_URL || 'http://localhost:8000';
   }
 
-  async enrollFace(imageData: Buffer): Promise<EnrollmentResponse> {
+  async enrollFace(imageData: Buffer, faceRoi?: string): Promise<EnrollmentResponse> {
     try {
       const form = new FormData();
       form.append('image', imageData, { 
         filename: 'face.jpg',
         contentType: 'image/jpeg'
       });
+      // Face guide box from the camera; detection searches it first
+      if (faceRoi) {
+        form.append('roi', faceRoi);
+      }
       
       const response = await axios.post(`${this.baseUrl}/enroll`, form, {
         headers: {
@@ -56,29 +71,52 @@ export class AIService {
     }
   }
 
-  async verifyFace(imageData: Buffer, storedEmbedding: number[]): Promise<VerificationResponse> {
+  async verifyFace(imageData: Buffer, storedEmbedding: number[], faceRoi?: string): Promise<VerificationResponse> {
     try {
-      const form = new FormData();
-      form.append('image', imageData, {
-        filename: 'face.jpg',
-        contentType: 'image/jpeg'
-      });
-      form.append('stored_embedding', JSON.stringify(storedEmbedding));
+      // Send only the template key; the AI service asks for the embedding
+      // when it has not cached it yet
+      const templateId = templateIdFor(storedEmbedding);
+      let result = await this.postVerify(imageData, templateId, faceRoi);
+      if (result.template_unknown) {
+        result = await this.postVerify(imageData, templateId, faceRoi, storedEmbedding);
+      }
       
-      const response = await axios.post(`${this.baseUrl}/verify`, form, {
-        headers: {
-          ...form.getHeaders(),
-        },
-        timeout: 15000, // 15 second timeout for face processing
-      });
-      
-      return response.data;
+      return result;
     } catch (error: any) {
       console.error('AI Service verification error:', error.response?.data || error.message);
       throw new Error(`Face verification failed: ${error.response?.data?.message || error.message || error}`);
     }
   }
 
+  private async postVerify(
+    imageData: Buffer,
+    templateId: string,
+    faceRoi?: string,
+    storedEmbedding?: number[]
+  ): Promise<VerificationResponse> {
+    const form = new FormData();
+    form.append('image', imageData, {
+      filename: 'face.jpg',
+      contentType: 'image/jpeg'
+    });
+    form.append('template_id', templateId);
+    if (faceRoi) {
+      form.append('roi', faceRoi);
+    }
+    if (storedEmbedding) {
+      form.append('stored_embedding', JSON.stringify(storedEmbedding));
+    }
+    
+    const response = await axios.post(`${this.baseUrl}/verify`, form, {
+      headers: {
+        ...form.getHeaders(),
+      },
+      timeout: 15000, // 15 second timeout for face processing
+    });
+    
+    return response.data;
+  }
+
   async healthCheck(): Promise<HealthResponse> {
     try {
       const response = await axios.get(`${this.baseUrl}/health`, {
@@ -99,7 +99,7 @@ export async function registerRoutes(
   app.post(api.face.enroll.path, async (req, res) => {
     if (!req.session.userId) return res.status(401).json({ message: "Unauthorized" });
     
-    const { userId } = api.face.enroll.input.parse(req.body);
+    const { userId, faceRoi } = api.face.enroll.input.parse(req.body);
     
     // Check if the user has permission to enroll their face
     if (req.session.userId !== userId) {
@@ -118,7 +118,7 @@ export async function registerRoutes(
       const imageBuffer = Buffer.from(faceImageBase64, 'base64');
       
       // Process the face image with AI service
-      const enrollmentResult = await aiService.enrollFace(imageBuffer);
+      const enrollmentResult = await aiService.enrollFace(imageBuffer, faceRoi);
       
       if (!enrollmentResult.success || !enrollmentResult.embedding) {
         return res.status(400).json({ message: enrollmentResult.message });
@@ -142,7 +142,7 @@ export async function registerRoutes(
   app.post(api.attendance.mark.path, async (req, res) => {
     if (!req.session.userId) return res.status(401).json({ message: "Unauthorized" });
     
-    const { lat, lng, faceEmbedding } = api.attendance.mark.input.parse(req.body);
+    const { lat, lng, faceEmbedding, faceRoi } = api.attendance.mark.input.parse(req.body);
     const userId = req.session.userId;
     const ip = req.ip;
 
@@ -199,7 +199,7 @@ export async function registerRoutes(
         return res.status(400).json({ message: "Face embedding must be a base64 string" });
       }
       
-      const verificationResult = await aiService.verifyFace(imageBuffer, storedEmbedding);
+      const verificationResult = await aiService.verifyFace(imageBuffer, storedEmbedding, faceRoi);
       
       if (!verificationResult.match) {
         await storage.logSuspicious({
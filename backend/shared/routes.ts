@@ -32,7 +32,7 @@ export const api = {
     enroll: {
       method: 'POST' as const,
       path: '/api/face/enroll',
-      input: z.object({ userId: z.number(), embedding: z.any() }),
+      input: z.object({ userId: z.number(), embedding: z.any(), faceRoi: z.string().optional() }),
       responses: {
         200: users,
         400: z.object({ message: z.string() }),
@@ -43,7 +43,7 @@ export const api = {
     mark: {
       method: 'POST' as const,
       path: '/api/attendance/mark',
-      input: z.object({ lat: z.number(), lng: z.number(), faceEmbedding: z.any() }),
+      input: z.object({ lat: z.number(), lng: z.number(), faceEmbedding: z.any(), faceRoi: z.string().optional() }),
       responses: {
         200: z.object({ status: z.string(), message: z.string().optional(), record: attendance.optional() }),
         400: z.object({ message: z.string() }),
@@ -4,13 +4,32 @@ import { Button } from '@/components/ui/button';
 import { cn } from '@/lib/utils';
 
 interface CameraProps {
-  onCapture: (imageData: string) => void;
+  onCapture: (imageData: string, faceRoi?: string) => void;
   onError?: (error: string) => void;
   showFaceGuide?: boolean;
   disabled?: boolean;
   className?: string;
 }
 
+// Face guide box as "x,y,w,h" fractions of the captured frame. The video is
+// shown with object-cover, so part of the frame may be cropped off screen;
+// the capture is mirrored like the preview, so no flip is needed.
+function guideRoi(video: HTMLVideoElement, guide: HTMLDivElement | null): string | undefined {
+  if (!guide || !video.videoWidth || !video.videoHeight) return undefined;
+
+  const view = video.getBoundingClientRect();
+  const box = guide.getBoundingClientRect();
+  const scale = Math.max(view.width / video.videoWidth, view.height / video.videoHeight);
+  const offsetX = (view.width - video.videoWidth * scale) / 2;
+  const offsetY = (view.height - video.videoHeight * scale) / 2;
+
+  const x = (box.left - view.left - offsetX) / scale / video.videoWidth;
+  const y = (box.top - view.top - offsetY) / scale / video.videoHeight;
+  const w = box.width / scale / video.videoWidth;
+  const h = box.height / scale / video.videoHeight;
+  return [x, y, w, h].map(value => value.toFixed(4)).join(',');
+}
+
 export const Camera: React.FC<CameraProps> = ({
   onCapture,
   onError,
@@ -20,6 +39,7 @@ export const Camera: React.FC<CameraProps> = ({
 }) => {
   const videoRef = useRef<HTMLVideoElement>(null);
   const canvasRef = useRef<HTMLCanvasElement>(null);
+  const guideRef = useRef<HTMLDivElement>(null);
   const streamRef = useRef<MediaStream | null>(null);
   
   const [isStreaming, setIsStreaming] = useState(false);
@@ -104,7 +124,7 @@ export const Camera: React.FC<CameraProps> = ({
     
     const imageData = canvas.toDataURL('image/jpeg', 0.9);
     setCapturedImage(imageData);
-    onCapture(imageData);
+    onCapture(imageData, guideRoi(video, guideRef.current));
     stopCamera();
   }, [facingMode, onCapture, stopCamera]);
 
@@ -183,7 +203,7 @@ export const Camera: React.FC<CameraProps> = ({
         {isStreaming && !error && (
           <>
             <div className="camera-overlay" />
-            {showFaceGuide && <div className="face-guide animate-pulse-glow" />}
+            {showFaceGuide && <div ref={guideRef} className="face-guide animate-pulse-glow" />}
           </>
         )}
       </div>
@@ -152,12 +152,13 @@ export const authApi = {
 
 // Face API
 export const faceApi = {
-  enrollFace: async (userId: number, imageData: string): Promise<{ success: boolean; message: string; quality_score?: number }> => {
+  enrollFace: async (userId: number, imageData: string, faceRoi?: string): Promise<{ success: boolean; message: string; quality_score?: number }> => {
     const response = await apiRequest('/api/face/enroll', {
       method: 'POST',
       body: JSON.stringify({ 
         userId,
-        faceImage: imageData // Send as base64 string
+        faceImage: imageData, // Send as base64 string
+        faceRoi // Face guide box, lets the AI service search there first
       }),
     });
 
@@ -173,13 +174,14 @@ export const faceApi = {
 
 // Attendance API
 export const attendanceApi = {
-  markAttendance: async (lat: number, lng: number, imageData: string): Promise<{ status: string; record: AttendanceRecord; confidence?: number }> => {
+  markAttendance: async (lat: number, lng: number, imageData: string, faceRoi?: string): Promise<{ status: string; record: AttendanceRecord; confidence?: number }> => {
     const response = await apiRequest('/api/attendance/mark', {
       method: 'POST',
       body: JSON.stringify({ 
         lat, 
         lng, 
-        faceEmbedding: imageData // Send image as base64 string
+        faceEmbedding: imageData, // Send image as base64 string
+        faceRoi // Face guide box, lets the AI service search there first
       }),
     });
 
@@ -15,12 +15,12 @@ export const FaceEnrollmentPage: React.FC = () => {
   const [capturedImage, setCapturedImage] = useState<string | null>(null);
   const [errorMessage, setErrorMessage] = useState<string>('');
 
-  const handleCapture = async (imageData: string) => {
+  const handleCapture = async (imageData: string, faceRoi?: string) => {
     setCapturedImage(imageData);
     setStep('processing');
     
     try {
-      const result = await faceApi.enrollFace(user?.id || 0, imageData);
+      const result = await faceApi.enrollFace(user?.id || 0, imageData, faceRoi);
       if (result.success) {
         // Update user to reflect that they now have an enrolled face
         updateUser({ faceEmbedding: [] }); // Update with empty array as placeholder
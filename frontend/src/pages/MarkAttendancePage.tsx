@@ -39,7 +39,7 @@ export const MarkAttendancePage: React.FC = () => {
     day: 'numeric',
   });
 
-  const handleCapture = async (imageData: string) => {
+  const handleCapture = async (imageData: string, faceRoi?: string) => {
     setStep('processing');
     
     try {
@@ -48,7 +48,7 @@ export const MarkAttendancePage: React.FC = () => {
       const lat = 37.7749; // Mock latitude
       const lng = -122.4194; // Mock longitude
       
-      const result = await attendanceApi.markAttendance(lat, lng, imageData);
+      const result = await attendanceApi.markAttendance(lat, lng, imageData, faceRoi);
       setRecord(result.record);
       setConfidence(result.confidence || 0);
       